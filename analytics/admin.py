@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel
+from .models import (
+    Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel, ObservationDailyRollup, MetricValue,
+    DashboardUsage
+)
 
 
 @admin.register(Dashboard)
@@ -38,7 +41,10 @@ class ReportAdmin(admin.ModelAdmin):
     list_display = ['name', 'template', 'created_by', 'status', 'format', 'date_from', 'date_to', 'created_at']
     list_filter = ['status', 'format', 'created_at', 'date_from']
     search_fields = ['name', 'created_by__username', 'template__name']
-    readonly_fields = ['created_at', 'updated_at', 'generated_at', 'generation_time']
+    readonly_fields = [
+        'created_at', 'updated_at', 'generated_at', 'generation_time',
+        'attempts', 'next_attempt_at', 'started_at', 'error_message'
+    ]
     ordering = ['-created_at']
     list_per_page = 25
     date_hierarchy = 'created_at'
@@ -58,7 +64,7 @@ class ReportAdmin(admin.ModelAdmin):
             'fields': ('status', 'file')
         }),
         ('Generation Info', {
-            'fields': ('generated_at', 'generation_time'),
+            'fields': ('generated_at', 'generation_time', 'attempts', 'next_attempt_at', 'started_at', 'error_message'),
             'classes': ('collapse',)
         }),
         ('Metadata', {
@@ -150,3 +156,38 @@ class ForecastModelAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(ObservationDailyRollup)
+class ObservationDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['day', 'coefficient', 'outlet', 'data_source_type', 'row_count', 'value_count', 'value_sum', 'value_min', 'value_max']
+    list_filter = ['data_source_type', 'day']
+    search_fields = ['coefficient__code', 'outlet__name']
+    readonly_fields = ['updated_at']
+    raw_id_fields = ['coefficient', 'outlet']
+    ordering = ['-day']
+    list_per_page = 25
+    date_hierarchy = 'day'
+
+
+@admin.register(MetricValue)
+class MetricValueAdmin(admin.ModelAdmin):
+    list_display = ['metric', 'level', 'entity_id', 'period', 'period_start', 'value', 'observation_count', 'computed_at']
+    list_filter = ['level', 'period', 'period_start']
+    search_fields = ['metric__code', 'metric__name']
+    readonly_fields = ['computed_at']
+    raw_id_fields = ['metric']
+    ordering = ['-period_start']
+    list_per_page = 25
+    date_hierarchy = 'period_start'
+
+
+@admin.register(DashboardUsage)
+class DashboardUsageAdmin(admin.ModelAdmin):
+    list_display = ['dashboard', 'view', 'preset', 'hits', 'last_used_at', 'last_warmed_at']
+    list_filter = ['view', 'last_used_at']
+    search_fields = ['dashboard__name', 'dashboard__code', 'preset__name']
+    readonly_fields = ['params_hash', 'hits', 'last_used_at', 'last_warmed_at']
+    raw_id_fields = ['dashboard', 'preset']
+    ordering = ['-hits']
+    list_per_page = 25
@@ -4,7 +4,7 @@ API URLs for ANALYTICS app
 from rest_framework.routers import DefaultRouter
 from .api_views import (
     DashboardViewSet, ReportViewSet, ReportTemplateViewSet,
-    FilterPresetViewSet, ForecastModelViewSet
+    FilterPresetViewSet, ForecastModelViewSet, MetricValueViewSet
 )
 
 router = DefaultRouter()
@@ -13,5 +13,6 @@ router.register(r'reports', ReportViewSet, basename='report')
 router.register(r'report-templates', ReportTemplateViewSet, basename='reporttemplate')
 router.register(r'filter-presets', FilterPresetViewSet, basename='filterpreset')
 router.register(r'forecast-models', ForecastModelViewSet, basename='forecastmodel')
+router.register(r'metric-values', MetricValueViewSet, basename='metricvalue')
 
 urlpatterns = router.urls
@@ -1,14 +1,24 @@
 """
 DRF ViewSets for ANALYTICS app
 """
-from rest_framework import viewsets, filters
-from rest_framework.permissions import IsAuthenticated
+import hashlib
+import json
+
+from rest_framework import viewsets, filters, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.reverse import reverse
+from django.utils.cache import patch_cache_control
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel
+from . import cache_warmer, forecasting, metrics, periods, report_queue, sql_reports, widget_cache, widgets as widgets_engine
+
+from .models import Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel, MetricValue
 from .serializers import (
     DashboardSerializer, ReportSerializer, ReportTemplateSerializer,
-    FilterPresetSerializer, ForecastModelSerializer
+    FilterPresetSerializer, ForecastModelSerializer, MetricValueSerializer
 )
 
 
@@ -23,6 +33,106 @@ class DashboardViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'created_at', 'level_order']
     ordering = ['name']
 
+    @action(detail=False, methods=['get'], url_path='cache-stats')
+    def cache_stats(self, request):
+        """Счетчики попаданий/промахов кэша виджетов и итог последнего прогрева"""
+        return Response({**widget_cache.stats(), 'warmup': cache_warmer.last_run(), 'shared_cache': cache_warmer.shared_cache()})
+
+    @action(detail=True, methods=['get'])
+    def layout(self, request, pk=None):
+        """
+        Раскладка виджетов дашборда без вычисления данных.
+        Данные каждого виджета загружаются отдельно по его url (см. widget_data).
+        """
+        dashboard = self.get_object()
+        layout = []
+        for index, config in enumerate(dashboard_widget_configs(dashboard)):
+            kind = widgets_engine.widget_kind(config)
+            if kind is None:
+                continue
+            layout.append({
+                'index': index,
+                'kind': kind,
+                'type': config.get('type'),
+                'title': config.get('title', ''),
+                'url': reverse('dashboard-widget-data', kwargs={'pk': dashboard.pk, 'index': index}, request=request),
+            })
+        return Response({
+            'dashboard': dashboard.pk,
+            'name': dashboard.name,
+            'refresh_interval': dashboard.refresh_interval,
+            'widgets': layout,
+        })
+
+    @action(detail=True, methods=['get'], url_path=r'widgets/(?P<index>\d+)')
+    def widget_data(self, request, pk=None, index=None):
+        """
+        Данные одного виджета с фильтрами из query-параметров
+        (period, date_from, date_to, country...outlet, data_type, attr_<код>).
+        Ответ кэшируется на Dashboard.refresh_interval и отдается с ETag.
+        """
+        dashboard = self.get_object()
+        configs = dashboard_widget_configs(dashboard)
+        index = int(index)
+        if index >= len(configs) or widgets_engine.widget_kind(configs[index]) is None:
+            raise NotFound('Виджет не найден')
+
+        try:
+            filters = dashboard_filters(request.query_params)
+        except ValueError:
+            raise ValidationError({'date_from': 'Ожидается дата в формате YYYY-MM-DD'})
+
+        result = widgets_engine.evaluate_widgets([configs[index]], filters, dashboard=dashboard)[0]
+
+        etag = '"%s"' % hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response({'index': index, **result})
+        response['ETag'] = etag
+        if result.get('type') in ('error', 'pending') or not dashboard.refresh_interval:
+            patch_cache_control(response, private=True, no_cache=True)
+        else:
+            patch_cache_control(response, private=True, max_age=dashboard.refresh_interval * 60)
+        return response
+
+
+def dashboard_widget_configs(dashboard):
+    """Конфигурации виджетов дашборда (widgets_config может храниться строкой)"""
+    config = dashboard.widgets_config or {}
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except ValueError:
+            config = {}
+    return config.get('widgets', []) if isinstance(config, dict) else []
+
+
+def _id_list(value):
+    """Список id из строки "1,2,3" (пустая строка - None)"""
+    if not value:
+        return None
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+def dashboard_filters(params):
+    """Фильтры виджетов из query-параметров API"""
+    period = params.get('period', 'month')
+    date_from, date_to = periods.period_bounds(period, params.get('date_from'), params.get('date_to'))
+
+    filters = {
+        'period': period,
+        'date_from': date_from,
+        'date_to': date_to,
+        'data_type': params.get('data_type', 'MON'),
+        'attributes': {
+            key[5:]: value for key, value in params.items() if key.startswith('attr_') and value
+        },
+    }
+    for level in ('country', 'region', 'city', 'district', 'channel', 'outlet'):
+        filters[level] = params.get(level) or None
+    return filters
+
 
 class ReportViewSet(viewsets.ModelViewSet):
     """ViewSet for Report model"""
@@ -35,6 +145,22 @@ class ReportViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'generated_at']
     ordering = ['-created_at']
 
+    def perform_create(self, serializer):
+        report = serializer.save()
+        report_queue.enqueue(report)
+
+    @action(detail=True, methods=['post'])
+    def generate(self, request, pk=None):
+        """Поставить отчет в очередь на генерацию (формирует воркер run_report_worker)"""
+        report = self.get_object()
+        report_queue.enqueue(report)
+        return Response(report_queue.status(report), status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def generation_status(self, request, pk=None):
+        """Статус генерации отчета для опроса"""
+        return Response(report_queue.status(self.get_object()))
+
 
 class ReportTemplateViewSet(viewsets.ModelViewSet):
     """ViewSet for ReportTemplate model"""
@@ -47,6 +173,23 @@ class ReportTemplateViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'category', 'created_at']
     ordering = ['category', 'name']
 
+    @action(detail=True, methods=['get'], permission_classes=[IsAdminUser])
+    def sql(self, request, pk=None):
+        """
+        Результат SQL запроса шаблона с фильтрами из query-параметров
+        (period, date_from, date_to, country...outlet, data_type). Только для персонала.
+        """
+        template = self.get_object()
+        try:
+            filters = dashboard_filters(request.query_params)
+        except ValueError:
+            raise ValidationError({'date_from': 'Ожидается дата в формате YYYY-MM-DD'})
+        try:
+            result = sql_reports.execute(template, filters)
+        except sql_reports.SqlQueryError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(result)
+
 
 class FilterPresetViewSet(viewsets.ModelViewSet):
     """ViewSet for FilterPreset model"""
@@ -70,3 +213,64 @@ class ForecastModelViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'code', 'description']
     ordering_fields = ['name', 'created_at', 'trained_at']
     ordering = ['name']
+
+    @action(detail=True, methods=['post'])
+    def train(self, request, pk=None):
+        """Обучить модель для всех ее метрик и узлов гео-иерархии"""
+        model = self.get_object()
+        try:
+            forecasting.train(model)
+        except forecasting.ForecastError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(self.get_serializer(model).data)
+
+    @action(detail=True, methods=['get'])
+    def forecast(self, request, pk=None):
+        """
+        Прогноз обученной модели для набора рядов за один запрос.
+        Параметры: metric (id через запятую), level, entity_id (id через запятую), steps (число периодов).
+        """
+        model = self.get_object()
+        try:
+            metric_ids = _id_list(request.query_params.get('metric'))
+            entity_ids = _id_list(request.query_params.get('entity_id'))
+            steps = int(request.query_params.get('steps') or 0) or None
+        except ValueError:
+            raise ValidationError({'detail': 'Некорректные параметры запроса'})
+        if steps is not None and not 0 < steps <= forecasting.MAX_STEPS:
+            raise ValidationError({'detail': f'steps должен быть от 1 до {forecasting.MAX_STEPS}'})
+
+        try:
+            result = forecasting.forecast_rows(
+                model, metric_ids=metric_ids, level=request.query_params.get('level'),
+                entity_ids=entity_ids, steps=steps,
+            )
+        except forecasting.ForecastError as e:
+            raise ValidationError({'detail': str(e)})
+        return Response(result)
+
+
+class MetricValueViewSet(viewsets.ReadOnlyModelViewSet):
+    """Материализованные значения метрик (KPI) по узлам гео-иерархии и периодам"""
+    queryset = MetricValue.objects.select_related('metric').all()
+    serializer_class = MetricValueSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_fields = {
+        'metric': ['exact'],
+        'metric__code': ['exact', 'in'],
+        'level': ['exact'],
+        'entity_id': ['exact', 'in'],
+        'period': ['exact'],
+        'period_start': ['exact', 'gte', 'lte'],
+    }
+    ordering_fields = ['period_start', 'value', 'observation_count']
+    ordering = ['metric', 'level', 'entity_id', 'period_start']
+
+    @action(detail=False, methods=['get'])
+    def pending(self, request):
+        """
+        Размер очереди пересчета метрик. Сам пересчет выполняет
+        python manage.py materialize_metrics по расписанию, а не запрос.
+        """
+        return Response(metrics.queue_stats())
@@ -0,0 +1,273 @@
+"""
+Прогрев кэша виджетов для популярных дашбордов и наборов фильтров
+
+Страницы дашбордов записывают просмотры в DashboardUsage: дашборд, страница
+(обычный / мультиуровневый), параметры фильтров и набор фильтров (?preset=<id>).
+Прогреватель берет самые просматриваемые за ANALYTICS_CACHE_WARM_USAGE_DAYS дней
+виды, строит фильтры так же, как страница, и заранее считает виджеты в кэш
+(analytics.widget_cache) - первый утренний просмотр получает готовый результат.
+
+- Запуск: по расписанию (python manage.py warm_dashboard_cache, cron) и в фоне
+  после массовой загрузки данных (rollup.deferred_refresh, rollup.rebuild),
+  не чаще раза в ANALYTICS_CACHE_WARM_MIN_INTERVAL секунд.
+- Бюджет цикла: ANALYTICS_CACHE_WARM_TIME_BUDGET секунд и
+  ANALYTICS_CACHE_WARM_CPU_BUDGET секунд процессорного времени - виды,
+  не уместившиеся в бюджет, пропускаются до следующего цикла.
+- Записи живут Dashboard.refresh_interval минут, поэтому расписание прогрева
+  должно быть не реже интервала обновления в часы перед началом работы.
+- Итог цикла (доля виджетов, найденных в кэше до и после прогрева) сохраняется
+  в кэше и выводится командой; запросы прогревателя не влияют на статистику
+  попаданий кэша виджетов (widget_cache.stats()).
+
+Ограничение: прогрев имеет смысл только с общим для процессов бэкендом кэша
+(Redis, Memcached, БД, файлы). С LocMemCache (настройка по умолчанию) кэш
+живет внутри процесса: команда warm_dashboard_cache прогревала бы собственный
+кэш, который пропадает при ее завершении, поэтому она отказывается работать
+(shared_cache()). Фоновый прогрев после загрузки данных с LocMemCache
+прогревает только кэш того веб-процесса, в котором прошла загрузка.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import widget_cache, widgets
+from .models import DashboardUsage
+
+KEY_PREFIX = 'analytics:warmup'
+LAST_RUN_KEY = f'{KEY_PREFIX}:last'
+SCHEDULE_KEY = f'{KEY_PREFIX}:scheduled'
+
+# Параметры страниц дашбордов, от которых зависят фильтры виджетов
+PARAM_KEYS = {
+    'period', 'date_from', 'date_to', 'data_type',
+    'country', 'region', 'city', 'district', 'channel', 'outlet',
+    'level', 'entity_id', 'scope_level', 'scope',
+}
+
+
+def max_targets():
+    return getattr(settings, 'ANALYTICS_CACHE_WARM_TARGETS', 50)
+
+
+def usage_days():
+    return getattr(settings, 'ANALYTICS_CACHE_WARM_USAGE_DAYS', 14)
+
+
+def time_budget():
+    return getattr(settings, 'ANALYTICS_CACHE_WARM_TIME_BUDGET', 120)
+
+
+def cpu_budget():
+    return getattr(settings, 'ANALYTICS_CACHE_WARM_CPU_BUDGET', 60)
+
+
+def min_interval():
+    return getattr(settings, 'ANALYTICS_CACHE_WARM_MIN_INTERVAL', 5 * 60)
+
+
+# Бэкенды, кэш которых не виден другим процессам (или не хранится вовсе)
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache():
+    """Кэш виджетов общий для процессов (прогрев отдельным процессом виден веб-процессам)"""
+    return settings.CACHES.get('default', {}).get('BACKEND') not in PROCESS_LOCAL_BACKENDS
+
+
+# ============================================================================
+# Учет просмотров
+# ============================================================================
+
+def clean_params(params):
+    """Параметры просмотра, влияющие на фильтры (период "custom" - вместе с датами)"""
+    cleaned = {
+        key: str(value) for key, value in params.items()
+        if (key in PARAM_KEYS or key.startswith('attr_')) and value not in (None, '')
+    }
+    if cleaned.get('period', 'month') != 'custom':
+        cleaned.pop('date_from', None)
+        cleaned.pop('date_to', None)
+    return cleaned
+
+
+def preset_params(preset):
+    """Фильтры набора (FilterPreset.filters) в виде GET параметров дашборда"""
+    filters = preset.filters if isinstance(preset.filters, dict) else {}
+    params = {
+        key: str(value) for key, value in filters.items()
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool)
+    }
+    attributes = filters.get('attributes')
+    if isinstance(attributes, dict):
+        params.update({f'attr_{code}': str(value) for code, value in attributes.items() if value})
+    if 'date_from' in params and 'period' not in params:
+        params['period'] = 'custom'
+    return params
+
+
+def record_usage(dashboard, view, params, preset=None):
+    """Учесть просмотр дашборда с параметрами (для дашбордов без кэша не учитывается)"""
+    if not dashboard.refresh_interval:
+        return
+    params = clean_params(params)
+    params_hash = hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+    now = timezone.now()
+
+    usage = DashboardUsage.objects.filter(dashboard=dashboard, view=view, params_hash=params_hash)
+    if usage.update(hits=F('hits') + 1, last_used_at=now, preset=preset):
+        return
+    try:
+        with transaction.atomic():
+            DashboardUsage.objects.create(
+                dashboard=dashboard, view=view, params=params, params_hash=params_hash,
+                preset=preset, hits=1, last_used_at=now,
+            )
+    except IntegrityError:
+        # Параллельный первый просмотр с теми же параметрами уже создал запись
+        usage.update(hits=F('hits') + 1, last_used_at=now)
+
+
+# ============================================================================
+# Прогрев
+# ============================================================================
+
+def build_filters(view, params):
+    """Фильтры виджетов так же, как их строит страница дашборда"""
+    from .views import dashboard_detail_filters, multilevel_filters
+
+    if view == DashboardUsage.VIEW_MULTILEVEL:
+        return multilevel_filters(params)
+    return dashboard_detail_filters(params)
+
+
+def targets(limit=None):
+    """Самые просматриваемые виды дашбордов с включенным кэшем"""
+    return list(
+        DashboardUsage.objects.select_related('dashboard').filter(
+            last_used_at__gte=timezone.now() - timedelta(days=usage_days()),
+            dashboard__is_active=True,
+            dashboard__refresh_interval__gt=0,
+        ).order_by('-hits', '-last_used_at')[:limit or max_targets()]
+    )
+
+
+def warm_target(usage):
+    """Посчитать недостающие в кэше виджеты вида. Возвращает (виджетов, было в кэше, посчитано, ошибок)."""
+    from .api_views import dashboard_widget_configs
+
+    configs = dashboard_widget_configs(usage.dashboard)
+    indexes = [index for index, config in enumerate(configs) if widgets.widget_kind(config) is not None]
+    if not indexes:
+        return 0, 0, 0, 0
+
+    filters = build_filters(usage.view, usage.params)
+    lookup = widget_cache.WidgetCacheLookup(usage.dashboard, configs, filters, track_stats=False)
+    pending = [index for index in indexes if index not in lookup.hits]
+
+    computed = dict(zip(pending, widgets.compute_widgets([configs[index] for index in pending], filters)))
+    lookup.store(computed)
+
+    errors = sum(1 for result in computed.values() if result is not None and result.get('type') == 'error')
+    return len(indexes), len(indexes) - len(pending), len(pending) - errors, errors
+
+
+def warm(limit=None, budget=None, cpu=None):
+    """
+    Цикл прогрева: популярные виды по убыванию просмотров, пока не исчерпан бюджет.
+    Возвращает итог цикла (он же сохраняется в кэше, см. last_run()).
+    """
+    budget = time_budget() if budget is None else budget
+    cpu = cpu_budget() if cpu is None else cpu
+    started, cpu_started = time.monotonic(), time.thread_time()
+
+    usages = targets(limit)
+    report = {
+        'targets': len(usages), 'warmed_targets': 0, 'skipped_targets': 0, 'failed_targets': 0,
+        'widgets': 0, 'cached_before': 0, 'warmed': 0, 'errors': 0,
+    }
+    warmed_ids = []
+    for position, usage in enumerate(usages):
+        if time.monotonic() - started >= budget or time.thread_time() - cpu_started >= cpu:
+            report['skipped_targets'] = len(usages) - position
+            break
+        try:
+            total, cached, warmed, errors = warm_target(usage)
+        except (ValueError, TypeError):
+            # Параметры просмотра больше не разбираются (например, некорректная дата)
+            report['failed_targets'] += 1
+            continue
+        report['widgets'] += total
+        report['cached_before'] += cached
+        report['warmed'] += warmed
+        report['errors'] += errors
+        report['warmed_targets'] += 1
+        warmed_ids.append(usage.pk)
+
+    now = timezone.now()
+    DashboardUsage.objects.filter(pk__in=warmed_ids).update(last_warmed_at=now)
+
+    widgets_total = report['widgets']
+    report.update({
+        'hit_ratio_before': round(report['cached_before'] / widgets_total, 4) if widgets_total else None,
+        'hit_ratio': round((report['cached_before'] + report['warmed']) / widgets_total, 4) if widgets_total else None,
+        'elapsed': round(time.monotonic() - started, 3),
+        'cpu_time': round(time.thread_time() - cpu_started, 3),
+        'finished_at': now.isoformat(),
+    })
+    cache.set(LAST_RUN_KEY, report, timeout=None)
+    return report
+
+
+def last_run():
+    """Итог последнего цикла прогрева (None - прогрева еще не было)"""
+    return cache.get(LAST_RUN_KEY)
+
+
+# ============================================================================
+# Прогрев в фоне после загрузки данных
+# ============================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Один поток на процесс: циклы прогрева не выполняются параллельно"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics-warmup')
+    return _executor
+
+
+def _warm_in_thread():
+    try:
+        return warm()
+    finally:
+        # У каждого потока свое соединение с БД - не оставлять его открытым в пуле
+        connections.close_all()
+
+
+def warm_in_background():
+    """
+    Запустить цикл прогрева в фоне (после массовой загрузки данных).
+    Не чаще раза в ANALYTICS_CACHE_WARM_MIN_INTERVAL секунд; 0 - прогрев после загрузки отключен.
+    Возвращает True, если цикл запланирован.
+    """
+    if not min_interval() or not cache.add(SCHEDULE_KEY, time.time_ns(), timeout=min_interval()):
+        return False
+    # Прогрев должен видеть загруженные данные, поэтому стартует после коммита транзакции
+    transaction.on_commit(lambda: get_executor().submit(_warm_in_thread))
+    return True
@@ -0,0 +1,546 @@
+"""
+Выгрузка отчетов в CSV и Excel
+
+CSV отдается генератором через StreamingHttpResponse: первые байты
+уходят клиенту сразу, а в памяти держится только текущая пачка строк, а не
+весь файл. Выгрузка наблюдений читает БД итератором (на PostgreSQL - через
+серверный курсор), поэтому память не растет с числом строк.
+
+Excel пишется книгой openpyxl в режиме write-only: строки сразу уходят
+во временный файл, числа остаются числами, ширина колонок оценивается
+по первым строкам листа, а длинные секции продолжаются на следующих листах.
+Большие отчеты (ANALYTICS_REPORT_EXCEL_INLINE_ROWS строк таблиц) формируются
+в фоне - воркером очереди отчетов или фоновым пулом процесса - и отдаются
+готовым файлом из хранилища.
+
+PDF отрисовывается WeasyPrint в фоновом пуле и хранится в Report.file под
+ключом содержимого отчета и версии HTML-шаблона; пока отчет не изменился,
+скачивания отдают сохраненный файл (с ETag для условных запросов).
+"""
+import csv
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.template.loader import get_template, render_to_string
+from django.utils import timezone
+
+from . import widgets
+from .models import Report
+
+# BOM для правильного отображения кириллицы в Excel
+BOM = '\ufeff'
+
+# Сколько строк CSV собирать в одну пачку ответа
+CSV_CHUNK_ROWS = 500
+
+# Сколько наблюдений читать из БД за один запрос курсора
+OBSERVATION_CHUNK_SIZE = 2000
+
+# Колонки выгрузки наблюдений: (заголовок, поле)
+OBSERVATION_COLUMNS = [
+    ('ID', 'id'),
+    ('Дата визита', 'local_date'),
+    ('Визит', 'visit_id'),
+    ('Код точки', 'visit__outlet__code'),
+    ('Точка', 'visit__outlet__name'),
+    ('Код коэффициента', 'coefficient__code'),
+    ('Коэффициент', 'coefficient__name'),
+    ('Артикул', 'product__sku_code'),
+    ('Товар', 'product__name'),
+    ('Тип данных', 'data_source_type'),
+    ('Числовое значение', 'value_numeric'),
+    ('Текстовое значение', 'value_text'),
+    ('Да/Нет', 'value_boolean'),
+]
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: writerow() возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(rows, bom=True):
+    """Строки (списки значений) → пачки текста CSV для StreamingHttpResponse"""
+    writer = csv.writer(Echo())
+    if bom:
+        yield BOM
+    chunk = []
+    for row in rows:
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= CSV_CHUNK_ROWS:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+def filename(report, extension, suffix=''):
+    return f'report_{report.pk}{suffix}_{timezone.now().strftime("%Y%m%d_%H%M")}.{extension}'
+
+
+# ============================================================================
+# Секции отчета
+# ============================================================================
+
+def section_title(key):
+    return key.replace('_', ' ').title()
+
+
+def report_metrics(result):
+    """Метрики результата отчета: [{'title', 'value', 'unit'}]"""
+    metrics = []
+    for section_key, section_data in result.items():
+        if isinstance(section_data, dict) and 'value' in section_data:
+            metrics.append({
+                'title': section_title(section_key),
+                'value': section_data.get('value', section_data),
+                'unit': section_data.get('unit', '')
+            })
+        elif isinstance(section_data, (int, float)):
+            metrics.append({
+                'title': section_title(section_key),
+                'value': section_data,
+                'unit': ''
+            })
+    return metrics
+
+
+def report_tables(result):
+    """Таблицы результата отчета: [(заголовок, строки)]"""
+    return [
+        (section_title(section_key), section_data)
+        for section_key, section_data in result.items()
+        if isinstance(section_data, list) and len(section_data) > 0
+    ]
+
+
+def report_result(report):
+    result = report.result
+    return result if isinstance(result, dict) else {}
+
+
+def report_rows(report):
+    """Строки CSV отчета: шапка, метрики, затем таблицы секций со своими заголовками"""
+    result = report_result(report)
+
+    yield [report.name]
+    yield [report.description or '']
+    yield [f"Дата создания: {report.created_at.strftime('%d.%m.%Y %H:%M')}"]
+    yield [f"Статус: {report.get_status_display()}"]
+    yield []
+
+    metrics = report_metrics(result)
+    if metrics:
+        yield ['МЕТРИКИ']
+        for metric in metrics:
+            yield [metric['title'], f"{metric['value']} {metric['unit']}"]
+        yield []
+
+    for title, rows in report_tables(result):
+        yield [title]
+        headers = list(rows[0].keys())
+        yield [header.title() for header in headers]
+        for row in rows:
+            yield [row.get(header) for header in headers]
+        yield []
+
+
+# ============================================================================
+# Наблюдения
+# ============================================================================
+
+def observation_rows(filters):
+    """Строки CSV всех наблюдений под фильтрами отчета (с заголовком), в порядке id"""
+    yield [header for header, _ in OBSERVATION_COLUMNS]
+
+    queryset = widgets.filter_observations(filters).order_by('id').values_list(
+        *[field for _, field in OBSERVATION_COLUMNS]
+    )
+    for row in queryset.iterator(chunk_size=OBSERVATION_CHUNK_SIZE):
+        yield ['' if value is None else value for value in row]
+
+
+# ============================================================================
+# Excel
+# ============================================================================
+
+EXCEL_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Строк на лист (предел Excel - 1 048 576); длинные секции продолжаются на следующем листе
+EXCEL_MAX_ROWS = 1000000
+
+# Ширина колонок оценивается по первым строкам листа
+EXCEL_WIDTH_SAMPLE = 200
+EXCEL_MAX_WIDTH = 50
+
+# Файлы больших отчетов, сформированные в фоне
+EXCEL_DIRECTORY = 'reports/xlsx'
+
+
+def excel_inline_rows():
+    """Сколько строк таблиц отчета формировать прямо в запросе; больше - в фоне"""
+    return getattr(settings, 'ANALYTICS_REPORT_EXCEL_INLINE_ROWS', 50000)
+
+
+def excel_value(value):
+    """Значение ячейки: числа, даты и булевы остаются типизированными, остальное - строкой"""
+    if value is None or isinstance(value, (bool, int, float, Decimal, date)):
+        if isinstance(value, datetime) and timezone.is_aware(value):
+            return timezone.localtime(value).replace(tzinfo=None)
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+class _ExcelSheets:
+    """
+    Запись строк в книгу write-only: строки сразу уходят во временный файл openpyxl.
+    Первые EXCEL_WIDTH_SAMPLE строк листа буферизуются для оценки ширины колонок
+    (ее нужно задать до первой записи). При переполнении листа создается следующий,
+    и на нем повторяются заголовок и шапка текущей секции.
+    """
+
+    def __init__(self, workbook, title, styles):
+        from openpyxl.cell import WriteOnlyCell
+
+        self.workbook = workbook
+        self.title = title
+        self.styles = styles
+        self.cell_class = WriteOnlyCell
+        self.sheet = None
+        self.sheet_count = 0
+        self.row_count = 0
+        self.buffer = None
+        self.repeat = []
+
+    def _new_sheet(self):
+        self.flush()
+        self.sheet_count += 1
+        title = self.title if self.sheet_count == 1 else f'{self.title} ({self.sheet_count})'
+        self.sheet = self.workbook.create_sheet(title[:31])
+        self.row_count = 0
+        self.buffer = []
+        for values, style in self.repeat:
+            self.append(values, style)
+
+    def section(self, title, headers=None):
+        """Начать секцию: заголовок и шапка таблицы повторяются на следующих листах"""
+        self.repeat = []
+        self.append([title], 'section')
+        if headers:
+            self.append(headers, 'header')
+        self.repeat = [([f'{title} (продолжение)'], 'section')] + ([(headers, 'header')] if headers else [])
+
+    def append(self, values, style=None):
+        if self.sheet is None or self.row_count >= EXCEL_MAX_ROWS:
+            self._new_sheet()
+        self.row_count += 1
+        if self.buffer is not None:
+            self.buffer.append((values, style))
+            if len(self.buffer) >= EXCEL_WIDTH_SAMPLE:
+                self.flush()
+        else:
+            self._write(values, style)
+
+    def _write(self, values, style):
+        if style is None:
+            self.sheet.append([excel_value(value) for value in values])
+            return
+        font, fill, alignment = self.styles[style]
+        cells = []
+        for value in values:
+            cell = self.cell_class(self.sheet, value=excel_value(value))
+            cell.font = font
+            if fill is not None:
+                cell.fill = fill
+            if alignment is not None:
+                cell.alignment = alignment
+            cells.append(cell)
+        self.sheet.append(cells)
+
+    def flush(self):
+        """Задать ширину колонок по буферу первых строк и записать их"""
+        if not self.buffer:
+            self.buffer = None
+            return
+        from openpyxl.utils import get_column_letter
+
+        widths = {}
+        for values, style in self.buffer:
+            # Заголовки отчета и секций - в одной ячейке, ширину колонки A по ним не считаем
+            if style in ('title', 'subtitle', 'note', 'section'):
+                continue
+            for index, value in enumerate(values, start=1):
+                if value is not None:
+                    widths[index] = max(widths.get(index, 0), len(str(excel_value(value))))
+        for index, width in widths.items():
+            self.sheet.column_dimensions[get_column_letter(index)].width = min(width + 2, EXCEL_MAX_WIDTH)
+
+        buffer, self.buffer = self.buffer, None
+        for values, style in buffer:
+            self._write(values, style)
+
+
+def write_excel(report, output):
+    """Записать отчет в книгу Excel (write-only, постоянная память) в файл или файловый объект output"""
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, PatternFill, Alignment
+
+    section_fill = PatternFill(start_color='CCCCCC', end_color='CCCCCC', fill_type='solid')
+    styles = {
+        'title': (Font(size=16, bold=True), None, None),
+        'subtitle': (Font(size=11, italic=True), None, None),
+        'note': (Font(), None, None),
+        'section': (Font(bold=True, size=14), section_fill, None),
+        'header': (
+            Font(bold=True),
+            PatternFill(start_color='DDDDDD', end_color='DDDDDD', fill_type='solid'),
+            Alignment(horizontal='center'),
+        ),
+    }
+
+    workbook = Workbook(write_only=True)
+    sheets = _ExcelSheets(workbook, 'Report', styles)
+    result = report_result(report)
+
+    sheets.append([report.name], 'title')
+    sheets.append([report.description or ''], 'subtitle')
+    sheets.append([f"Дата создания: {report.created_at.strftime('%d.%m.%Y %H:%M')}"], 'note')
+    sheets.append([f"Статус: {report.get_status_display()}"], 'note')
+    sheets.append([])
+
+    metrics = report_metrics(result)
+    if metrics:
+        sheets.section('МЕТРИКИ')
+        for metric in metrics:
+            # Значение - числом, единица измерения - в соседней колонке
+            sheets.append([metric['title'], metric['value'], metric['unit'] or None])
+        sheets.append([])
+        sheets.append([])
+
+    for title, rows in report_tables(result):
+        headers = list(rows[0].keys())
+        sheets.section(title, [header.title() for header in headers])
+        for row in rows:
+            sheets.append([row.get(header) for header in headers])
+        sheets.append([])
+        sheets.append([])
+
+    sheets.flush()
+    workbook.save(output)
+
+
+def table_row_count(report):
+    return sum(len(rows) for _, rows in report_tables(report_result(report)))
+
+
+def excel_name(report):
+    """Имя файла Excel в хранилище: меняется при любом изменении отчета"""
+    return f'{EXCEL_DIRECTORY}/{report.pk}/report_{report.pk}_{report.updated_at:%Y%m%d%H%M%S%f}.xlsx'
+
+
+def stored_excel(report):
+    """Имя сформированного файла Excel текущей версии отчета или None"""
+    name = excel_name(report)
+    return name if default_storage.exists(name) else None
+
+
+def render_excel(report):
+    """Сформировать файл Excel в хранилище (старые версии файла удаляются). Возвращает имя файла."""
+    name = excel_name(report)
+    directory = f'{EXCEL_DIRECTORY}/{report.pk}'
+    with tempfile.TemporaryFile() as output:
+        write_excel(report, output)
+        output.seek(0)
+        if not default_storage.exists(name):
+            name = default_storage.save(name, File(output))
+
+    try:
+        _, files = default_storage.listdir(directory)
+    except (FileNotFoundError, NotImplementedError):
+        files = []
+    for file_name in files:
+        if f'{directory}/{file_name}' != name:
+            default_storage.delete(f'{directory}/{file_name}')
+    return name
+
+
+def render_excel_async(report):
+    """Поставить формирование файла Excel в фоновый пул процесса (повторный вызов не дублирует работу)"""
+    return run_in_background(f'analytics:excel:{excel_name(report)}', _render_stored, render_excel, report.pk)
+
+
+# ============================================================================
+# PDF
+# ============================================================================
+
+PDF_TEMPLATE = 'analytics/report_pdf.html'
+
+
+def pdf_wait():
+    """Сколько секунд запрос ждет фоновой отрисовки PDF, прежде чем попросить повторить скачивание"""
+    return getattr(settings, 'ANALYTICS_REPORT_PDF_WAIT', 10)
+
+
+_template_version = None
+
+
+def template_version():
+    """Версия HTML-шаблона PDF (хэш исходника): правка шаблона делает старые PDF неактуальными"""
+    global _template_version
+    if _template_version is None:
+        source = get_template(PDF_TEMPLATE).template.source
+        _template_version = hashlib.sha256(source.encode()).hexdigest()[:12]
+    return _template_version
+
+
+def pdf_key(report):
+    """Ключ PDF по содержимому отчета и версии шаблона"""
+    payload = json.dumps([
+        report_result(report), report.name, report.description, report.status,
+        report.created_at.isoformat(),
+        report.template.name if report.template_id else None,
+        report.created_by.get_full_name() or report.created_by.username,
+        template_version(),
+    ], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:20]
+
+
+def _pdf_basename(report, key=''):
+    return f'report_{report.pk}_{key}'
+
+
+def is_generated_pdf(report):
+    """Хранится ли в Report.file сформированный PDF (а не загруженный пользователем файл)"""
+    if not report.file:
+        return False
+    basename = os.path.basename(report.file.name)
+    return basename.startswith(_pdf_basename(report)) and basename.endswith('.pdf')
+
+
+def stored_pdf(report, key=None):
+    """Сформированный PDF текущей версии отчета (FieldFile) или None"""
+    key = key or pdf_key(report)
+    if not is_generated_pdf(report) or os.path.basename(report.file.name) != f'{_pdf_basename(report, key)}.pdf':
+        return None
+    return report.file if report.file.storage.exists(report.file.name) else None
+
+
+def pdf_context(report):
+    """Контекст шаблона PDF: метрики и таблицы результата отчета"""
+    result = report_result(report)
+    tables = [{'title': title, 'data': rows} for title, rows in report_tables(result)]
+    metrics = []
+    for section_key, section_data in result.items():
+        if isinstance(section_data, dict):
+            # Графики в PDF не выводятся
+            if 'value' in section_data or not ('labels' in section_data and 'values' in section_data):
+                metrics.append({
+                    'title': section_title(section_key),
+                    'value': section_data.get('value', section_data),
+                    'unit': section_data.get('unit', '')
+                })
+        elif isinstance(section_data, (int, float)):
+            metrics.append({'title': section_title(section_key), 'value': section_data, 'unit': ''})
+    return {
+        'report': report,
+        'tables': tables,
+        'metrics': metrics,
+        'generated_at': timezone.now(),
+    }
+
+
+def render_pdf(report):
+    """
+    Отрисовать PDF (WeasyPrint) и сохранить в Report.file под ключом содержимого.
+    Предыдущий сформированный PDF удаляется. Возвращает имя файла.
+    """
+    from weasyprint import HTML
+
+    key = pdf_key(report)
+    html = render_to_string(PDF_TEMPLATE, pdf_context(report))
+    pdf = HTML(string=html, base_url=str(settings.BASE_DIR)).write_pdf()
+
+    previous = report.file.name if is_generated_pdf(report) else None
+    storage = report.file.storage
+    name = storage.save(report.file.field.generate_filename(report, f'{_pdf_basename(report, key)}.pdf'), ContentFile(pdf))
+    # Без save(): updated_at отчета не меняется, ключи других выгрузок остаются актуальными
+    Report.objects.filter(pk=report.pk).update(file=name)
+    report.file.name = name
+    if previous and previous != name:
+        storage.delete(previous)
+    return name
+
+
+def render_pdf_async(report):
+    """Поставить отрисовку PDF в фоновый пул процесса. Future или None, если PDF уже отрисовывается."""
+    return run_in_background(f'analytics:pdf:{report.pk}:{pdf_key(report)}', _render_stored, render_pdf, report.pk)
+
+
+def discard_pdf(report):
+    """Удалить сформированный PDF (отчет перегенерируется). Возвращает True, если файл был."""
+    if not is_generated_pdf(report):
+        return False
+    report.file.delete(save=False)
+    return True
+
+
+# ============================================================================
+# Фоновый пул
+# ============================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Общий пул потоков выгрузок: ограничивает число одновременных отрисовок на процесс"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ANALYTICS_REPORT_RENDER_WORKERS', 2),
+                thread_name_prefix='analytics-exports'
+            )
+    return _executor
+
+
+def run_in_background(lock_key, function, *args):
+    """
+    Выполнить function(*args) в фоновом пуле. Блокировка в кэше не дает запустить
+    ту же работу второй раз (в том числе из другого процесса), пока первая не закончится.
+    Возвращает Future или None, если работа уже выполняется.
+    """
+    if not cache.add(lock_key, True, timeout=60 * 60):
+        return None
+    return get_executor().submit(_run_locked, lock_key, function, args)
+
+
+def _run_locked(lock_key, function, args):
+    try:
+        return function(*args)
+    finally:
+        cache.delete(lock_key)
+        # У каждого потока свое соединение с БД - не оставлять его открытым в пуле
+        connections.close_all()
+
+
+def _render_stored(render, report_id):
+    """Отрисовать файл актуальной версии отчета (отчет перечитывается в потоке пула)"""
+    report = Report.objects.select_related('template', 'created_by').filter(pk=report_id).first()
+    return render(report) if report is not None else None
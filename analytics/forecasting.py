@@ -0,0 +1,350 @@
+"""
+Прогнозирование метрик (ForecastModel)
+
+Модель обучается сразу для всех своих метрик и всех узлов гео-иерархии:
+история берется из материализованных значений (MetricValue, analytics.metrics)
+одним запросом и раскладывается в матрицу ряд × период (пропуски - NaN),
+а метод прогноза применяется ко всей матрице массивами NumPy.
+
+Методы (ForecastModel.model_type):
+- linear - линейный тренд (МНК по известным точкам ряда);
+- moving_average - среднее последних window известных значений;
+- exponential - простое экспоненциальное сглаживание с коэффициентом alpha.
+
+Параметры каждого ряда сводятся к паре (уровень, тренд): прогноз на h
+периодов вперед - уровень + тренд × h. Ключи рядов, история и параметры
+хранятся сжатыми массивами в ForecastModel.fitted_arrays, в training_data -
+только сводка обучения. Точность (training_score) - 1 - sMAPE / 2 прогноза
+последнего периода истории по модели, обученной без него (1 - точный прогноз).
+
+ForecastModel.parameters:
+- period - период рядов (day / week / month / quarter), по умолчанию первый
+  из settings.ANALYTICS_METRIC_PERIODS;
+- levels - уровни иерархии, по умолчанию все;
+- history - сколько последних периодов брать в историю (по умолчанию 24);
+- window - окно скользящего среднего (по умолчанию 3);
+- alpha - коэффициент сглаживания (0..1, по умолчанию 0.3).
+"""
+import io
+import math
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+from django.db.models import Max
+from django.utils import timezone
+
+from coefficients import formulas
+from geo import closure
+from . import metrics, periods
+from .models import ForecastModel, MetricValue
+
+LEVELS = closure.LEVEL_NAMES
+
+DEFAULT_HISTORY = 24
+DEFAULT_WINDOW = 3
+DEFAULT_ALPHA = 0.3
+MAX_STEPS = 366
+
+# Примерная длина периода в днях - для перевода горизонта (дни) в число периодов
+PERIOD_DAYS = {
+    'day': 1,
+    'week': 7,
+    'month': 30,
+    'quarter': 91,
+}
+
+
+class ForecastError(ValueError):
+    """Модель нельзя обучить или применить"""
+
+
+# ============================================================================
+# Методы прогноза над матрицей рядов
+# ============================================================================
+
+def fit_linear(history):
+    """Линейный тренд каждого ряда: (уровень в последнем периоде, наклон)"""
+    mask = ~np.isnan(history)
+    x = np.where(mask, np.arange(history.shape[1], dtype=float), 0.0)
+    y = np.where(mask, history, 0.0)
+    n = mask.sum(axis=1).astype(float)
+    sx, sy = x.sum(axis=1), y.sum(axis=1)
+    sxx, sxy = (x * x).sum(axis=1), (x * y).sum(axis=1)
+
+    # Одна точка - горизонтальный тренд
+    slope = np.nan_to_num(formulas.divide(n * sxy - sx * sy, n * sxx - sx * sx))
+    intercept = formulas.divide(sy - slope * sx, n)
+    return np.column_stack([intercept + slope * (history.shape[1] - 1), slope])
+
+
+def fit_moving_average(history, window=DEFAULT_WINDOW):
+    """Среднее последних window известных значений каждого ряда, тренд - 0"""
+    mask = ~np.isnan(history)
+    # Номер известного значения с конца ряда: 1 - последнее
+    rank = np.cumsum(mask[:, ::-1], axis=1)[:, ::-1]
+    taken = mask & (rank <= window)
+    level = formulas.divide(np.where(taken, history, 0.0).sum(axis=1), taken.sum(axis=1))
+    return np.column_stack([level, np.zeros(len(history))])
+
+
+def fit_exponential(history, alpha=DEFAULT_ALPHA):
+    """Простое экспоненциальное сглаживание: уровень после последнего известного значения, тренд - 0"""
+    level = np.full(len(history), np.nan)
+    for column in history.T:
+        known = ~np.isnan(column)
+        smoothed = np.where(np.isnan(level), column, alpha * column + (1 - alpha) * level)
+        level = np.where(known, smoothed, level)
+    return np.column_stack([level, np.zeros(len(history))])
+
+
+def fit(model_type, history, options=None):
+    """Параметры (уровень, тренд) всех рядов матрицы history методом model_type"""
+    options = options or {}
+    if model_type == ForecastModel.MODEL_TYPE_LINEAR:
+        return fit_linear(history)
+    if model_type == ForecastModel.MODEL_TYPE_MOVING_AVERAGE:
+        return fit_moving_average(history, int(options.get('window') or DEFAULT_WINDOW))
+    if model_type == ForecastModel.MODEL_TYPE_EXPONENTIAL:
+        return fit_exponential(history, float(options.get('alpha', DEFAULT_ALPHA)))
+    raise ForecastError(f'Тип модели не поддерживается: {model_type}')
+
+
+def project(params, steps):
+    """Прогноз на steps периодов вперед: матрица ряд × шаг"""
+    return params[:, :1] + params[:, 1:] * np.arange(1, steps + 1, dtype=float)
+
+
+def holdout_score(model_type, history, options=None):
+    """1 - sMAPE / 2 прогноза последнего периода по модели без него; None - нечего проверять"""
+    if history.shape[1] < 2:
+        return None
+    actual = history[:, -1]
+    predicted = project(fit(model_type, history[:, :-1], options), 1)[:, 0]
+    checked = ~np.isnan(actual) & ~np.isnan(predicted)
+    if not checked.any():
+        return None
+    actual, predicted = actual[checked], predicted[checked]
+    errors = np.nan_to_num(formulas.divide(2 * np.abs(predicted - actual), np.abs(actual) + np.abs(predicted)))
+    return float(1 - errors.mean() / 2)
+
+
+# ============================================================================
+# Обучение
+# ============================================================================
+
+def _number(options, key, default, cast):
+    """Числовой параметр модели (ForecastError - значение не число)"""
+    value = options.get(key)
+    if value in (None, ''):
+        return default
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise ForecastError(f'{key} должен быть числом, получено: {value!r}')
+
+
+def _options(model):
+    options = dict(model.parameters or {})
+    period = options.get('period') or metrics.metric_periods()[0]
+    if period not in PERIOD_DAYS:
+        raise ForecastError(f'Неизвестный период: {period}')
+    levels = options.get('levels') or LEVELS
+    if not isinstance(levels, (list, tuple)):
+        raise ForecastError('levels должен быть списком уровней')
+    unknown = set(levels) - set(LEVELS)
+    if unknown:
+        raise ForecastError(f'Неизвестные уровни: {", ".join(sorted(map(str, unknown)))}')
+    alpha = _number(options, 'alpha', DEFAULT_ALPHA, float)
+    if not 0 < alpha <= 1:
+        raise ForecastError('alpha должен быть в диапазоне (0, 1]')
+    history = _number(options, 'history', DEFAULT_HISTORY, int)
+    window = _number(options, 'window', DEFAULT_WINDOW, int)
+    if history < 1 or window < 1:
+        raise ForecastError('history и window должны быть положительными')
+    options.update(period=period, levels=list(levels), alpha=alpha, history=history, window=window)
+    return options
+
+
+def _history_starts(metric_ids, options):
+    """Сетка последних периодов истории, заканчивающаяся последним рассчитанным периодом"""
+    last = MetricValue.objects.filter(
+        metric_id__in=metric_ids, period=options['period'], level__in=options['levels']
+    ).aggregate(last=Max('period_start'))['last']
+    if last is None:
+        return []
+    starts = [last]
+    while len(starts) < options['history']:
+        starts.append(periods.period_start(starts[-1] - timedelta(days=1), options['period']))
+    return starts[::-1]
+
+
+def load_history(metric_ids, options):
+    """
+    История всех рядов одним запросом.
+    Возвращает (ключи int64 [id метрики, номер уровня, id узла], матрица ряд × период, начала периодов).
+    """
+    starts = _history_starts(metric_ids, options)
+    if not starts:
+        return np.empty((0, 3), dtype=np.int64), np.empty((0, 0)), []
+
+    rows = MetricValue.objects.filter(
+        metric_id__in=metric_ids, period=options['period'], level__in=options['levels'],
+        period_start__gte=starts[0], value__isnull=False,
+    ).values_list('metric_id', 'level', 'entity_id', 'period_start', 'value').order_by()
+
+    columns = {start: position for position, start in enumerate(starts)}
+    level_numbers = {level: number for number, level in enumerate(LEVELS)}
+    series = {}
+    positions, values = [], []
+    for metric_id, level, entity_id, start, value in rows.iterator(chunk_size=5000):
+        column = columns.get(start)
+        if column is None:
+            continue
+        row = series.setdefault((metric_id, level_numbers[level], entity_id), len(series))
+        positions.append((row, column))
+        values.append(value)
+
+    history = np.full((len(series), len(starts)), np.nan)
+    if positions:
+        rows_index, columns_index = np.array(positions).T
+        history[rows_index, columns_index] = values
+    keys = np.array(list(series), dtype=np.int64).reshape(-1, 3)
+
+    # Периоды до первого известного значения не хранятся
+    first = int(np.argmax(~np.isnan(history).all(axis=0))) if len(keys) else 0
+    return keys, history[:, first:], starts[first:]
+
+
+def _pack(**arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def train(model):
+    """Обучить модель для всех ее метрик и узлов. Возвращает сводку обучения (training_data)."""
+    options = _options(model)
+    if model.model_type not in (
+        ForecastModel.MODEL_TYPE_LINEAR, ForecastModel.MODEL_TYPE_MOVING_AVERAGE, ForecastModel.MODEL_TYPE_EXPONENTIAL
+    ):
+        raise ForecastError(f'Тип модели не поддерживается: {model.get_model_type_display()}')
+    metric_ids = list(model.metrics.values_list('id', flat=True))
+    if not metric_ids:
+        raise ForecastError('У модели нет метрик')
+
+    keys, history, starts = load_history(metric_ids, options)
+    if not len(keys):
+        raise ForecastError('Нет рассчитанных значений метрик для обучения (materialize_metrics)')
+
+    params = fit(model.model_type, history, options)
+    fitted_arrays = _pack(
+        keys=keys,
+        history=history.astype(np.float32),
+        params=params,
+        starts=np.array([start.toordinal() for start in starts], dtype=np.int32),
+    )
+
+    model.fitted_arrays = fitted_arrays
+    model.training_score = holdout_score(model.model_type, history, options)
+    model.training_data = {
+        'period': options['period'],
+        'levels': options['levels'],
+        'series': len(keys),
+        'periods': len(starts),
+        'first_period': starts[0].isoformat(),
+        'last_period': starts[-1].isoformat(),
+        'values': int((~np.isnan(history)).sum()),
+        'size': len(fitted_arrays),
+    }
+    model.status = ForecastModel.STATUS_ACTIVE
+    model.trained_at = timezone.now()
+    model.save(update_fields=[
+        'fitted_arrays', 'training_score', 'training_data', 'status', 'trained_at', 'updated_at'
+    ])
+    return model.training_data
+
+
+# ============================================================================
+# Применение
+# ============================================================================
+
+class FittedModel:
+    """Обученные массивы модели: keys, history, params, starts (даты начала периодов)"""
+
+    def __init__(self, period, keys, history, params, starts):
+        self.period = period
+        self.keys = keys
+        self.history = history
+        self.params = params
+        self.starts = starts
+
+    def future_starts(self, steps):
+        starts = [periods.next_period(self.starts[-1], self.period)]
+        while len(starts) < steps:
+            starts.append(periods.next_period(starts[-1], self.period))
+        return starts
+
+
+_fitted = {}
+_fitted_lock = threading.Lock()
+
+
+def fitted(model):
+    """Обученные массивы модели (кэш по id и дате обучения)"""
+    if not model.fitted_arrays or not model.trained_at:
+        raise ForecastError(f'Модель {model.code} не обучена')
+
+    key = (model.pk, model.trained_at)
+    with _fitted_lock:
+        entry = _fitted.get(model.pk)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    with np.load(io.BytesIO(bytes(model.fitted_arrays))) as arrays:
+        result = FittedModel(
+            (model.training_data or {}).get('period') or metrics.metric_periods()[0],
+            arrays['keys'], arrays['history'], arrays['params'],
+            [date.fromordinal(int(day)) for day in arrays['starts']],
+        )
+    with _fitted_lock:
+        _fitted[model.pk] = (key, result)
+    return result
+
+
+def horizon_steps(model, period):
+    """Горизонт модели (дни) в периодах"""
+    return max(1, math.ceil(model.forecast_horizon / PERIOD_DAYS[period]))
+
+
+def forecast(model, metric_ids=None, level=None, entity_ids=None, steps=None):
+    """
+    Прогноз выбранных рядов модели на горизонт (по умолчанию - forecast_horizon).
+    Возвращает (начала будущих периодов, ключи рядов, матрица ряд × шаг); NaN - прогноза нет.
+    """
+    data = fitted(model)
+    selected = np.ones(len(data.keys), dtype=bool)
+    if metric_ids:
+        selected &= np.isin(data.keys[:, 0], list(metric_ids))
+    if level:
+        if level not in LEVELS:
+            raise ForecastError(f'Неизвестный уровень: {level}')
+        selected &= data.keys[:, 1] == LEVELS.index(level)
+    if entity_ids:
+        selected &= np.isin(data.keys[:, 2], list(entity_ids))
+
+    steps = steps or horizon_steps(model, data.period)
+    return data.future_starts(steps), data.keys[selected], project(data.params[selected], steps)
+
+
+def forecast_rows(model, **kwargs):
+    """Прогноз в виде строк для API: {'periods': [...], 'series': [{metric, level, entity_id, values}]}"""
+    starts, keys, values = forecast(model, **kwargs)
+    return {
+        'period': fitted(model).period,
+        'periods': [start.isoformat() for start in starts],
+        'series': [
+            {'metric': int(metric_id), 'level': LEVELS[level], 'entity_id': int(entity_id), 'values': formulas.to_values(row, 4)}
+            for (metric_id, level, entity_id), row in zip(keys.tolist(), values)
+        ],
+    }
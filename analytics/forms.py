@@ -1,4 +1,5 @@
 from django import forms
+from . import sql_reports
 from .models import Dashboard, Report, ReportTemplate, FilterPreset
 
 
@@ -149,6 +150,25 @@ class ReportTemplateForm(forms.ModelForm):
             }),
         }
 
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        self.fields['sql_query'].help_text = (
+            'Только SELECT. Параметры: ' + ', '.join(f':{name}' for name in sql_reports.PARAMETERS)
+        )
+
+    def clean_sql_query(self):
+        sql_query = self.cleaned_data['sql_query']
+        if not sql_query.strip() or sql_query == (self.instance.sql_query or ''):
+            return sql_query
+        if self.user is not None and not self.user.is_staff:
+            raise forms.ValidationError('SQL запрос шаблона может задавать только администратор')
+        try:
+            sql_reports.validate(sql_query)
+        except sql_reports.SqlQueryError as e:
+            raise forms.ValidationError(str(e))
+        return sql_query
+
 
 class FilterPresetForm(forms.ModelForm):
     """Form for FilterPreset model"""
@@ -0,0 +1,48 @@
+"""
+Management command для выполнения правил агрегации (Rule) за период
+
+Каждое правило считается одним сгруппированным запросом для всех уровней
+гео-иерархии (см. analytics.rules).
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from analytics import periods, rules
+
+
+class Command(BaseCommand):
+    help = 'Выполнить активные правила агрегации за период для всех уровней гео-иерархии'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--period',
+            default='month',
+            choices=list(periods.PERIOD_LIMITS),
+            help='Период: day / week / month / quarter (по умолчанию month)'
+        )
+        parser.add_argument(
+            '--date',
+            help='Дата внутри периода (YYYY-MM-DD), по умолчанию - сегодня'
+        )
+
+    def handle(self, *args, **options):
+        period = options['period']
+        if options['date']:
+            try:
+                day = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError(f'Неверный формат даты: {options["date"]} (ожидается YYYY-MM-DD)')
+        else:
+            day = timezone.localdate()
+        start = periods.period_start(day, period)
+
+        self.stdout.write(f'Выполняем правила агрегации за {periods.period_label(start, period, long=True)}...')
+        results = rules.execute_all(period, start)
+        for code, result in results.items():
+            counts = ', '.join(
+                f'{level}: {len(result.for_level(level))}' for level in rules.LEVELS if result.for_level(level)
+            )
+            self.stdout.write(f'  {code} ({result.rule.get_aggregation_method_display()}): {counts or "нет данных"}')
+        self.stdout.write(self.style.SUCCESS(f'Готово: выполнено правил - {len(results)}'))
@@ -0,0 +1,68 @@
+"""
+Management command для материализации значений метрик (MetricValue)
+
+По умолчанию - инкрементальный пересчет по очереди изменений (запускать по расписанию,
+например cron каждые 15 минут). --full - полный пересчет за диапазон дат, нужен
+для первоначального заполнения, после rebuild_rollup и после изменения формул метрик.
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import metrics
+
+
+class Command(BaseCommand):
+    help = 'Рассчитать значения метрик по точкам, уровням гео-иерархии и периодам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Полный пересчет вместо инкрементального'
+        )
+        parser.add_argument(
+            '--date-from',
+            help='Начальная дата полного пересчета (YYYY-MM-DD), по умолчанию - с начала данных'
+        )
+        parser.add_argument(
+            '--date-to',
+            help='Конечная дата полного пересчета (YYYY-MM-DD), по умолчанию - до конца данных'
+        )
+        parser.add_argument(
+            '--metric',
+            action='append',
+            help='Код метрики для полного пересчета (можно указать несколько раз), по умолчанию - все активные'
+        )
+
+    def handle(self, *args, **options):
+        if options['metric'] and not options['full']:
+            raise CommandError('--metric используется только с --full: очередь изменений общая для всех метрик')
+
+        selected = None
+        if options['metric']:
+            selected = metrics.active_metrics().filter(code__in=options['metric'])
+            missing = set(options['metric']) - set(selected.values_list('code', flat=True))
+            if missing:
+                raise CommandError(f'Активные метрики не найдены: {", ".join(sorted(missing))}')
+
+        if options['full']:
+            date_from = self.parse_date(options['date_from'])
+            date_to = self.parse_date(options['date_to'])
+            self.stdout.write('Полный пересчет метрик...')
+            count = metrics.materialize(date_from=date_from, date_to=date_to, metrics=selected)
+            self.stdout.write(self.style.SUCCESS(f'Готово: записано {count} значений'))
+        else:
+            self.stdout.write('Пересчет метрик по очереди изменений...')
+            touched, count = metrics.materialize_pending()
+            self.stdout.write(self.style.SUCCESS(
+                f'Готово: обработано {touched} дней точек, записано {count} значений'
+            ))
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Неверный формат даты: {value} (ожидается YYYY-MM-DD)')
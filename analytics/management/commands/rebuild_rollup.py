@@ -0,0 +1,41 @@
+"""
+Management command для перестроения дневного куба наблюдений (ObservationDailyRollup)
+
+Нужна после массовой загрузки данных в обход сигналов (bulk_create, QuerySet.update,
+импорт через SQL) и для первоначального заполнения куба.
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import rollup
+
+
+class Command(BaseCommand):
+    help = 'Перестроить дневной куб наблюдений для дашбордов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--date-from',
+            help='Начальная дата (YYYY-MM-DD), по умолчанию - с начала данных'
+        )
+        parser.add_argument(
+            '--date-to',
+            help='Конечная дата (YYYY-MM-DD), по умолчанию - до конца данных'
+        )
+
+    def handle(self, *args, **options):
+        date_from = self.parse_date(options['date_from'])
+        date_to = self.parse_date(options['date_to'])
+
+        self.stdout.write('Перестраиваем дневной куб наблюдений...')
+        cells = rollup.rebuild(date_from=date_from, date_to=date_to)
+        self.stdout.write(self.style.SUCCESS(f'Готово: записано {cells} ячеек'))
+
+    def parse_date(self, value):
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'Неверный формат даты: {value} (ожидается YYYY-MM-DD)')
@@ -0,0 +1,82 @@
+"""
+Management command - воркер очереди генерации отчетов
+
+Забирает отчеты со статусом pending и формирует их в пуле потоков
+(см. analytics.report_queue). Запускается постоянным процессом рядом
+с веб-сервером; --once - обработать текущую очередь и завершиться (cron).
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from analytics import report_queue
+
+
+def _process(report_id):
+    try:
+        return report_id, report_queue.process(report_id)
+    finally:
+        # У каждого потока свое соединение с БД - не оставлять его открытым в пуле
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Формировать отчеты из очереди генерации'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=report_queue.worker_threads(),
+            help='Количество отчетов, формируемых воркером одновременно (по умолчанию ANALYTICS_REPORT_WORKERS)'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Пауза между проверками пустой очереди, секунд (по умолчанию 5)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться'
+        )
+
+    def handle(self, *args, **options):
+        threads = max(options['threads'], 1)
+        self.stdout.write(f'Воркер отчетов запущен: потоков - {threads}')
+
+        running = set()
+        with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='analytics-reports') as executor:
+            while True:
+                running = self._collect(running)
+                if report_queue.requeue_stale():
+                    self.stdout.write(self.style.WARNING('Зависшие отчеты возвращены в очередь'))
+
+                claimed = report_queue.claim(threads - len(running))
+                for report_id in claimed:
+                    running.add(executor.submit(_process, report_id))
+
+                if options['once'] and not claimed and not running:
+                    break
+                if not claimed:
+                    if running:
+                        wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    else:
+                        time.sleep(options['poll_interval'])
+
+        self.stdout.write(self.style.SUCCESS('Очередь отчетов обработана'))
+
+    def _collect(self, running):
+        """Вывести итоги завершенных отчетов и вернуть незавершенные"""
+        done = {future for future in running if future.done()}
+        for future in done:
+            try:
+                report_id, status = future.result()
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'  Ошибка воркера: {e}'))
+                continue
+            self.stdout.write(f'  Отчет #{report_id}: {status}')
+        return running - done
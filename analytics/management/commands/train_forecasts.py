@@ -0,0 +1,45 @@
+"""
+Management command для обучения моделей прогнозирования (ForecastModel)
+
+Каждая модель обучается одним пакетом для всех своих метрик и узлов
+гео-иерархии по материализованным значениям (см. analytics.forecasting).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import forecasting
+from analytics.models import ForecastModel
+
+
+class Command(BaseCommand):
+    help = 'Обучить модели прогнозирования по рассчитанным значениям метрик'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            action='append',
+            dest='models',
+            help='Код модели (можно указать несколько раз), по умолчанию - все, кроме архивных'
+        )
+
+    def handle(self, *args, **options):
+        models = ForecastModel.objects.exclude(status=ForecastModel.STATUS_ARCHIVED)
+        if options['models']:
+            models = ForecastModel.objects.filter(code__in=options['models'])
+            missing = set(options['models']) - set(models.values_list('code', flat=True))
+            if missing:
+                raise CommandError(f'Модели не найдены: {", ".join(sorted(missing))}')
+
+        trained = 0
+        for model in models.order_by('code'):
+            try:
+                summary = forecasting.train(model)
+            except forecasting.ForecastError as e:
+                self.stdout.write(self.style.WARNING(f'  {model.code}: {e}'))
+                continue
+            trained += 1
+            score = f'{model.training_score:.3f}' if model.training_score is not None else '-'
+            self.stdout.write(
+                f'  {model.code} ({model.get_model_type_display()}): рядов - {summary["series"]}, '
+                f'периодов - {summary["periods"]}, точность - {score}'
+            )
+        self.stdout.write(self.style.SUCCESS(f'Готово: обучено моделей - {trained}'))
@@ -0,0 +1,83 @@
+"""
+Management command для прогрева кэша виджетов популярных дашбордов
+
+Считает заранее виджеты самых просматриваемых видов дашбордов и наборов
+фильтров (см. analytics.cache_warmer). Запускается по расписанию (cron) перед
+началом рабочего дня и не реже Dashboard.refresh_interval в рабочие часы;
+--interval - повторять циклы постоянным процессом.
+
+Нужен общий для процессов бэкенд кэша (Redis, Memcached, БД): с LocMemCache
+команда прогрела бы только собственный кэш и завершается с ошибкой.
+"""
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics import cache_warmer, widget_cache
+
+
+class Command(BaseCommand):
+    help = 'Прогреть кэш виджетов для популярных дашбордов и наборов фильтров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=cache_warmer.max_targets(),
+            help='Сколько самых популярных видов прогревать (по умолчанию ANALYTICS_CACHE_WARM_TARGETS)'
+        )
+        parser.add_argument(
+            '--budget',
+            type=float,
+            default=cache_warmer.time_budget(),
+            help='Бюджет цикла, секунд (по умолчанию ANALYTICS_CACHE_WARM_TIME_BUDGET)'
+        )
+        parser.add_argument(
+            '--cpu-budget',
+            type=float,
+            default=cache_warmer.cpu_budget(),
+            help='Бюджет процессорного времени цикла, секунд (по умолчанию ANALYTICS_CACHE_WARM_CPU_BUDGET)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=0,
+            help='Повторять прогрев каждые N минут (по умолчанию - один цикл)'
+        )
+
+    def handle(self, *args, **options):
+        if not cache_warmer.shared_cache():
+            raise CommandError(
+                f"Бэкенд кэша {settings.CACHES['default']['BACKEND']} хранит данные внутри процесса: "
+                f"прогретый кэш пропадет при завершении команды и не будет виден веб-процессам. "
+                f"Настройте общий бэкенд (Redis, Memcached, БД) в CACHES['default']."
+            )
+        while True:
+            report = cache_warmer.warm(limit=options['limit'], budget=options['budget'], cpu=options['cpu_budget'])
+            self.print_report(report)
+            if not options['interval']:
+                break
+            time.sleep(options['interval'] * 60)
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"Видов: {report['targets']}, прогрето: {report['warmed_targets']}, "
+            f"пропущено по бюджету: {report['skipped_targets']}, с ошибкой: {report['failed_targets']}"
+        )
+        self.stdout.write(
+            f"Виджетов: {report['widgets']}, уже в кэше: {report['cached_before']}, "
+            f"посчитано: {report['warmed']}, ошибок: {report['errors']}"
+        )
+        self.stdout.write(f"Время: {report['elapsed']} с, процессорное время: {report['cpu_time']} с")
+
+        if report['hit_ratio'] is not None:
+            self.stdout.write(self.style.SUCCESS(
+                f"Доля виджетов в кэше: {report['hit_ratio_before']:.1%} → {report['hit_ratio']:.1%}"
+            ))
+        stats = widget_cache.stats()
+        if stats['hit_ratio'] is not None:
+            self.stdout.write(
+                f"Попадания кэша на просмотрах: {stats['hit_ratio']:.1%} "
+                f"({stats['hits']} из {stats['hits'] + stats['misses']})"
+            )
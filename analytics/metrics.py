@@ -0,0 +1,422 @@
+"""
+Материализация метрик (MetricValue)
+
+Каждая активная метрика считается для всех точек и периодов
+(settings.ANALYTICS_METRIC_PERIODS) и сворачивается вверх по гео-иерархии
+до глобального рынка. Входы - средние значения коэффициентов метрики
+из дневного куба (ObservationDailyRollup); для узла верхнего уровня
+суммы и количества значений его точек складываются, а формула
+(coefficients.formulas) считается по получившимся средним - так доля
+или средний вес региона не равны среднему долей его точек.
+
+За один период: один сгруппированный запрос к кубу на тип источника
+данных, одна выборка замыкания иерархии (geo.closure), свертка по
+уровням и вычисление формул - массивами NumPy.
+
+Пересчет инкрементальный: изменения куба (analytics.rollup) ставят
+(день, точка) в очередь MetricRefreshQueue, materialize_pending()
+пересчитывает только затронутые периоды и записывает значения только
+затронутых точек и их предков. Перенос узла иерархии к другому родителю
+(analytics.signals) ставит в очередь прежних и новых предков узла за все
+дни данных его поддерева. Полный пересчет - materialize().
+Запуск по расписанию и вручную - python manage.py materialize_metrics.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum, Min, Max
+
+from coefficients import formulas
+from coefficients.models import Coefficient, Metric
+from core.constants import FORMULA_SOURCE_CUSTOM
+from geo import closure
+from geo.models import GeoClosure
+from visits.models import to_local_date
+from . import periods, widget_cache
+from .models import ObservationDailyRollup, MetricValue, MetricRefreshQueue
+
+# Уровни сворачивания: от точки к глобальному рынку
+ROLLUP_LEVELS = closure.LEVEL_NAMES[::-1]
+
+DELETE_CHUNK_SIZE = 500
+
+
+def metric_periods():
+    return getattr(settings, 'ANALYTICS_METRIC_PERIODS', ['month'])
+
+
+# ============================================================================
+# Очередь пересчета
+# ============================================================================
+
+def mark_dirty(cells):
+    """Поставить в очередь дни точек изменившихся ячеек куба (день, коэффициент, точка, тип данных)"""
+    pairs = {(cell[0], cell[2]) for cell in cells if cell is not None}
+    MetricRefreshQueue.objects.bulk_create([
+        MetricRefreshQueue(day=day, entity_id=outlet_id) for day, outlet_id in pairs
+    ])
+
+
+def mark_moved(level, node_id, old_ancestors, new_ancestors):
+    """
+    Поставить в очередь прежних и новых предков перенесенного узла ({уровень: id})
+    за все дни, по которым в кубе есть данные точек его поддерева
+    """
+    nodes = set(old_ancestors.items()) | set(new_ancestors.items())
+    if not nodes:
+        return
+    days = closure.filter_under(ObservationDailyRollup.objects.all(), level, node_id).values_list(
+        'day', flat=True
+    ).distinct()
+    MetricRefreshQueue.objects.bulk_create(
+        [
+            MetricRefreshQueue(day=day, level=ancestor_level, entity_id=ancestor_id)
+            for day in days.iterator()
+            for ancestor_level, ancestor_id in nodes
+        ],
+        batch_size=1000
+    )
+
+
+def queue_stats():
+    """Очередь пересчета: количество записей и время самой старой (насколько отстают значения)"""
+    stats = MetricRefreshQueue.objects.aggregate(queued=Count('id'), oldest=Min('created_at'))
+    return {'queued': stats['queued'], 'oldest': stats['oldest']}
+
+
+# ============================================================================
+# Входы метрик
+# ============================================================================
+
+class MetricPlan:
+    """Что нужно для расчета метрики: формула (или единственный коэффициент) и коды входов"""
+
+    def __init__(self, metric, formula, coefficient_ids):
+        self.metric = metric
+        self.formula = formula
+        # {код коэффициента: id}
+        self.coefficient_ids = coefficient_ids
+        self.source = None if metric.source_data_type == FORMULA_SOURCE_CUSTOM else metric.source_data_type
+
+
+def plan_metrics(metrics):
+    """
+    Планы расчета метрик. Метрика без формулы - среднее ее единственного коэффициента;
+    метрики с некорректной формулой или без входов пропускаются.
+    """
+    metrics = list(metrics)
+    codes = {}
+    for metric in metrics:
+        if metric.formula_id:
+            try:
+                codes[metric.pk] = set(formulas.variable_codes(metric.formula).values())
+            except formulas.FormulaError:
+                continue
+        else:
+            coefficient_codes = [coefficient.code for coefficient in metric.coefficients.all()]
+            if len(coefficient_codes) == 1:
+                codes[metric.pk] = set(coefficient_codes)
+
+    all_codes = set().union(*codes.values()) if codes else set()
+    coefficient_ids = dict(Coefficient.objects.filter(code__in=all_codes).values_list('code', 'id'))
+
+    plans = []
+    for metric in metrics:
+        if metric.pk not in codes:
+            continue
+        ids = {code: coefficient_ids[code] for code in codes[metric.pk] if code in coefficient_ids}
+        if ids:
+            plans.append(MetricPlan(metric, metric.formula if metric.formula_id else None, ids))
+    return plans
+
+
+def active_metrics():
+    return Metric.objects.filter(is_active=True).select_related('formula').prefetch_related('coefficients')
+
+
+# ============================================================================
+# Расчет
+# ============================================================================
+
+def _load_cube(day_from, day_to, coefficient_ids, source):
+    """
+    Суммы куба за период по точкам и коэффициентам.
+    Возвращает (id точек, позиции коэффициентов {id: столбец}, суммы, количества значений,
+    количества наблюдений, подзапрос id точек).
+    """
+    queryset = ObservationDailyRollup.objects.filter(
+        day__gte=day_from, day__lte=day_to, coefficient_id__in=coefficient_ids
+    )
+    if source:
+        queryset = queryset.filter(data_source_type=source)
+    rows = list(queryset.values_list('outlet_id', 'coefficient_id').annotate(
+        value_sum=Sum('value_sum'), value_count=Sum('value_count'), row_count=Sum('row_count')
+    ).order_by())
+
+    columns = {coefficient_id: position for position, coefficient_id in enumerate(sorted(coefficient_ids))}
+    outlets = np.unique(np.array([row[0] for row in rows], dtype=np.int64))
+    sums = np.zeros((len(outlets), len(columns)))
+    counts = np.zeros((len(outlets), len(columns)))
+    observations = np.zeros((len(outlets), len(columns)))
+    if rows:
+        positions = np.searchsorted(outlets, np.array([row[0] for row in rows], dtype=np.int64))
+        column_positions = np.array([columns[row[1]] for row in rows])
+        sums[positions, column_positions] = [float(row[2] or 0) for row in rows]
+        counts[positions, column_positions] = [row[3] or 0 for row in rows]
+        observations[positions, column_positions] = [row[4] or 0 for row in rows]
+    return outlets, columns, sums, counts, observations, queryset.values('outlet_id')
+
+
+def outlet_ancestors(outlets, outlet_ids_query):
+    """
+    Предки точек из замыкания: {уровень: (позиции точек в outlets, id предков)}.
+    outlets - отсортированный массив id точек, outlet_ids_query - подзапрос тех же id.
+    """
+    rows = GeoClosure.objects.filter(
+        descendant_level='outlet', descendant_id__in=outlet_ids_query
+    ).values_list('descendant_id', 'ancestor_level', 'ancestor_id') if len(outlets) else []
+
+    by_level = {}
+    for descendant_id, ancestor_level, ancestor_id in rows:
+        pairs = by_level.setdefault(ancestor_level, ([], []))
+        pairs[0].append(descendant_id)
+        pairs[1].append(ancestor_id)
+
+    hierarchy = {}
+    for level, (descendant_ids, ancestor_ids) in by_level.items():
+        hierarchy[level] = (
+            np.searchsorted(outlets, np.array(descendant_ids, dtype=np.int64)),
+            np.array(ancestor_ids, dtype=np.int64),
+        )
+    return hierarchy
+
+
+def aggregate_by_ancestor(positions, ancestor_ids, matrices, ufunc=np.add, initial=0.0):
+    """
+    Свернуть строки матриц точек по предкам функцией ufunc (np.add, np.fmin, np.fmax).
+    Возвращает (id предков, [матрицы предков]).
+    """
+    entities, inverse = np.unique(ancestor_ids, return_inverse=True)
+    result = []
+    for matrix in matrices:
+        aggregated = np.full((len(entities), matrix.shape[1]), initial)
+        ufunc.at(aggregated, inverse, matrix[positions])
+        result.append(aggregated)
+    return entities, result
+
+
+def _metric_values(plan, columns, sums, counts, observations):
+    """Значения метрики и количества наблюдений для строк матриц"""
+    inputs = {}
+    for code, coefficient_id in plan.coefficient_ids.items():
+        column = columns[coefficient_id]
+        inputs[code] = formulas.divide(sums[:, column], counts[:, column])
+
+    size = sums.shape[0]
+    if plan.formula is not None:
+        values = formulas.calculate(plan.formula, inputs, size=size)
+    else:
+        values = next(iter(inputs.values()))
+
+    used = [columns[coefficient_id] for coefficient_id in plan.coefficient_ids.values()]
+    return values, observations[:, used].sum(axis=1)
+
+
+def _affected_entities(nodes):
+    """Затронутые узлы всех уровней {уровень: множество id}: узлы очереди и предки ее точек"""
+    affected = {}
+    for ancestors in closure.ancestors_of('outlet', nodes.get('outlet', ())).values():
+        for level, node_id in ancestors.items():
+            affected.setdefault(level, set()).add(node_id)
+    for level, node_ids in nodes.items():
+        affected.setdefault(level, set()).update(node_ids)
+    return affected
+
+
+@transaction.atomic
+def compute_period(plans, period, start, nodes=None):
+    """
+    Пересчитать метрики за период.
+    nodes - затронутые узлы {уровень: множество id} (None - все): записываются значения
+    этих узлов и предков затронутых точек.
+    Возвращает количество записанных значений.
+    """
+    day_to = periods.next_period(start, period) - timedelta(days=1)
+    affected = _affected_entities(nodes) if nodes is not None else None
+
+    values = []
+    by_source = {}
+    for plan in plans:
+        by_source.setdefault(plan.source, []).append(plan)
+
+    for source, source_plans in by_source.items():
+        coefficient_ids = set().union(*(plan.coefficient_ids.values() for plan in source_plans))
+        outlets, columns, sums, counts, observations, outlet_ids_query = _load_cube(
+            start, day_to, coefficient_ids, source
+        )
+        hierarchy = outlet_ancestors(outlets, outlet_ids_query)
+
+        for level in ROLLUP_LEVELS:
+            if level not in hierarchy:
+                continue
+            entities, (level_sums, level_counts, level_observations) = aggregate_by_ancestor(
+                *hierarchy[level], [sums, counts, observations]
+            )
+            selected = np.ones(len(entities), dtype=bool)
+            if affected is not None:
+                selected = np.isin(entities, list(affected.get(level, ())))
+
+            for plan in source_plans:
+                metric_values, metric_observations = _metric_values(
+                    plan, columns, level_sums, level_counts, level_observations
+                )
+                for entity_id, value, count in zip(
+                    entities[selected], metric_values[selected], metric_observations[selected]
+                ):
+                    if not count:
+                        continue
+                    values.append(MetricValue(
+                        metric=plan.metric,
+                        level=level,
+                        entity_id=int(entity_id),
+                        period=period,
+                        period_start=start,
+                        value=None if np.isnan(value) else float(value),
+                        observation_count=int(count),
+                    ))
+
+    # Заменить прежние значения (в том числе узлов, у которых данных больше нет)
+    stale = MetricValue.objects.filter(
+        metric__in=[plan.metric for plan in plans], period=period, period_start=start
+    )
+    if affected is None:
+        stale.delete()
+    else:
+        for level, ids in affected.items():
+            ids = list(ids)
+            for offset in range(0, len(ids), DELETE_CHUNK_SIZE):
+                stale.filter(level=level, entity_id__in=ids[offset:offset + DELETE_CHUNK_SIZE]).delete()
+
+    MetricValue.objects.bulk_create(values, batch_size=1000)
+    return len(values)
+
+
+def materialize(date_from=None, date_to=None, metrics=None):
+    """
+    Полный пересчет метрик за диапазон дат (по умолчанию - за все данные куба).
+    Возвращает количество записанных значений.
+    """
+    plans = plan_metrics(metrics if metrics is not None else active_metrics())
+    if not plans:
+        return 0
+
+    bounds = ObservationDailyRollup.objects.aggregate(first=Min('day'), last=Max('day'))
+    date_from = date_from or bounds['first']
+    date_to = date_to or bounds['last']
+    if date_from is None or date_to is None:
+        return 0
+
+    count = 0
+    for period in metric_periods():
+        for start in periods.periods_between(date_from, date_to, period):
+            count += compute_period(plans, period, start)
+
+    widget_cache.invalidate_all()
+    return count
+
+
+def materialize_pending():
+    """
+    Инкрементальный пересчет по очереди: только затронутые периоды, узлы и предки точек.
+    Возвращает (количество обработанных дней узлов, количество записанных значений).
+    """
+    last_id = MetricRefreshQueue.objects.aggregate(last=Max('id'))['last']
+    if last_id is None:
+        return 0, 0
+
+    queue = MetricRefreshQueue.objects.filter(id__lte=last_id)
+    touched = set(queue.values_list('day', 'level', 'entity_id').distinct())
+
+    plans = plan_metrics(active_metrics())
+    count = 0
+    if plans:
+        for period in metric_periods():
+            nodes_by_period = {}
+            for day, level, entity_id in touched:
+                start = periods.period_start(day, period)
+                nodes_by_period.setdefault(start, {}).setdefault(level, set()).add(entity_id)
+            for start, nodes in sorted(nodes_by_period.items()):
+                count += compute_period(plans, period, start, nodes)
+
+    queue.delete()
+    # KPI-виджеты затронутых точек и их предков читают новые значения
+    widget_cache.invalidate_cells([
+        (day, None, entity_id, None) for day, level, entity_id in touched if level == 'outlet'
+    ])
+    if any(level != 'outlet' for _, level, _ in touched):
+        # Пересчитаны предки перенесенных узлов - поддеревья изменились целиком
+        widget_cache.invalidate_all()
+    return len(touched), count
+
+
+# ============================================================================
+# Чтение KPI
+# ============================================================================
+
+def values_for(metric, level, entity_id, period='month', period_from=None, period_to=None):
+    """Значения метрики узла по периодам: [(начало периода, значение)] по возрастанию"""
+    queryset = MetricValue.objects.filter(metric=metric, level=level, entity_id=entity_id, period=period)
+    if period_from:
+        queryset = queryset.filter(period_start__gte=period_from)
+    if period_to:
+        queryset = queryset.filter(period_start__lte=period_to)
+    return list(queryset.order_by('period_start').values_list('period_start', 'value'))
+
+
+def kpi_value(metric, filters, period='month'):
+    """
+    Значение метрики для фильтров дашборда: самый узкий выбранный узел иерархии
+    (без выбора - глобальный рынок) за период, в который попадает начало фильтра.
+    Несколько узлов одного уровня (несколько глобальных рынков) усредняются с весом по наблюдениям.
+    Возвращает (значение или None, начало периода).
+    """
+    level, entity_id = 'global_market', None
+    for candidate in ROLLUP_LEVELS:
+        if filters.get(candidate):
+            level, entity_id = candidate, filters[candidate]
+            break
+
+    start = periods.period_start(to_local_date(filters['date_from']), period)
+    queryset = MetricValue.objects.filter(
+        metric=metric, level=level, period=period, period_start=start, value__isnull=False
+    )
+    if entity_id is not None:
+        queryset = queryset.filter(entity_id=entity_id)
+
+    rows = list(queryset.values_list('value', 'observation_count'))
+    total = sum(count for _, count in rows)
+    if not total:
+        return None, start
+    return sum(value * count for value, count in rows) / total, start
+
+
+def kpi_widget(config, filters):
+    """Виджет KPI из материализованных значений метрики (config: metric - код метрики, period)"""
+    metric = Metric.objects.filter(code=config.get('metric')).first()
+    if metric is None:
+        raise ValueError(f"Метрика не найдена: {config.get('metric')}")
+
+    period = config.get('period', 'month')
+    value, _ = kpi_value(metric, filters, period)
+    unit = config.get('unit')
+    if unit is None:
+        unit = metric.formula.result_unit if metric.formula_id else ''
+    return {
+        'type': 'metric',
+        'title': config.get('title', metric.name),
+        'value': round(value, config.get('digits', 2)) if value is not None else 0,
+        'unit': unit,
+        'color': config.get('color', 'primary'),
+    }
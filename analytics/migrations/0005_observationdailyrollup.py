@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_alter_dashboard_level'),
+        ('coefficients', '0003_metric_source_data_type'),
+        ('geo', '0005_alter_channel_district'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObservationDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('data_source_type', models.CharField(choices=[('MON', 'Мониторинговые'), ('EXP', 'Экспертные'), ('AI', 'Данные ИИ')], default='MON', max_length=10, verbose_name='Тип источника данных')),
+                ('row_count', models.PositiveIntegerField(default=0, verbose_name='Количество наблюдений')),
+                ('value_count', models.PositiveIntegerField(default=0, verbose_name='Количество числовых значений')),
+                ('value_sum', models.DecimalField(blank=True, decimal_places=4, max_digits=20, null=True, verbose_name='Сумма')),
+                ('value_min', models.DecimalField(blank=True, decimal_places=4, max_digits=15, null=True, verbose_name='Минимум')),
+                ('value_max', models.DecimalField(blank=True, decimal_places=4, max_digits=15, null=True, verbose_name='Максимум')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('coefficient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='coefficients.coefficient', verbose_name='Коэффициент')),
+                ('outlet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='geo.outlet', verbose_name='Точка сбыта')),
+            ],
+            options={
+                'verbose_name': 'Дневной агрегат наблюдений',
+                'verbose_name_plural': 'Дневные агрегаты наблюдений',
+                'ordering': ['-day'],
+                'indexes': [models.Index(fields=['coefficient', 'data_source_type', 'day'], name='analytics_o_coeffic_abfd3e_idx'), models.Index(fields=['outlet', 'day'], name='analytics_o_outlet__e4f651_idx')],
+                'unique_together': {('day', 'coefficient', 'outlet', 'data_source_type')},
+            },
+        ),
+    ]
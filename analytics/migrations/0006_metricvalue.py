@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0005_observationdailyrollup'),
+        ('coefficients', '0003_metric_source_data_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricRefreshQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('outlet_id', models.PositiveBigIntegerField(verbose_name='ID точки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+            ],
+            options={
+                'verbose_name': 'Очередь пересчета метрик',
+                'verbose_name_plural': 'Очередь пересчета метрик',
+            },
+        ),
+        migrations.CreateModel(
+            name='MetricValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('global_market', 'Глобальный рынок'), ('country', 'Страна'), ('region', 'Регион'), ('city', 'Город'), ('district', 'Район'), ('channel', 'Канал сбыта'), ('outlet', 'Точка сбыта')], max_length=20, verbose_name='Уровень')),
+                ('entity_id', models.PositiveBigIntegerField(verbose_name='ID узла')),
+                ('period', models.CharField(choices=[('day', 'День'), ('week', 'Неделя'), ('month', 'Месяц'), ('quarter', 'Квартал')], max_length=10, verbose_name='Период')),
+                ('period_start', models.DateField(verbose_name='Начало периода')),
+                ('value', models.FloatField(blank=True, null=True, verbose_name='Значение')),
+                ('observation_count', models.PositiveIntegerField(default=0, verbose_name='Количество наблюдений')),
+                ('computed_at', models.DateTimeField(auto_now=True, verbose_name='Дата расчета')),
+                ('metric', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='coefficients.metric', verbose_name='Метрика')),
+            ],
+            options={
+                'verbose_name': 'Значение метрики',
+                'verbose_name_plural': 'Значения метрик',
+                'ordering': ['-period_start'],
+                'indexes': [models.Index(fields=['level', 'entity_id', 'period', 'period_start'], name='analytics_m_level_685f8e_idx')],
+                'unique_together': {('metric', 'level', 'entity_id', 'period', 'period_start')},
+            },
+        ),
+    ]
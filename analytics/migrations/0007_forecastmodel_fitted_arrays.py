@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_metricvalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='forecastmodel',
+            name='fitted_arrays',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Обученные массивы'),
+        ),
+        migrations.AlterField(
+            model_name='forecastmodel',
+            name='model_type',
+            field=models.CharField(choices=[('linear', 'Линейная'), ('moving_average', 'Скользящее среднее'), ('exponential', 'Экспоненциальная'), ('seasonal', 'Сезонная'), ('arima', 'ARIMA'), ('custom', 'Пользовательская')], default='linear', max_length=50, verbose_name='Тип модели'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_forecastmodel_fitted_arrays'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='report',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Попыток генерации'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='error_message',
+            field=models.TextField(blank=True, editable=False, verbose_name='Ошибка генерации'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Следующая попытка'),
+        ),
+        migrations.AddField(
+            model_name='report',
+            name='started_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Начало генерации'),
+        ),
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='analytics_r_status_8b0874_idx'),
+        ),
+    ]
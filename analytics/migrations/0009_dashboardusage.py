@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_report_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(choices=[('detail', 'Дашборд'), ('multilevel', 'Мультиуровневый дашборд')], default='detail', max_length=20, verbose_name='Страница')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Параметры фильтров')),
+                ('params_hash', models.CharField(max_length=40, verbose_name='Хэш параметров')),
+                ('hits', models.PositiveIntegerField(default=0, verbose_name='Просмотров')),
+                ('last_used_at', models.DateTimeField(verbose_name='Последний просмотр')),
+                ('last_warmed_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний прогрев')),
+                ('dashboard', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='analytics.dashboard', verbose_name='Дашборд')),
+                ('preset', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='analytics.filterpreset', verbose_name='Набор фильтров')),
+            ],
+            options={
+                'verbose_name': 'Статистика просмотров дашборда',
+                'verbose_name_plural': 'Статистика просмотров дашбордов',
+                'ordering': ['-hits'],
+                'indexes': [models.Index(fields=['last_used_at', 'hits'], name='analytics_d_last_us_25fcda_idx')],
+                'unique_together': {('dashboard', 'view', 'params_hash')},
+            },
+        ),
+    ]
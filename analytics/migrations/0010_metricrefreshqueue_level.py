@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_dashboardusage'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='metricrefreshqueue',
+            old_name='outlet_id',
+            new_name='entity_id',
+        ),
+        migrations.AlterField(
+            model_name='metricrefreshqueue',
+            name='entity_id',
+            field=models.PositiveBigIntegerField(verbose_name='ID узла'),
+        ),
+        migrations.AddField(
+            model_name='metricrefreshqueue',
+            name='level',
+            field=models.CharField(default='outlet', max_length=20, verbose_name='Уровень'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from core.constants import DATA_SOURCE_CHOICES
 
 
 class Dashboard(models.Model):
@@ -161,6 +162,12 @@ class Report(models.Model):
     generated_at = models.DateTimeField('Дата генерации', null=True, blank=True)
     generation_time = models.FloatField('Время генерации (сек)', null=True, blank=True)
 
+    # Очередь генерации (analytics.report_queue)
+    attempts = models.PositiveSmallIntegerField('Попыток генерации', default=0, editable=False)
+    next_attempt_at = models.DateTimeField('Следующая попытка', null=True, blank=True, editable=False)
+    started_at = models.DateTimeField('Начало генерации', null=True, blank=True, editable=False)
+    error_message = models.TextField('Ошибка генерации', blank=True, editable=False)
+
     # Метаданные
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
@@ -172,11 +179,17 @@ class Report(models.Model):
         indexes = [
             models.Index(fields=['created_by', '-created_at']),
             models.Index(fields=['status']),
+            models.Index(fields=['status', 'next_attempt_at']),
         ]
 
     def __str__(self):
         return f"{self.name} - {self.created_at.strftime('%Y-%m-%d')}"
 
+    @property
+    def result(self):
+        """Результат генерации: {ключ секции: таблица / график / метрика}"""
+        return self.data
+
 
 class ReportTemplate(models.Model):
     """Шаблон отчета"""
@@ -313,12 +326,14 @@ class ForecastModel(models.Model):
 
     # Тип модели
     MODEL_TYPE_LINEAR = 'linear'
+    MODEL_TYPE_MOVING_AVERAGE = 'moving_average'
     MODEL_TYPE_EXPONENTIAL = 'exponential'
     MODEL_TYPE_SEASONAL = 'seasonal'
     MODEL_TYPE_ARIMA = 'arima'
     MODEL_TYPE_CUSTOM = 'custom'
     MODEL_TYPE_CHOICES = [
         (MODEL_TYPE_LINEAR, 'Линейная'),
+        (MODEL_TYPE_MOVING_AVERAGE, 'Скользящее среднее'),
         (MODEL_TYPE_EXPONENTIAL, 'Экспоненциальная'),
         (MODEL_TYPE_SEASONAL, 'Сезонная'),
         (MODEL_TYPE_ARIMA, 'ARIMA'),
@@ -340,6 +355,8 @@ class ForecastModel(models.Model):
     # Результаты обучения
     training_data = models.JSONField('Данные обучения', default=dict, blank=True)
     training_score = models.FloatField('Точность модели', null=True, blank=True)
+    # Ряды, истории и параметры всех рядов - сжатые массивы NumPy (analytics.forecasting)
+    fitted_arrays = models.BinaryField('Обученные массивы', null=True, blank=True, editable=False)
 
     # Период прогноза (дней)
     forecast_horizon = models.PositiveIntegerField('Горизонт прогноза (дней)', default=30)
@@ -378,3 +395,164 @@ class ForecastModel(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.get_model_type_display()})"
+
+
+class ObservationDailyRollup(models.Model):
+    """Дневной агрегат наблюдений: день × коэффициент × точка × тип источника данных"""
+    day = models.DateField('День')
+    coefficient = models.ForeignKey(
+        'coefficients.Coefficient',
+        on_delete=models.CASCADE,
+        verbose_name='Коэффициент',
+        related_name='daily_rollups'
+    )
+    outlet = models.ForeignKey(
+        'geo.Outlet',
+        on_delete=models.CASCADE,
+        verbose_name='Точка сбыта',
+        related_name='daily_rollups'
+    )
+    data_source_type = models.CharField(
+        'Тип источника данных',
+        max_length=10,
+        choices=DATA_SOURCE_CHOICES,
+        default='MON'
+    )
+
+    # Агрегаты по value_numeric
+    row_count = models.PositiveIntegerField('Количество наблюдений', default=0)
+    value_count = models.PositiveIntegerField('Количество числовых значений', default=0)
+    value_sum = models.DecimalField('Сумма', max_digits=20, decimal_places=4, null=True, blank=True)
+    value_min = models.DecimalField('Минимум', max_digits=15, decimal_places=4, null=True, blank=True)
+    value_max = models.DecimalField('Максимум', max_digits=15, decimal_places=4, null=True, blank=True)
+
+    # Метаданные
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Дневной агрегат наблюдений'
+        verbose_name_plural = 'Дневные агрегаты наблюдений'
+        ordering = ['-day']
+        unique_together = ['day', 'coefficient', 'outlet', 'data_source_type']
+        indexes = [
+            models.Index(fields=['coefficient', 'data_source_type', 'day']),
+            models.Index(fields=['outlet', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.coefficient_id} - {self.outlet_id} ({self.data_source_type})"
+
+
+class MetricValue(models.Model):
+    """
+    Рассчитанное значение метрики: метрика × уровень гео-иерархии × узел × период.
+    Заполняется конвейером analytics.metrics, дашборды и отчеты читают KPI отсюда.
+    """
+    LEVEL_CHOICES = [
+        ('global_market', 'Глобальный рынок'),
+        ('country', 'Страна'),
+        ('region', 'Регион'),
+        ('city', 'Город'),
+        ('district', 'Район'),
+        ('channel', 'Канал сбыта'),
+        ('outlet', 'Точка сбыта'),
+    ]
+    PERIOD_CHOICES = [
+        ('day', 'День'),
+        ('week', 'Неделя'),
+        ('month', 'Месяц'),
+        ('quarter', 'Квартал'),
+    ]
+
+    metric = models.ForeignKey(
+        'coefficients.Metric',
+        on_delete=models.CASCADE,
+        verbose_name='Метрика',
+        related_name='values'
+    )
+    level = models.CharField('Уровень', max_length=20, choices=LEVEL_CHOICES)
+    entity_id = models.PositiveBigIntegerField('ID узла')
+    period = models.CharField('Период', max_length=10, choices=PERIOD_CHOICES)
+    period_start = models.DateField('Начало периода')
+
+    value = models.FloatField('Значение', null=True, blank=True)
+    observation_count = models.PositiveIntegerField('Количество наблюдений', default=0)
+
+    computed_at = models.DateTimeField('Дата расчета', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Значение метрики'
+        verbose_name_plural = 'Значения метрик'
+        ordering = ['-period_start']
+        unique_together = ['metric', 'level', 'entity_id', 'period', 'period_start']
+        indexes = [
+            models.Index(fields=['level', 'entity_id', 'period', 'period_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.metric_id} - {self.level}:{self.entity_id} - {self.period_start} = {self.value}"
+
+
+class MetricRefreshQueue(models.Model):
+    """
+    Дни узлов гео-иерархии, по которым метрики еще не пересчитаны: точки с изменившимися
+    наблюдениями (пересчитываются вместе с предками) и прежние / новые предки перенесенного узла
+    """
+    day = models.DateField('День')
+    level = models.CharField('Уровень', max_length=20, default='outlet')
+    entity_id = models.PositiveBigIntegerField('ID узла')
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Очередь пересчета метрик'
+        verbose_name_plural = 'Очередь пересчета метрик'
+
+    def __str__(self):
+        return f"{self.day} - {self.level} {self.entity_id}"
+
+
+class DashboardUsage(models.Model):
+    """
+    Статистика просмотров дашборда с конкретными фильтрами (набором фильтров).
+    По ней прогреватель кэша (analytics.cache_warmer) заранее считает самые популярные виды.
+    """
+    VIEW_DETAIL = 'detail'
+    VIEW_MULTILEVEL = 'multilevel'
+    VIEW_CHOICES = [
+        (VIEW_DETAIL, 'Дашборд'),
+        (VIEW_MULTILEVEL, 'Мультиуровневый дашборд'),
+    ]
+
+    dashboard = models.ForeignKey(
+        Dashboard,
+        on_delete=models.CASCADE,
+        verbose_name='Дашборд',
+        related_name='usage'
+    )
+    preset = models.ForeignKey(
+        FilterPreset,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Набор фильтров',
+        related_name='usage'
+    )
+    view = models.CharField('Страница', max_length=20, choices=VIEW_CHOICES, default=VIEW_DETAIL)
+    params = models.JSONField('Параметры фильтров', default=dict, blank=True)
+    params_hash = models.CharField('Хэш параметров', max_length=40)
+
+    hits = models.PositiveIntegerField('Просмотров', default=0)
+    last_used_at = models.DateTimeField('Последний просмотр')
+    last_warmed_at = models.DateTimeField('Последний прогрев', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Статистика просмотров дашборда'
+        verbose_name_plural = 'Статистика просмотров дашбордов'
+        ordering = ['-hits']
+        unique_together = ['dashboard', 'view', 'params_hash']
+        indexes = [
+            models.Index(fields=['last_used_at', 'hits']),
+        ]
+
+    def __str__(self):
+        return f"{self.dashboard_id} ({self.view}) - {self.hits}"
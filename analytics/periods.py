@@ -0,0 +1,137 @@
+"""
+Группировка данных по периодам: день / неделя / месяц / квартал
+
+Периоды считаются по локальной дате визита (TIME_ZONE проекта), которая
+хранится на наблюдении (Observation.local_date) и в дневном кубе (day).
+БД группирует только по готовой дате - без DATE_FORMAT/TRUNC и часовых
+поясов конкретной СУБД, - а дни сворачиваются в периоды здесь.
+Пропущенные периоды заполняются пустыми значениями, чтобы ось графика
+была непрерывной.
+
+Здесь же - границы периода фильтра дашборда (сегодня, неделя, месяц...).
+"""
+from datetime import date, datetime, time, timedelta
+
+from django.utils import timezone
+
+
+# Группировка виджета -> период
+PERIOD_GROUPS = {
+    'date': 'day',
+    'week': 'week',
+    'month': 'month',
+    'quarter': 'quarter',
+}
+
+# Сколько последних периодов показывать на графике
+PERIOD_LIMITS = {
+    'day': 30,
+    'week': 12,
+    'month': 12,
+    'quarter': 8,
+}
+
+
+def period_start(day, period):
+    """Первый день периода, в который попадает дата"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'quarter':
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    return day
+
+
+def next_period(start, period):
+    """Первый день следующего периода"""
+    if period == 'week':
+        return start + timedelta(days=7)
+    if period in ('month', 'quarter'):
+        months = 3 if period == 'quarter' else 1
+        month = start.month - 1 + months
+        return date(start.year + month // 12, month % 12 + 1, 1)
+    return start + timedelta(days=1)
+
+
+def period_label(start, period, long=False):
+    """Подпись периода для графиков и таблиц"""
+    if period == 'week':
+        year, week, _ = start.isocalendar()
+        return f'Неделя {year}-{week:02d}'
+    if period == 'month':
+        return start.strftime('%Y-%m')
+    if period == 'quarter':
+        return f'{start.year} Q{(start.month - 1) // 3 + 1}'
+    return start.strftime('%d.%m.%Y' if long else '%d.%m')
+
+
+def periods_between(day_from, day_to, period):
+    """Начала всех периодов, пересекающихся с диапазоном дат"""
+    starts = []
+    current = period_start(day_from, period)
+    while current <= day_to:
+        starts.append(current)
+        current = next_period(current, period)
+    return starts
+
+
+def group_days(days, period, combine):
+    """
+    Свернуть значения по дням {дата: значение} в значения по периодам {начало периода: значение}.
+    combine(a, b) объединяет значения двух дней одного периода.
+    """
+    grouped = {}
+    for day, value in days.items():
+        start = period_start(day, period)
+        grouped[start] = combine(grouped[start], value) if start in grouped else value
+    return grouped
+
+
+def fill_gaps(grouped, day_from, day_to, period):
+    """Упорядоченный список (начало периода, значение) без пропусков; пустые периоды - None"""
+    # Данные за пределами диапазона (граница периода "до сейчас") не теряются
+    starts = set(periods_between(day_from, day_to, period)) | set(grouped)
+    return [(start, grouped.get(start)) for start in sorted(starts)]
+
+
+def period_bounds(period, date_from=None, date_to=None):
+    """
+    Границы периода фильтра дашборда [date_from, date_to] в локальном времени.
+    period: today / yesterday / week / last_week / month / custom (date_from, date_to - строки YYYY-MM-DD).
+    """
+    now = timezone.localtime()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if period == 'today':
+        return today, now
+    if period == 'yesterday':
+        start = today - timedelta(days=1)
+        return start, start.replace(hour=23, minute=59, second=59)
+    if period == 'week':
+        return today - timedelta(days=now.weekday()), now
+    if period == 'last_week':
+        start = today - timedelta(days=now.weekday() + 7)
+        return start, start + timedelta(days=6, hours=23, minutes=59, seconds=59)
+    if period == 'custom' and date_from and date_to:
+        start = timezone.make_aware(datetime.strptime(date_from, '%Y-%m-%d'))
+        end = timezone.make_aware(datetime.strptime(date_to, '%Y-%m-%d').replace(hour=23, minute=59, second=59))
+        return start, end
+    return today.replace(day=1), now
+
+
+def is_midnight(value):
+    """Граница периода ровно в полночь (локальное время)"""
+    local = timezone.localtime(value) if timezone.is_aware(value) else value
+    return local.time() == time.min
+
+
+def last_day(date_to):
+    """Последний день периода: конец ровно в полночь относится к предыдущему дню"""
+    local = timezone.localtime(date_to) if timezone.is_aware(date_to) else date_to
+    return local.date() - timedelta(days=1) if is_midnight(local) else local.date()
+
+
+def is_open_ended(date_to):
+    """Период "до сейчас": конец сегодня (или позже), но не на границе дня"""
+    return not is_midnight(date_to) and last_day(date_to) >= timezone.localdate()
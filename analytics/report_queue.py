@@ -0,0 +1,214 @@
+"""
+Очередь генерации отчетов
+
+Очередь - сами строки Report: веб-часть только ставит отчет в очередь
+(status='pending') и опрашивает статус, а формирует отчеты воркер
+(python manage.py run_report_worker) в своем пуле потоков.
+
+- Захват: отчет переводится в processing условным UPDATE ... WHERE status='pending',
+  поэтому один отчет не достанется двум воркерам (без блокировок строк).
+- Ограничение параллельности: не больше ANALYTICS_REPORT_CONCURRENCY отчетов
+  в обработке на все воркеры и ANALYTICS_REPORT_WORKERS потоков на воркер.
+  Подсчет отчетов в обработке и захват выполняются под блокировкой захвата
+  (claim_lock), поэтому воркеры, захватывающие одновременно, не превышают лимит.
+- Повторы: временные ошибки (БД недоступна, таймаут) возвращают отчет в очередь
+  с экспоненциальной задержкой, пока не исчерпано ANALYTICS_REPORT_MAX_ATTEMPTS
+  попыток; остальные ошибки сразу переводят отчет в failed.
+- Отчеты, зависшие в processing дольше ANALYTICS_REPORT_TIMEOUT (воркер
+  упал), возвращаются в очередь.
+- После генерации воркер сразу формирует файлы, которые долго строить в запросе:
+  Excel больших отчетов и PDF отчетов в формате PDF (analytics.exports);
+  перезапуск генерации удаляет сохраненный PDF.
+"""
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import exports, reports
+from .models import Report
+
+# Ошибки, после которых генерацию имеет смысл повторить
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, ConnectionError, TimeoutError)
+
+RETRY_DELAY = 30
+
+# Блокировка захвата отчетов (ключ advisory lock PostgreSQL - crc32 имени)
+CLAIM_LOCK = 'analytics:report_queue:claim'
+
+
+def worker_threads():
+    return getattr(settings, 'ANALYTICS_REPORT_WORKERS', 2)
+
+
+def max_concurrency():
+    return getattr(settings, 'ANALYTICS_REPORT_CONCURRENCY', 4)
+
+
+def max_attempts():
+    return getattr(settings, 'ANALYTICS_REPORT_MAX_ATTEMPTS', 3)
+
+
+def stale_timeout():
+    return timedelta(seconds=getattr(settings, 'ANALYTICS_REPORT_TIMEOUT', 30 * 60))
+
+
+def retry_delay(attempts):
+    """Задержка перед повтором: 30 с, 1 мин, 2 мин..."""
+    return timedelta(seconds=RETRY_DELAY * 2 ** max(attempts - 1, 0))
+
+
+# ============================================================================
+# Веб-часть
+# ============================================================================
+
+def enqueue(report):
+    """Поставить отчет в очередь на (повторную) генерацию"""
+    report.status = Report.STATUS_PENDING
+    report.attempts = 0
+    report.next_attempt_at = None
+    report.started_at = None
+    report.error_message = ''
+    update_fields = ['status', 'attempts', 'next_attempt_at', 'started_at', 'error_message', 'updated_at']
+    # Сохраненный PDF относится к прежним данным отчета
+    if exports.discard_pdf(report):
+        update_fields.append('file')
+    report.save(update_fields=update_fields)
+
+
+def status(report):
+    """Статус генерации для опроса"""
+    return {
+        'id': report.pk,
+        'status': report.status,
+        'status_display': report.get_status_display(),
+        'attempts': report.attempts,
+        'next_attempt_at': report.next_attempt_at,
+        'error_message': report.error_message,
+        'generated_at': report.generated_at,
+        'generation_time': report.generation_time,
+    }
+
+
+# ============================================================================
+# Воркер
+# ============================================================================
+
+def requeue_stale():
+    """Вернуть в очередь отчеты, зависшие в обработке. Возвращает количество."""
+    now = timezone.now()
+    stale = Report.objects.filter(status=Report.STATUS_PROCESSING, started_at__lt=now - stale_timeout())
+    failed = stale.filter(attempts__gte=max_attempts()).update(
+        status=Report.STATUS_FAILED, error_message='Превышено время генерации', updated_at=now
+    )
+    requeued = stale.update(status=Report.STATUS_PENDING, next_attempt_at=None, updated_at=now)
+    return failed + requeued
+
+
+@contextmanager
+def claim_lock():
+    """
+    Транзакция, в которой захват отчетов выполняет только один воркер:
+    PostgreSQL - advisory lock транзакции, MySQL - именованная блокировка GET_LOCK,
+    SQLite - блокировка записи БД (берется первой записью транзакции и держится до коммита).
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [zlib.crc32(CLAIM_LOCK.encode())])
+            elif connection.vendor == 'mysql':
+                cursor.execute('SELECT GET_LOCK(%s, -1)', [CLAIM_LOCK])
+            else:
+                table, pk = (connection.ops.quote_name(name) for name in (Report._meta.db_table, Report._meta.pk.column))
+                cursor.execute(f'UPDATE {table} SET {pk} = {pk} WHERE 1 = 0')
+        try:
+            yield
+        finally:
+            if connection.vendor == 'mysql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT RELEASE_LOCK(%s)', [CLAIM_LOCK])
+
+
+def claim(limit):
+    """Захватить до limit отчетов из очереди (с учетом общего ограничения). Возвращает их id."""
+    with claim_lock():
+        processing = Report.objects.filter(status=Report.STATUS_PROCESSING).count()
+        limit = min(limit, max_concurrency() - processing)
+        if limit <= 0:
+            return []
+
+        now = timezone.now()
+        candidates = Report.objects.filter(status=Report.STATUS_PENDING).filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now)
+        ).order_by('created_at').values_list('pk', flat=True)
+
+        claimed = []
+        for report_id in candidates[:limit]:
+            taken = Report.objects.filter(pk=report_id, status=Report.STATUS_PENDING).update(
+                status=Report.STATUS_PROCESSING, started_at=now, attempts=F('attempts') + 1, updated_at=now
+            )
+            if taken:
+                claimed.append(report_id)
+        return claimed
+
+
+def _finish(report_id, **fields):
+    """Записать итог генерации, если отчет не перезапустили и не удалили за время обработки"""
+    fields['updated_at'] = timezone.now()
+    return Report.objects.filter(pk=report_id, status=Report.STATUS_PROCESSING).update(**fields)
+
+
+def process(report_id):
+    """Сформировать захваченный отчет. Возвращает итоговый статус."""
+    report = Report.objects.select_related('template').get(pk=report_id)
+    started = time.monotonic()
+    try:
+        data = reports.build(report)
+    except TRANSIENT_ERRORS as e:
+        if report.attempts < max_attempts():
+            _finish(
+                report_id, status=Report.STATUS_PENDING, error_message=str(e),
+                next_attempt_at=timezone.now() + retry_delay(report.attempts),
+            )
+            return Report.STATUS_PENDING
+        _finish(report_id, status=Report.STATUS_FAILED, error_message=str(e))
+        return Report.STATUS_FAILED
+    except Exception as e:
+        _finish(report_id, status=Report.STATUS_FAILED, error_message=str(e) or e.__class__.__name__)
+        return Report.STATUS_FAILED
+
+    finished = _finish(
+        report_id, status=Report.STATUS_COMPLETED, data=data, error_message='', next_attempt_at=None,
+        generated_at=timezone.now(), generation_time=round(time.monotonic() - started, 3),
+    )
+    if finished:
+        prerender(report_id)
+    return Report.STATUS_COMPLETED
+
+
+def prerender(report_id):
+    """
+    Заранее сформировать файлы, которые слишком долго строить в запросе:
+    Excel больших отчетов и PDF отчетов в формате PDF.
+    """
+    report = Report.objects.select_related('template', 'created_by').filter(
+        pk=report_id, status=Report.STATUS_COMPLETED
+    ).first()
+    if report is None:
+        return
+    # ImportError / OSError - openpyxl или WeasyPrint (GTK) не установлены, выгрузка формируется по запросу
+    if exports.table_row_count(report) > exports.excel_inline_rows():
+        try:
+            exports.render_excel(report)
+        except ImportError:
+            pass
+    if report.format == Report.FORMAT_PDF:
+        try:
+            exports.render_pdf(report)
+        except (ImportError, OSError):
+            pass
@@ -0,0 +1,146 @@
+"""
+Формирование отчетов (Report) по шаблону (ReportTemplate)
+
+Секции отчета описываются в ReportTemplate.config так же, как виджеты
+дашборда (analytics.widgets), с ключом секции:
+
+    {"sections": [
+        {"key": "avg_weight", "type": "metric", "coefficient_id": 1, "aggregation": "avg"},
+        {"key": "by_month", "type": "line", "coefficient_id": 1, "group_by": "month"},
+        {"key": "top_outlets", "type": "table", "coefficient_id": 1, "row_limit": 50}
+    ]}
+
+Метрики шаблона (ReportTemplate.metrics) добавляются секциями KPI, результат
+SQL запроса шаблона (ReportTemplate.sql_query, analytics.sql_reports) - таблицей
+с ключом config["sql_section"] (по умолчанию "sql").
+Секции с общей группировкой считаются одним запросом, как виджеты дашборда.
+Фильтры - период отчета (date_from / date_to) и Report.filters
+(country...outlet, data_type, attributes).
+
+Результат (Report.data) - {ключ секции: значение}: таблица - список строк,
+график - {'type', 'labels', 'values'}, метрика - {'value', 'unit'}.
+Ошибки не превращаются в пустые секции, а пробрасываются - очередь
+(analytics.report_queue) решает, повторять ли генерацию.
+"""
+import json
+from datetime import datetime, time
+
+from django.utils import timezone
+
+from . import metrics, periods, sql_reports, widgets
+
+
+class ReportError(ValueError):
+    """Отчет нельзя сформировать (ошибка шаблона или параметров)"""
+
+
+def report_filters(report):
+    """Фильтры секций из периода и фильтров отчета (в формате фильтров дашборда)"""
+    params = report.filters if isinstance(report.filters, dict) else {}
+
+    if report.date_from or report.date_to:
+        date_from = report.date_from or report.date_to
+        date_to = report.date_to or report.date_from
+        if date_from > date_to:
+            raise ReportError('Дата начала отчета позже даты окончания')
+        bounds = (
+            timezone.make_aware(datetime.combine(date_from, time.min)),
+            timezone.make_aware(datetime.combine(date_to, time.max)),
+        )
+    else:
+        bounds = periods.period_bounds(params.get('period', 'month'))
+
+    filters = {
+        'period': 'custom',
+        'date_from': bounds[0],
+        'date_to': bounds[1],
+        'data_type': params.get('data_type', 'MON'),
+        'attributes': params.get('attributes') or {},
+    }
+    for level in widgets.GEO_LEVELS:
+        filters[level] = params.get(level) or None
+    return filters
+
+
+def section_configs(template):
+    """Секции шаблона: конфиги виджетов с ключом секции (key)"""
+    config = template.config or {}
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except ValueError:
+            raise ReportError('Конфигурация шаблона - некорректный JSON')
+    sections = config.get('sections', config.get('widgets', [])) if isinstance(config, dict) else []
+
+    configs = []
+    for index, section in enumerate(sections):
+        if not isinstance(section, dict):
+            raise ReportError(f'Секция {index + 1} шаблона должна быть объектом')
+        configs.append(dict(section, key=section.get('key') or f'section_{index + 1}'))
+
+    keys = {config['key'] for config in configs}
+    for metric in template.metrics.all():
+        if metric.code not in keys:
+            configs.append({'key': metric.code, 'type': 'kpi', 'metric': metric.code, 'title': metric.name})
+    return configs
+
+
+def compute_sections(configs, filters):
+    """Посчитать секции пакетными запросами; результат выровнен по конфигам (None - неизвестный тип)"""
+    results = [None] * len(configs)
+    batches, ungrouped = widgets.plan_widgets(configs)
+
+    for dimensions, members in batches.items():
+        coefficient_ids = {config.get('coefficient_id') for _, _, config in members}
+        partials = widgets.fetch_partials(filters, dimensions, coefficient_ids)
+        for index, kind, config in members:
+            results[index] = widgets.fan_out(kind, config, partials, filters)
+
+    for index, kind, config in ungrouped:
+        if kind == 'kpi':
+            results[index] = metrics.kpi_widget(config, filters)
+        else:
+            results[index] = widgets.fan_out(kind, config, {}, filters)
+    return results
+
+
+def section_value(widget):
+    """Результат виджета → значение секции отчета"""
+    if widget['type'] == 'table':
+        return widget['rows']
+    if widget['type'] == 'chart':
+        return {
+            'type': widget['chart_type'],
+            'labels': json.loads(widget['labels']),
+            'values': json.loads(widget['values']),
+        }
+    return {'value': widget['value'], 'unit': widget.get('unit', '')}
+
+
+def build(report):
+    """Сформировать данные отчета: {ключ секции: значение}"""
+    if report.template is None:
+        raise ReportError('У отчета нет шаблона')
+
+    template = report.template
+    configs = section_configs(template)
+    has_sql = bool((template.sql_query or '').strip())
+    if not configs and not has_sql:
+        raise ReportError(f'В шаблоне {template.code} нет секций')
+
+    filters = report_filters(report)
+    try:
+        widgets_data = compute_sections(configs, filters)
+        sql_result = sql_reports.execute(template, filters) if has_sql else None
+    except ValueError as e:
+        raise ReportError(str(e))
+
+    data = {
+        config['key']: section_value(widget)
+        for config, widget in zip(configs, widgets_data)
+        if widget is not None
+    }
+    if sql_result is not None:
+        config = template.config if isinstance(template.config, dict) else {}
+        data[config.get('sql_section') or 'sql'] = sql_reports.as_table(sql_result)
+    return data
@@ -0,0 +1,252 @@
+"""
+Дневной куб наблюдений (ObservationDailyRollup)
+
+Куб хранит агрегаты value_numeric в разрезе
+день × коэффициент × точка × тип источника данных и обновляется
+инкрементально при записи наблюдений и визитов (см. analytics.signals).
+Виджеты дашбордов читают агрегаты из куба и обращаются к сырым
+наблюдениям только когда куб не может ответить на запрос.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import time
+
+from django.db import transaction
+from django.db.models import Count, Sum, Min, Max, FloatField
+from django.db.models.functions import Cast, NullIf
+from django.utils import timezone
+
+from visits.models import to_local_date
+from .models import ObservationDailyRollup
+from . import metrics, periods, widget_cache
+
+_local = threading.local()
+
+
+# ============================================================================
+# Ключи ячеек
+# ============================================================================
+
+def cell_key(visit, coefficient_id, data_source_type):
+    """Ключ ячейки куба для наблюдения визита (None если визит не начат)"""
+    day = to_local_date(visit.start_date)
+    if day is None:
+        return None
+    return (day, coefficient_id, visit.outlet_id, data_source_type)
+
+
+def observation_key(observation):
+    """Ключ ячейки куба для наблюдения"""
+    return cell_key(observation.visit, observation.coefficient_id, observation.data_source_type)
+
+
+def visit_keys(visit):
+    """Ключи всех ячеек, в которые попадают наблюдения визита"""
+    if visit.start_date is None:
+        return set()
+    pairs = visit.observations.values_list('coefficient_id', 'data_source_type').distinct()
+    return {cell_key(visit, coefficient_id, data_source_type) for coefficient_id, data_source_type in pairs}
+
+
+# ============================================================================
+# Обновление куба
+# ============================================================================
+
+REFRESH_CHUNK_SIZE = 1000
+ROLLUP_VALUE_FIELDS = ['row_count', 'value_count', 'value_sum', 'value_min', 'value_max']
+
+
+def _refresh_chunk(keys):
+    """Пересчитать пачку ячеек: один агрегирующий запрос, один upsert, одно удаление опустевших ячеек"""
+    from visits.models import Observation
+
+    # Выборка по произведению множеств шире пачки - лишние ячейки отбрасываются
+    days, coefficient_ids, outlet_ids, data_source_types = (set(values) for values in zip(*keys))
+    cells = Observation.objects.filter(
+        local_date__in=days,
+        coefficient_id__in=coefficient_ids,
+        visit__outlet_id__in=outlet_ids,
+        data_source_type__in=data_source_types,
+    ).values(
+        'local_date', 'coefficient_id', 'visit__outlet_id', 'data_source_type'
+    ).annotate(
+        row_count=Count('id'),
+        value_count=Count('value_numeric'),
+        value_sum=Sum('value_numeric'),
+        value_min=Min('value_numeric'),
+        value_max=Max('value_numeric'),
+    ).order_by()
+
+    rollups = []
+    for cell in cells:
+        key = (cell['local_date'], cell['coefficient_id'], cell['visit__outlet_id'], cell['data_source_type'])
+        if key in keys:
+            rollups.append(ObservationDailyRollup(
+                day=key[0], coefficient_id=key[1], outlet_id=key[2], data_source_type=key[3],
+                **{field: cell[field] for field in ROLLUP_VALUE_FIELDS}
+            ))
+    filled = {(rollup.day, rollup.coefficient_id, rollup.outlet_id, rollup.data_source_type) for rollup in rollups}
+
+    stale = [
+        pk for pk, *key in ObservationDailyRollup.objects.filter(
+            day__in=days,
+            coefficient_id__in=coefficient_ids,
+            outlet_id__in=outlet_ids,
+            data_source_type__in=data_source_types,
+        ).values_list('pk', 'day', 'coefficient_id', 'outlet_id', 'data_source_type')
+        if tuple(key) in keys and tuple(key) not in filled
+    ]
+
+    with transaction.atomic():
+        ObservationDailyRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['day', 'coefficient', 'outlet', 'data_source_type'],
+            update_fields=ROLLUP_VALUE_FIELDS + ['updated_at'],
+        )
+        if stale:
+            ObservationDailyRollup.objects.filter(pk__in=stale).delete()
+
+
+def refresh_cells(keys):
+    """Пересчитать ячейки куба по сырым наблюдениям (пачками, число запросов не зависит от числа ячеек)"""
+    keys = list({key for key in keys if key is not None})
+    for start in range(0, len(keys), REFRESH_CHUNK_SIZE):
+        _refresh_chunk(set(keys[start:start + REFRESH_CHUNK_SIZE]))
+
+    # Кэш виджетов инвалидируется после обновления куба, чтобы не закэшировать старые агрегаты
+    widget_cache.invalidate_cells(keys)
+    # Значения метрик этих точек и дней пересчитываются конвейером analytics.metrics
+    metrics.mark_dirty(keys)
+
+
+def mark_dirty(keys):
+    """
+    Пометить ячейки как изменённые.
+    Внутри deferred_refresh() пересчёт откладывается до выхода из блока,
+    иначе выполняется сразу.
+    """
+    keys = {key for key in keys if key is not None}
+    if not keys:
+        return
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.update(keys)
+    else:
+        refresh_cells(keys)
+
+
+@contextmanager
+def deferred_refresh():
+    """Собрать изменённые ячейки и пересчитать каждую один раз (для массовых записей)"""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+
+    _local.pending = set()
+    try:
+        yield
+        keys = _local.pending
+    finally:
+        _local.pending = None
+    refresh_cells(keys)
+    if keys:
+        # После массовой записи популярные дашборды пересчитываются в кэш заранее
+        from . import cache_warmer
+        cache_warmer.warm_in_background()
+
+
+def rebuild(date_from=None, date_to=None):
+    """
+    Полностью перестроить куб (или его часть по датам) из сырых наблюдений.
+    Возвращает количество записанных ячеек.
+    """
+    from visits.models import Observation
+
+    observations = Observation.objects.filter(local_date__isnull=False)
+    rollups = ObservationDailyRollup.objects.all()
+    if date_from:
+        observations = observations.filter(local_date__gte=date_from)
+        rollups = rollups.filter(day__gte=date_from)
+    if date_to:
+        observations = observations.filter(local_date__lte=date_to)
+        rollups = rollups.filter(day__lte=date_to)
+
+    rollups.delete()
+
+    cells = observations.values(
+        'local_date', 'coefficient_id', 'visit__outlet_id', 'data_source_type'
+    ).annotate(
+        row_count=Count('id'),
+        value_count=Count('value_numeric'),
+        value_sum=Sum('value_numeric'),
+        value_min=Min('value_numeric'),
+        value_max=Max('value_numeric'),
+    ).order_by()
+
+    count = 0
+    batch = []
+    for cell in cells.iterator(chunk_size=5000):
+        batch.append(ObservationDailyRollup(
+            day=cell['local_date'],
+            coefficient_id=cell['coefficient_id'],
+            outlet_id=cell['visit__outlet_id'],
+            data_source_type=cell['data_source_type'],
+            row_count=cell['row_count'],
+            value_count=cell['value_count'],
+            value_sum=cell['value_sum'],
+            value_min=cell['value_min'],
+            value_max=cell['value_max'],
+        ))
+        if len(batch) >= 1000:
+            ObservationDailyRollup.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    ObservationDailyRollup.objects.bulk_create(batch)
+    count += len(batch)
+
+    widget_cache.invalidate_all()
+    from . import cache_warmer
+    cache_warmer.warm_in_background()
+    return count
+
+
+# ============================================================================
+# Чтение куба
+# ============================================================================
+
+def day_range(filters):
+    """
+    Перевести период фильтров в диапазон дней куба.
+    Возвращает None, если границы периода не совпадают с границами дней.
+    """
+    date_from = timezone.localtime(filters['date_from'])
+    date_to = timezone.localtime(filters['date_to'])
+
+    if date_from.time() != time.min:
+        return None
+
+    # Конец ровно в полночь (например, "вчера" до 00:00 сегодня) - период заканчивается предыдущим днем
+    if periods.is_midnight(date_to):
+        if date_to <= date_from:
+            return None
+        return date_from.date(), periods.last_day(date_to)
+    # Период "до сейчас" охватывает сегодняшний день целиком
+    if periods.is_open_ended(date_to):
+        return date_from.date(), date_to.date()
+    if date_to.time().replace(microsecond=0) == time(23, 59, 59):
+        return date_from.date(), date_to.date()
+    return None
+
+
+def can_answer(filters):
+    """Может ли куб ответить на запрос с такими фильтрами"""
+    # В кубе нет измерения товара, поэтому фильтр по атрибутам считается по сырым данным
+    if any((filters.get('attributes') or {}).values()):
+        return False
+    return day_range(filters) is not None
+
+
+def avg_expression():
+    """Среднее value_numeric по ячейкам куба"""
+    return Cast(Sum('value_sum'), FloatField()) / NullIf(Cast(Sum('value_count'), FloatField()), 0.0)
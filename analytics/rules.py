@@ -0,0 +1,253 @@
+"""
+Выполнение правил агрегации (Rule с rule_type='aggregation')
+
+Правило задает метод агрегации (sum / avg / min / max / count) и коэффициенты
+(applies_to). За период правило считается сразу для всех уровней иерархии
+(точка → канал → район → город → регион → страна → глобальный рынок)
+одним сгруппированным запросом к дневному кубу (ObservationDailyRollup):
+
+- PostgreSQL и MySQL 8 - GROUP BY ROLLUP по цепочке гео-иерархии;
+- остальные СУБД (SQLite) - запрос по точкам и свертка по уровням
+  массивами NumPy через замыкание иерархии (geo.closure).
+
+Все методы разложимы по ячейкам куба (суммы, количества, минимумы,
+максимумы), поэтому оба пути дают одинаковый результат.
+
+Rule.parameters:
+- data_type - тип источника данных (MON / EXP / AI), по умолчанию - все.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import connection
+from django.db.models import Sum, Min, Max
+
+from coefficients.models import Rule
+from geo import closure
+from geo.models import Outlet, Channel, District, City, Region, Country
+from . import metrics, periods
+from .models import ObservationDailyRollup
+
+# Уровни от корня к листьям, как в колонках ROLLUP
+LEVELS = closure.LEVEL_NAMES
+
+# Путь от ячейки куба к id узла каждого уровня: (уровень, модель, колонка родителя)
+HIERARCHY_JOINS = [
+    ('outlet', Outlet, 'channel_id'),
+    ('channel', Channel, 'district_id'),
+    ('district', District, 'city_id'),
+    ('city', City, 'region_id'),
+    ('region', Region, 'country_id'),
+    ('country', Country, 'global_market_id'),
+]
+
+# Агрегаты ячеек куба: value_sum, value_count, row_count, value_min, value_max
+AGGREGATE_COLUMNS = ['value_sum', 'value_count', 'row_count', 'value_min', 'value_max']
+
+
+class RuleResult:
+    """Результат правила: values {(уровень, id узла, id коэффициента): значение}"""
+
+    def __init__(self, rule, period, start, values):
+        self.rule = rule
+        self.period = period
+        self.start = start
+        self.values = values
+
+    def for_level(self, level):
+        """{(id узла, id коэффициента): значение} одного уровня"""
+        return {
+            (entity_id, coefficient_id): value
+            for (value_level, entity_id, coefficient_id), value in self.values.items()
+            if value_level == level
+        }
+
+    def as_rows(self):
+        return [
+            {'level': level, 'entity_id': entity_id, 'coefficient_id': coefficient_id, 'value': value}
+            for (level, entity_id, coefficient_id), value in sorted(
+                self.values.items(), key=lambda item: (LEVELS.index(item[0][0]), item[0][1], item[0][2])
+            )
+        ]
+
+
+def final_value(method, value_sum, value_count, row_count, value_min, value_max):
+    """Значение метода агрегации по сложенным агрегатам ячеек (None - нет числовых значений)"""
+    if method == Rule.AGGREGATION_COUNT:
+        return int(row_count or 0)
+    if not value_count:
+        return None
+    if method == Rule.AGGREGATION_SUM:
+        return float(value_sum)
+    if method == Rule.AGGREGATION_AVG:
+        return float(value_sum) / float(value_count)
+    if method == Rule.AGGREGATION_MIN:
+        return float(value_min)
+    if method == Rule.AGGREGATION_MAX:
+        return float(value_max)
+    raise ValueError(f'Неизвестный метод агрегации: {method}')
+
+
+def supports_rollup():
+    """Поддерживает ли СУБД GROUP BY ROLLUP с GROUPING()"""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'mysql':
+        return not connection.mysql_is_mariadb and connection.mysql_version >= (8, 0, 1)
+    return False
+
+
+# ============================================================================
+# Выполнение
+# ============================================================================
+
+def execute(rule, period, start):
+    """Выполнить правило агрегации за период (начало периода start) для всех уровней иерархии"""
+    if rule.rule_type != Rule.TYPE_AGGREGATION or not rule.aggregation_method:
+        raise ValueError(f'Правило {rule.code} не является правилом агрегации')
+
+    coefficient_ids = sorted(rule.applies_to.values_list('id', flat=True))
+    day_to = periods.next_period(start, period) - timedelta(days=1)
+    data_type = (rule.parameters or {}).get('data_type')
+
+    if not coefficient_ids:
+        cells = []
+    elif supports_rollup():
+        cells = _rollup_cells(coefficient_ids, start, day_to, data_type)
+    else:
+        cells = _numpy_cells(coefficient_ids, start, day_to, data_type)
+
+    values = {}
+    for level, entity_id, coefficient_id, aggregates in cells:
+        value = final_value(rule.aggregation_method, *aggregates)
+        if value is not None:
+            values[(level, int(entity_id), int(coefficient_id))] = value
+    return RuleResult(rule, period, start, values)
+
+
+def execute_all(period, start, rules=None):
+    """Выполнить все активные правила агрегации за период: {код правила: RuleResult}"""
+    if rules is None:
+        rules = Rule.objects.filter(
+            is_active=True, rule_type=Rule.TYPE_AGGREGATION, aggregation_method__isnull=False
+        ).exclude(aggregation_method='')
+    return {rule.code: execute(rule, period, start) for rule in rules}
+
+
+def _rollup_cells(coefficient_ids, day_from, day_to, data_type):
+    """Один запрос с GROUP BY ROLLUP: [(уровень, id узла, id коэффициента, агрегаты)]"""
+    qn = connection.ops.quote_name
+    cube = qn(ObservationDailyRollup._meta.db_table)
+
+    # Колонки id узлов от глобального рынка к точке и JOIN'ы по цепочке родителей
+    joins = []
+    level_columns = {'outlet': f'r.{qn("outlet_id")}'}
+    previous = ('r', 'outlet_id')
+    for index, (level, model, parent_column) in enumerate(HIERARCHY_JOINS):
+        alias = f'g{index}'
+        joins.append(
+            f'LEFT JOIN {qn(model._meta.db_table)} {alias} ON {alias}.{qn("id")} = {previous[0]}.{qn(previous[1])}'
+        )
+        parent_level = LEVELS[LEVELS.index(level) - 1]
+        level_columns[parent_level] = f'{alias}.{qn(parent_column)}'
+        previous = (alias, parent_column)
+    columns = [level_columns[level] for level in LEVELS]
+
+    where = [f'r.{qn("day")} >= %s', f'r.{qn("day")} <= %s']
+    params = [day_from, day_to]
+    where.append(f'r.{qn("coefficient_id")} IN ({", ".join(["%s"] * len(coefficient_ids))})')
+    params += coefficient_ids
+    if data_type:
+        where.append(f'r.{qn("data_source_type")} = %s')
+        params.append(data_type)
+
+    coefficient = f'r.{qn("coefficient_id")}'
+    if connection.vendor == 'postgresql':
+        group_by = f'{coefficient}, ROLLUP({", ".join(columns)})'
+    else:
+        group_by = f'{coefficient}, {", ".join(columns)} WITH ROLLUP'
+
+    sql = f"""
+        SELECT {coefficient}, {", ".join(columns)},
+               GROUPING({coefficient}), GROUPING({", ".join(columns)}),
+               SUM(r.{qn("value_sum")}), SUM(r.{qn("value_count")}), SUM(r.{qn("row_count")}),
+               MIN(r.{qn("value_min")}), MAX(r.{qn("value_max")})
+        FROM {cube} r
+        {" ".join(joins)}
+        WHERE {" AND ".join(where)}
+        GROUP BY {group_by}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+
+    cells = []
+    depth = len(LEVELS)
+    for row in rows:
+        coefficient_id, ids = row[0], row[1:depth + 1]
+        coefficient_grouping, level_grouping = row[depth + 1], row[depth + 2]
+        if coefficient_grouping:
+            continue
+        # Свернутые колонки ROLLUP - хвост цепочки; уровень строки - последняя несвернутая колонка
+        rolled = bin(level_grouping).count('1')
+        index = depth - rolled - 1
+        if index < 0 or ids[index] is None:
+            continue
+        cells.append((LEVELS[index], ids[index], coefficient_id, row[depth + 3:]))
+    return cells
+
+
+def _numpy_cells(coefficient_ids, day_from, day_to, data_type):
+    """Один запрос по точкам и свертка по уровням в NumPy: [(уровень, id узла, id коэффициента, агрегаты)]"""
+    queryset = ObservationDailyRollup.objects.filter(
+        day__gte=day_from, day__lte=day_to, coefficient_id__in=coefficient_ids
+    )
+    if data_type:
+        queryset = queryset.filter(data_source_type=data_type)
+    rows = list(queryset.values_list('outlet_id', 'coefficient_id').annotate(
+        value_sum=Sum('value_sum'), value_count=Sum('value_count'), row_count=Sum('row_count'),
+        value_min=Min('value_min'), value_max=Max('value_max'),
+    ).order_by())
+    if not rows:
+        return []
+
+    columns = {coefficient_id: position for position, coefficient_id in enumerate(coefficient_ids)}
+    outlets = np.unique(np.array([row[0] for row in rows], dtype=np.int64))
+    positions = np.searchsorted(outlets, np.array([row[0] for row in rows], dtype=np.int64))
+    column_positions = np.array([columns[row[1]] for row in rows])
+
+    # Матрицы точка × коэффициент; пустые ячейки минимумов/максимумов - NaN (np.fmin/np.fmax их пропускают)
+    matrices = {}
+    for offset, name in enumerate(AGGREGATE_COLUMNS, start=2):
+        matrix = np.full((len(outlets), len(columns)), np.nan if name in ('value_min', 'value_max') else 0.0)
+        matrix[positions, column_positions] = [
+            np.nan if row[offset] is None else float(row[offset]) for row in rows
+        ]
+        matrices[name] = matrix
+    additive = ['value_sum', 'value_count', 'row_count']
+
+    cells = []
+    hierarchy = metrics.outlet_ancestors(outlets, queryset.values('outlet_id'))
+    for level in LEVELS:
+        if level not in hierarchy:
+            continue
+        outlet_positions, ancestor_ids = hierarchy[level]
+        entities, sums = metrics.aggregate_by_ancestor(
+            outlet_positions, ancestor_ids, [np.nan_to_num(matrices[name]) for name in additive]
+        )
+        _, (minimums,) = metrics.aggregate_by_ancestor(
+            outlet_positions, ancestor_ids, [matrices['value_min']], ufunc=np.fmin, initial=np.nan
+        )
+        _, (maximums,) = metrics.aggregate_by_ancestor(
+            outlet_positions, ancestor_ids, [matrices['value_max']], ufunc=np.fmax, initial=np.nan
+        )
+        level_matrices = sums + [minimums, maximums]
+
+        row_counts = level_matrices[2]
+        for entity_position, column in zip(*np.nonzero(row_counts)):
+            aggregates = [matrix[entity_position, column] for matrix in level_matrices]
+            cells.append((
+                level, entities[entity_position], coefficient_ids[column],
+                [None if np.isnan(value) else value for value in aggregates],
+            ))
+    return cells
@@ -2,7 +2,8 @@
 DRF Serializers for ANALYTICS app models
 """
 from rest_framework import serializers
-from .models import Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel
+from . import sql_reports
+from .models import Dashboard, Report, ReportTemplate, FilterPreset, ForecastModel, MetricValue
 
 
 class DashboardSerializer(serializers.ModelSerializer):
@@ -31,6 +32,7 @@ class ReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = Report
         fields = '__all__'
+        read_only_fields = ['status', 'generated_at', 'generation_time']
 
     def get_file_url(self, obj):
         if obj.file:
@@ -58,6 +60,18 @@ class ReportTemplateSerializer(serializers.ModelSerializer):
     def get_report_count(self, obj):
         return obj.reports.count()
 
+    def validate_sql_query(self, value):
+        if not value.strip() or (self.instance is not None and value == self.instance.sql_query):
+            return value
+        request = self.context.get('request')
+        if request is None or not request.user.is_staff:
+            raise serializers.ValidationError('SQL запрос шаблона может задавать только администратор')
+        try:
+            sql_reports.validate(value)
+        except sql_reports.SqlQueryError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
 
 class FilterPresetSerializer(serializers.ModelSerializer):
     """Serializer for FilterPreset model"""
@@ -78,7 +92,18 @@ class ForecastModelSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ForecastModel
-        fields = '__all__'
+        exclude = ['fitted_arrays']
+        read_only_fields = ['training_data', 'training_score', 'trained_at']
 
     def get_metric_count(self, obj):
         return obj.metrics.count()
+
+
+class MetricValueSerializer(serializers.ModelSerializer):
+    """Serializer for MetricValue model"""
+    metric_code = serializers.CharField(source='metric.code', read_only=True)
+    metric_name = serializers.CharField(source='metric.name', read_only=True)
+
+    class Meta:
+        model = MetricValue
+        fields = '__all__'
@@ -0,0 +1,91 @@
+"""
+Сигналы ANALYTICS: поддержание дневного куба наблюдений, материализованных метрик
+и кэша виджетов в актуальном состоянии
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from geo import closure
+from visits.models import Visit, Observation
+from visits.signals import REPARENT_SCOPES
+from . import metrics, rollup, widget_cache
+
+
+@receiver(pre_save, sender=Observation)
+def observation_pre_save(sender, instance, raw=False, **kwargs):
+    """Запомнить ячейку куба до изменения наблюдения"""
+    instance._rollup_old_key = None
+    if raw or not instance.pk:
+        return
+    old = Observation.objects.filter(pk=instance.pk).select_related('visit').first()
+    if old:
+        instance._rollup_old_key = rollup.observation_key(old)
+
+
+@receiver(post_save, sender=Observation)
+def observation_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rollup.mark_dirty({getattr(instance, '_rollup_old_key', None), rollup.observation_key(instance)})
+
+
+@receiver(post_delete, sender=Observation)
+def observation_post_delete(sender, instance, **kwargs):
+    try:
+        rollup.mark_dirty({rollup.observation_key(instance)})
+    except Visit.DoesNotExist:
+        pass
+
+
+@receiver(pre_save, sender=Visit)
+def visit_pre_save(sender, instance, raw=False, **kwargs):
+    """Запомнить ячейки куба, если у визита меняется дата начала или точка"""
+    instance._rollup_old_keys = None
+    if raw or not instance.pk:
+        return
+    old = Visit.objects.filter(pk=instance.pk).only('start_date', 'outlet_id').first()
+    if old and (old.start_date != instance.start_date or old.outlet_id != instance.outlet_id):
+        instance._rollup_old_keys = rollup.visit_keys(old)
+
+
+@receiver(post_save, sender=Visit)
+def visit_post_save(sender, instance, raw=False, **kwargs):
+    old_keys = getattr(instance, '_rollup_old_keys', None)
+    if raw or old_keys is None:
+        return
+    rollup.mark_dirty(old_keys | rollup.visit_keys(instance))
+
+
+def _ancestors(parent):
+    """Предки узла по его родителю (уровень, id): {уровень: id}, включая самого родителя"""
+    if parent is None:
+        return {}
+    parent_level, parent_id = parent
+    return closure.ancestors_of(parent_level, [parent_id]).get(parent_id, {parent_level: parent_id})
+
+
+def geo_node_pre_save(sender, instance, raw=False, **kwargs):
+    """Запомнить предков узла до переноса (значения метрик прежних предков нужно пересчитать)"""
+    instance._metric_old_ancestors = None
+    if raw or not instance.pk:
+        return
+    parent_field, _ = REPARENT_SCOPES[sender]
+    old_parent_id = sender.objects.filter(pk=instance.pk).values_list(parent_field, flat=True).first()
+    if old_parent_id != getattr(instance, parent_field):
+        parent_level = closure.PARENT_FIELDS[closure.MODEL_LEVELS[sender]]
+        instance._metric_old_ancestors = _ancestors((parent_level, old_parent_id) if old_parent_id else None)
+
+
+def geo_node_post_save(sender, instance, raw=False, **kwargs):
+    """Перенос узла гео-иерархии меняет состав поддеревьев - пересчитать метрики предков, сбросить кэш виджетов"""
+    # Флаг выставляется в visits.signals.geo_node_pre_save
+    if raw or not getattr(instance, '_geo_parent_changed', False):
+        return
+    old_ancestors = getattr(instance, '_metric_old_ancestors', None) or {}
+    metrics.mark_moved(closure.MODEL_LEVELS[sender], instance.pk, old_ancestors, _ancestors(closure.parent_of(instance)))
+    widget_cache.invalidate_all()
+
+
+for model in REPARENT_SCOPES:
+    pre_save.connect(geo_node_pre_save, sender=model, dispatch_uid=f'analytics_geo_pre_save_{model.__name__}')
+    post_save.connect(geo_node_post_save, sender=model, dispatch_uid=f'analytics_geo_post_save_{model.__name__}')
@@ -0,0 +1,334 @@
+"""
+Выполнение SQL запросов шаблонов отчетов (ReportTemplate.sql_query)
+
+Запрос пишет аналитик, пользователь передает только значения параметров:
+- в запросе допускается один SELECT / WITH без изменяющих команд; доступны
+  только таблицы приложений ANALYTICS_SQL_ALLOWED_APPS (пользователи, сессии,
+  настройки интеграций и системные каталоги СУБД недоступны);
+- параметры - именованные (:date_from, :outlet...) и всегда передаются
+  в БД отдельно от текста запроса, значения берутся из фильтров отчета;
+- запрос выполняется в транзакции только для чтения с ограничением времени
+  (ANALYTICS_SQL_TIMEOUT) и числа строк (ANALYTICS_SQL_MAX_ROWS), строки
+  читаются пачками через серверный курсор (PostgreSQL);
+- результат кэшируется по (шаблон, параметры, версия данных): версия данных -
+  версии областей кэша виджетов для узла и месяцев фильтра (analytics.widget_cache)
+  и версия гео-иерархии, поэтому изменение наблюдений сбрасывает результат.
+
+Параметры:
+- date_from, date_to - даты периода (локальные);
+- datetime_from, datetime_to - границы периода с временем;
+- country, region, city, district, channel, outlet - id выбранных узлов или NULL;
+- geo_level, geo_id - самый узкий выбранный узел (без выбора - NULL);
+- data_type - тип источника данных (MON / EXP / AI).
+
+Пример:
+    SELECT o.local_date AS day, COUNT(*) AS observations
+    FROM visits_observation o
+    WHERE o.local_date BETWEEN :date_from AND :date_to AND o.data_source_type = :data_type
+    GROUP BY o.local_date
+"""
+import hashlib
+import json
+import re
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, InterfaceError, OperationalError, connections, transaction
+from django.utils import timezone
+
+from geo import selectors
+from . import widget_cache, widgets
+
+KEY_PREFIX = 'analytics:sql'
+FETCH_CHUNK_SIZE = 1000
+
+PARAMETERS = [
+    'date_from', 'date_to', 'datetime_from', 'datetime_to',
+    'country', 'region', 'city', 'district', 'channel', 'outlet',
+    'geo_level', 'geo_id', 'data_type',
+]
+
+# Строковые литералы и комментарии | именованный параметр | знак процента
+TOKEN_RE = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/)|(?<![:\w]):([A-Za-z_]\w*)|(%)""",
+    re.DOTALL
+)
+LITERAL_RE = re.compile(r"""'(?:[^']|'')*'|--[^\n]*|/\*.*?\*/""", re.DOTALL)
+IDENTIFIER_RE = re.compile(r'"(?:[^"]|"")*"')
+
+FORBIDDEN_KEYWORDS = re.compile(
+    r'\b(INSERT|UPDATE|DELETE|MERGE|UPSERT|REPLACE|DROP|ALTER|CREATE|TRUNCATE|RENAME|GRANT|REVOKE|'
+    r'COPY|ATTACH|DETACH|PRAGMA|VACUUM|REINDEX|CALL|EXEC|EXECUTE|DO|SET|RESET|LOCK|LISTEN|NOTIFY|'
+    r'LOAD|INTO|OUTFILE|DUMPFILE|HANDLER)\b',
+    re.IGNORECASE
+)
+FORBIDDEN_FUNCTIONS = re.compile(
+    r'\b(pg_read_file|pg_read_binary_file|pg_ls_dir|pg_stat_file|lo_import|lo_export|dblink\w*|'
+    r'load_extension|load_file|sleep|pg_sleep\w*|benchmark)\s*\(',
+    re.IGNORECASE
+)
+# Служебные таблицы: пользователи, сессии, токены, системные каталоги СУБД
+FORBIDDEN_TABLES = re.compile(
+    r'\b((auth|django|token_blacklist|authtoken|users|sqlite)_\w+|pg_catalog|information_schema|'
+    r'performance_schema|mysql)\b',
+    re.IGNORECASE
+)
+WORD_RE = re.compile(r'[A-Za-z_][\w$]*')
+
+
+class SqlQueryError(ValueError):
+    """Запрос шаблона нельзя выполнить (недопустимый текст, параметры, ошибка или таймаут)"""
+
+
+def max_rows():
+    return getattr(settings, 'ANALYTICS_SQL_MAX_ROWS', 10000)
+
+
+def statement_timeout():
+    return getattr(settings, 'ANALYTICS_SQL_TIMEOUT', 30)
+
+
+def cache_timeout():
+    return getattr(settings, 'ANALYTICS_SQL_CACHE_TIMEOUT', 10 * 60)
+
+
+def allowed_apps():
+    """Приложения, таблицы которых доступны запросам шаблонов (данные аналитики, без пользователей)"""
+    return getattr(settings, 'ANALYTICS_SQL_ALLOWED_APPS', ['analytics', 'visits', 'geo', 'coefficients', 'catalog', 'forms'])
+
+
+def forbidden_tables():
+    """Таблицы моделей вне разрешенных приложений (пользователи, сессии, настройки интеграций...)"""
+    allowed = set(allowed_apps())
+    return {
+        model._meta.db_table.lower()
+        for model in apps.get_models(include_auto_created=True)
+        if model._meta.app_label not in allowed
+    }
+
+
+def database():
+    """Алиас БД для запросов аналитиков (например, реплика только для чтения)"""
+    return getattr(settings, 'ANALYTICS_SQL_DATABASE', 'default')
+
+
+# ============================================================================
+# Проверка и подготовка запроса
+# ============================================================================
+
+def validate(sql):
+    """Проверить текст запроса (SqlQueryError - недопустимый запрос). Возвращает текст без ';' в конце."""
+    sql = (sql or '').strip()
+    if sql.endswith(';'):
+        sql = sql[:-1].rstrip()
+    if not sql:
+        raise SqlQueryError('Пустой запрос')
+
+    code = LITERAL_RE.sub(' ', sql)
+    code_without_identifiers = IDENTIFIER_RE.sub(' ', code)
+
+    if ';' in code_without_identifiers:
+        raise SqlQueryError('Допускается только один запрос')
+    first_word = code_without_identifiers.split(None, 1)[0].upper()
+    if first_word not in ('SELECT', 'WITH') and not first_word.startswith('('):
+        raise SqlQueryError('Допускаются только запросы SELECT / WITH')
+
+    keyword = FORBIDDEN_KEYWORDS.search(code_without_identifiers)
+    if keyword:
+        raise SqlQueryError(f'Недопустимая команда в запросе: {keyword.group(1).upper()}')
+    function = FORBIDDEN_FUNCTIONS.search(code_without_identifiers)
+    if function:
+        raise SqlQueryError(f'Недопустимая функция в запросе: {function.group(1)}')
+    identifiers = code.replace('"', ' ').replace('`', ' ')
+    table = FORBIDDEN_TABLES.search(identifiers)
+    if table:
+        raise SqlQueryError(f'Служебные таблицы недоступны: {table.group(0)}')
+    # Разрешены только таблицы приложений аналитики (ANALYTICS_SQL_ALLOWED_APPS)
+    denied = forbidden_tables()
+    for word in WORD_RE.findall(identifiers):
+        if word.lower() in denied:
+            raise SqlQueryError(f'Таблица недоступна для запросов отчетов: {word}')
+
+    unknown = sorted(set(parameter_names(sql)) - set(PARAMETERS))
+    if unknown:
+        raise SqlQueryError(
+            f'Неизвестные параметры: {", ".join(unknown)} (доступны: {", ".join(PARAMETERS)})'
+        )
+    return sql
+
+
+def parameter_names(sql):
+    return [match.group(2) for match in TOKEN_RE.finditer(sql) if match.group(2)]
+
+
+def bind(sql, values):
+    """Именованные параметры → плейсхолдеры курсора Django: (текст, список значений)"""
+    params = []
+
+    def replace(match):
+        literal, name, percent = match.groups()
+        if literal is not None:
+            return literal.replace('%', '%%')
+        if name is not None:
+            params.append(values[name])
+            return '%s'
+        return '%%'
+
+    return TOKEN_RE.sub(replace, sql), params
+
+
+def parameters(filters):
+    """Значения параметров запроса из фильтров отчета / дашборда"""
+    values = {
+        'date_from': widget_cache._local_date(filters['date_from']),
+        'date_to': widget_cache._local_date(filters['date_to']),
+        'datetime_from': filters['date_from'],
+        'datetime_to': filters['date_to'],
+        'data_type': filters.get('data_type') or 'MON',
+        'geo_level': None,
+        'geo_id': None,
+    }
+    for level in widgets.GEO_LEVELS:
+        value = filters.get(level)
+        try:
+            values[level] = int(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            raise SqlQueryError(f'Некорректный id узла {level}: {value}')
+    for level in reversed(widgets.GEO_LEVELS):
+        if values[level] is not None:
+            values['geo_level'], values['geo_id'] = level, values[level]
+            break
+    return values
+
+
+# ============================================================================
+# Выполнение
+# ============================================================================
+
+def _json_value(value):
+    """Значение строки результата в виде, пригодном для JSON (Report.data, API)"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, datetime):
+        return (timezone.localtime(value) if timezone.is_aware(value) else value).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+def _cache_key(template, filters, values):
+    """Ключ результата: шаблон (текст запроса), параметры, версия данных"""
+    version_keys = widget_cache.scope_keys(filters)
+    watermark = cache.get_many(version_keys)
+    payload = json.dumps([
+        template.pk, template.sql_query,
+        widget_cache.normalize_filters(filters), values['data_type'],
+        [watermark.get(key) for key in version_keys], selectors.version(),
+    ], sort_keys=True, default=str)
+    return f'{KEY_PREFIX}:{template.pk}:{hashlib.sha1(payload.encode()).hexdigest()}'
+
+
+class _Limits:
+    """Транзакция только для чтения и таймаут запроса для конкретной СУБД"""
+
+    def __init__(self, connection, timeout):
+        self.connection = connection
+        self.timeout = timeout
+        self.deadline = None
+
+    def __enter__(self):
+        vendor = self.connection.vendor
+        self.deadline = time.monotonic() + self.timeout
+        with self.connection.cursor() as cursor:
+            if vendor == 'postgresql':
+                cursor.execute('SET TRANSACTION READ ONLY')
+                cursor.execute('SET LOCAL statement_timeout = %s', [int(self.timeout * 1000)])
+            elif vendor == 'mysql':
+                cursor.execute('SET TRANSACTION READ ONLY')
+                cursor.execute('SET SESSION max_execution_time = %s', [int(self.timeout * 1000)])
+            elif vendor == 'sqlite':
+                cursor.execute('PRAGMA query_only = ON')
+                # Прервать запрос после дедлайна (проверка каждые 10 000 инструкций VM)
+                self.connection.connection.set_progress_handler(
+                    lambda: int(time.monotonic() > self.deadline), 10000
+                )
+        return self
+
+    def __exit__(self, *exc_info):
+        vendor = self.connection.vendor
+        if vendor == 'mysql':
+            with self.connection.cursor() as cursor:
+                cursor.execute('SET SESSION max_execution_time = 0')
+        elif vendor == 'sqlite':
+            self.connection.connection.set_progress_handler(None, 0)
+            with self.connection.cursor() as cursor:
+                cursor.execute('PRAGMA query_only = OFF')
+
+    def timed_out(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline - 0.05
+
+
+def run(sql, values, limit=None):
+    """Выполнить проверенный запрос: {'columns', 'rows', 'truncated'}"""
+    sql = validate(sql)
+    limit = min(limit or max_rows(), max_rows())
+    query, params = bind(sql, values)
+    connection = connections[database()]
+
+    limits = _Limits(connection, statement_timeout())
+    rows = []
+    try:
+        with transaction.atomic(using=connection.alias):
+            with limits:
+                # На PostgreSQL - именованный (серверный) курсор: строки приходят пачками
+                with connection.chunked_cursor() as cursor:
+                    cursor.execute(query, params)
+                    columns = [column[0] for column in cursor.description or []]
+                    while len(rows) <= limit:
+                        chunk = cursor.fetchmany(min(FETCH_CHUNK_SIZE, limit + 1 - len(rows)))
+                        if not chunk:
+                            break
+                        rows.extend([_json_value(value) for value in row] for row in chunk)
+    except InterfaceError:
+        # Соединение с БД потеряно - ошибка временная, генерацию отчета можно повторить
+        raise
+    except DatabaseError as e:
+        if limits.timed_out():
+            raise SqlQueryError(f'Превышено время выполнения запроса ({statement_timeout()} с)')
+        if isinstance(e, OperationalError) and (connection.connection is None or not connection.is_usable()):
+            raise
+        raise SqlQueryError(f'Ошибка выполнения запроса: {e}')
+
+    return {'columns': columns, 'rows': rows[:limit], 'truncated': len(rows) > limit}
+
+
+def execute(template, filters, use_cache=True, limit=None):
+    """
+    Выполнить запрос шаблона с параметрами из фильтров.
+    Возвращает {'columns', 'rows', 'truncated', 'cached'}.
+    """
+    if not (template.sql_query or '').strip():
+        raise SqlQueryError(f'В шаблоне {template.code} нет SQL запроса')
+
+    values = parameters(filters)
+    key = f'{_cache_key(template, filters, values)}:{limit or max_rows()}'
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+    result = run(template.sql_query, values, limit=limit)
+    if use_cache:
+        cache.set(key, result, cache_timeout())
+    return dict(result, cached=False)
+
+
+def as_table(result):
+    """Результат запроса → строки таблицы отчета [{колонка: значение}]"""
+    return [dict(zip(result['columns'], row)) for row in result['rows']]
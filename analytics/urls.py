@@ -18,6 +18,8 @@ urlpatterns = [
     path('reports/<int:pk>/pdf/', views.ReportPDFView.as_view(), name='report_pdf'),
     path('reports/<int:pk>/excel/', views.ReportExcelView.as_view(), name='report_excel'),
     path('reports/<int:pk>/csv/', views.ReportCSVView.as_view(), name='report_csv'),
+    path('reports/<int:pk>/observations/csv/', views.ReportObservationsCSVView.as_view(), name='report_observations_csv'),
+    path('reports/<int:pk>/generate/', views.ReportGenerateView.as_view(), name='report_generate'),
     path('reports/create/', views.ReportCreateView.as_view(), name='report_create'),
     path('reports/<int:pk>/update/', views.ReportUpdateView.as_view(), name='report_update'),
     path('reports/<int:pk>/delete/', views.ReportDeleteView.as_view(), name='report_delete'),
@@ -0,0 +1,209 @@
+"""
+Кэш результатов виджетов дашбордов
+
+Ключ записи: (id дашборда, хэш конфигурации виджета, нормализованные фильтры),
+время жизни - Dashboard.refresh_interval (минуты, 0 - кэш отключен).
+
+Инвалидация выборочная: каждая запись хранит версии "областей", от которых
+зависит - (узел гео-иерархии из фильтров, месяц периода). При изменении
+наблюдений точки за день версии этой точки и всех её предков за этот месяц
+обновляются, и зависящие записи перестают совпадать. Поэтому правка данных
+одного района не сбрасывает кэш дашбордов других регионов.
+"""
+import hashlib
+import json
+import time
+from datetime import date
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from catalog import attribute_index
+from . import periods
+
+KEY_PREFIX = 'analytics:widget'
+EPOCH_KEY = f'{KEY_PREFIX}:epoch'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+# Уровни гео-иерархии от самого узкого к самому широкому
+GEO_LEVELS = ['outlet', 'channel', 'district', 'city', 'region', 'country']
+
+
+# ============================================================================
+# Ключи
+# ============================================================================
+
+def _hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _local_date(value):
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def normalize_filters(filters):
+    """
+    Фильтры в виде, пригодном для ключа кэша.
+    Период "до сейчас" не включает текущее время, иначе каждый запрос получал бы свой ключ.
+    """
+    normalized = {
+        key: str(value) for key, value in filters.items()
+        if key not in ('date_from', 'date_to', 'attributes') and value not in (None, '')
+    }
+    normalized['date_from'] = filters['date_from'].isoformat()
+    if periods.is_open_ended(filters['date_to']):
+        normalized['date_to'] = 'now'
+    else:
+        normalized['date_to'] = filters['date_to'].isoformat()
+    attributes = {code: value for code, value in (filters.get('attributes') or {}).items() if value}
+    if attributes:
+        normalized['attributes'] = attributes
+    return normalized
+
+
+def entry_key(dashboard_id, widget_config, filters_hash):
+    return f'{KEY_PREFIX}:{dashboard_id}:{_hash(widget_config)}:{filters_hash}'
+
+
+def version_key(level, node_id, month):
+    return f'{KEY_PREFIX}:version:{level}:{node_id}:{month}'
+
+
+def _months(day_from, day_to):
+    """Месяцы периода в формате YYYY-MM"""
+    months = []
+    current = date(day_from.year, day_from.month, 1)
+    while current <= day_to:
+        months.append(current.strftime('%Y-%m'))
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+    return months
+
+
+def scope_keys(filters):
+    """Ключи версий, от которых зависит результат виджета с такими фильтрами"""
+    level, node_id = 'all', 0
+    for candidate in GEO_LEVELS:
+        if filters.get(candidate):
+            level, node_id = candidate, filters[candidate]
+            break
+
+    day_from = _local_date(filters['date_from'])
+    day_to = max(_local_date(filters['date_to']), day_from)
+    keys = [EPOCH_KEY] + [version_key(level, node_id, month) for month in _months(day_from, day_to)]
+    # Результат с фильтром по атрибутам зависит и от индекса значений атрибутов
+    if any((filters.get('attributes') or {}).values()):
+        keys.append(attribute_index.VERSION_KEY)
+    return keys
+
+
+# ============================================================================
+# Чтение и запись
+# ============================================================================
+
+class WidgetCacheLookup:
+    """
+    Результат поиска виджетов дашборда в кэше.
+    Версии областей читаются до вычисления, поэтому запись, посчитанная
+    параллельно с изменением данных, не будет считаться актуальной.
+    """
+
+    def __init__(self, dashboard, widget_configs, filters, track_stats=True):
+        self.timeout = (dashboard.refresh_interval or 0) * 60
+        self.hits = {}
+        self.keys = {}
+        self.versions = {}
+        if not self.timeout:
+            return
+
+        filters_hash = _hash(normalize_filters(filters))
+        self.keys = {
+            index: entry_key(dashboard.pk, config, filters_hash)
+            for index, config in enumerate(widget_configs)
+        }
+        version_keys = scope_keys(filters)
+        current = cache.get_many(version_keys)
+        self.versions = {key: current.get(key) for key in version_keys}
+
+        entries = cache.get_many(list(self.keys.values()))
+        for index, key in self.keys.items():
+            entry = entries.get(key)
+            if entry is not None and entry['versions'] == self.versions:
+                self.hits[index] = entry['result']
+
+        # Прогреватель кэша (analytics.cache_warmer) не учитывается в статистике просмотров
+        if track_stats:
+            _count(HITS_KEY, len(self.hits))
+            _count(MISSES_KEY, len(self.keys) - len(self.hits))
+
+    def store(self, results):
+        """Сохранить вычисленные результаты {индекс: результат} (ошибки и заглушки не кэшируются)"""
+        if not self.timeout:
+            return
+        entries = {
+            self.keys[index]: {'versions': self.versions, 'result': result}
+            for index, result in results.items()
+            if result is not None and result.get('type') not in ('error', 'pending')
+        }
+        if entries:
+            cache.set_many(entries, self.timeout)
+
+
+def _count(key, amount):
+    if not amount:
+        return
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.set(key, amount, timeout=None)
+
+
+def stats():
+    """Счетчики попаданий/промахов кэша виджетов"""
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+# ============================================================================
+# Инвалидация
+# ============================================================================
+
+def invalidate_cells(cells):
+    """
+    Инвалидировать записи, зависящие от ячеек куба (день, коэффициент, точка, тип данных):
+    обновить версии точки и всех её предков за месяц каждой ячейки.
+    """
+    from geo import closure
+
+    cells = [cell for cell in cells if cell is not None]
+    if not cells:
+        return
+
+    ancestors = closure.ancestors_of('outlet', {outlet_id for _, _, outlet_id, _ in cells})
+
+    version = time.time_ns()
+    keys = set()
+    for day, _, outlet_id, _ in cells:
+        month = day.strftime('%Y-%m')
+        keys.add(version_key('all', 0, month))
+        for level, node_id in ancestors.get(outlet_id, {'outlet': outlet_id}).items():
+            if level in GEO_LEVELS:
+                keys.add(version_key(level, node_id, month))
+
+    cache.set_many({key: version for key in keys}, timeout=None)
+
+
+def invalidate_all():
+    """Инвалидировать все записи кэша виджетов"""
+    cache.set(EPOCH_KEY, time.time_ns(), timeout=None)
@@ -0,0 +1,542 @@
+"""
+Вычисление виджетов дашбордов (метрики, графики, таблицы)
+
+Агрегаты по возможности читаются из дневного куба (analytics.rollup),
+сырые наблюдения используются только когда куб не может ответить.
+evaluate_widgets() группирует виджеты дашборда с одинаковой группировкой
+и считает каждую группу одним запросом (coefficient_id × ключ группировки).
+Графики и таблицы по периодам группируются по локальному дню и сворачиваются
+в недели/месяцы/кварталы в analytics.periods.
+"""
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Sum, Min, Max
+
+from catalog import attribute_index
+from geo import closure
+from visits.models import Observation, to_local_date
+from . import metrics, periods, rollup, widget_cache
+from .models import ObservationDailyRollup
+
+
+# Уровни гео-иерархии в фильтрах дашборда
+GEO_LEVELS = ['country', 'region', 'city', 'district', 'channel', 'outlet']
+
+
+# Для сырых наблюдений предки точки денормализованы на визите (одно равенство вместо JOIN-цепочки)
+VISIT_GEO_LOOKUPS = [
+    ('country', 'visit__country_id'),
+    ('region', 'visit__region_id'),
+    ('city', 'visit__city_id'),
+    ('district', 'visit__district_id'),
+    ('channel', 'visit__channel_id'),
+    ('outlet', 'visit__outlet_id'),
+]
+
+# Поля группировки куба -> короткий путь от наблюдения (день - локальная дата визита на наблюдении)
+OBSERVATION_FIELDS = {
+    'day': 'local_date',
+    'outlet__channel__district__city__region__name': 'visit__region__name',
+    'outlet__channel__name': 'visit__channel__name',
+}
+
+
+def apply_geo_filters(queryset, filters, lookups=None):
+    """
+    Применить фильтры по гео-иерархии.
+    По умолчанию (ячейки куба) - подзапрос к замыканию иерархии по outlet,
+    lookups [(уровень, путь)] - прямые равенства по денормализованным полям.
+    """
+    if lookups is not None:
+        for key, lookup in lookups:
+            if filters.get(key):
+                queryset = queryset.filter(**{lookup: filters[key]})
+        return queryset
+
+    for level in GEO_LEVELS:
+        if filters.get(level):
+            queryset = closure.filter_under(queryset, level, filters[level])
+    return queryset
+
+
+def observation_field(field):
+    """Путь от наблюдения к полю куба (заданному относительно outlet)"""
+    return OBSERVATION_FIELDS.get(field, 'visit__' + field)
+
+
+def filter_observations(filters, coefficient_id=None):
+    """Сырые наблюдения с учетом фильтров дашборда"""
+    # ВАЖНО: Тип данных берется из фильтров (выбран пользователем на дашборде)
+    data_type = filters.get('data_type', 'MON')  # MON/EXP/AI
+
+    queryset = Observation.objects.filter(
+        visit__start_date__gte=filters['date_from'],
+        visit__start_date__lte=filters['date_to']
+    )
+    queryset = apply_geo_filters(queryset, filters, VISIT_GEO_LOOKUPS)
+
+    # Фильтр по атрибутам: множество товаров из инвертированного индекса
+    product_ids = attribute_index.resolve(filters.get('attributes'))
+    if product_ids is not None:
+        queryset = queryset.filter(attribute_index.id_condition('product_id', product_ids))
+
+    if coefficient_id:
+        queryset = queryset.filter(coefficient_id=coefficient_id)
+
+    # ВАЖНО: Фильтр по типу источника данных
+    if data_type in ['MON', 'EXP', 'AI']:
+        queryset = queryset.filter(data_source_type=data_type)
+
+    return queryset
+
+
+def filter_rollups(filters, coefficient_id=None):
+    """Ячейки дневного куба с учетом фильтров (None, если куб не может ответить)"""
+    if not rollup.can_answer(filters):
+        return None
+
+    data_type = filters.get('data_type', 'MON')
+    day_from, day_to = rollup.day_range(filters)
+
+    queryset = ObservationDailyRollup.objects.filter(day__gte=day_from, day__lte=day_to)
+    queryset = apply_geo_filters(queryset, filters)
+
+    if coefficient_id:
+        queryset = queryset.filter(coefficient_id=coefficient_id)
+    if data_type in ['MON', 'EXP', 'AI']:
+        queryset = queryset.filter(data_source_type=data_type)
+
+    return queryset
+
+
+# ============================================================================
+# Виды виджетов и группировки
+# ============================================================================
+
+CHART_WIDGET_TYPES = ['chart', 'line', 'bar', 'horizontalBar', 'pie', 'doughnut', 'polarArea', 'radar']
+
+# Группировки графика по гео-уровням: (поле от outlet, подпись для пустого значения)
+SEGMENT_GROUPS = {
+    'region': ('outlet__channel__district__city__region__name', 'Без региона'),
+    'channel': ('outlet__channel__name', 'Без канала'),
+    'outlet': ('outlet__name', 'Без точки'),
+}
+
+# Группировки строк таблицы: (поле имени от outlet, подпись для пустого значения)
+TABLE_GROUPS = {
+    'outlet': ('outlet__name', 'Без названия'),
+    'region': ('outlet__channel__district__city__region__name', 'Без региона'),
+    'channel': ('outlet__channel__name', 'Без канала'),
+}
+
+
+def widget_kind(config):
+    """Тип вычисления виджета: metric / chart / table / kpi (None для неизвестных типов)"""
+    widget_type = config.get('type')
+    if widget_type == 'metric':
+        return 'metric'
+    if widget_type in CHART_WIDGET_TYPES:
+        return 'chart'
+    if widget_type == 'table':
+        return 'table'
+    if widget_type == 'kpi':
+        return 'kpi'
+    return None
+
+
+def calculate_widget(config, filters):
+    """Вычислить один виджет"""
+    return compute_widgets([config], filters)[0]
+
+
+def error_widget(config, error):
+    return {
+        'type': 'error',
+        'title': config.get('title', 'Виджет'),
+        'error': str(error)
+    }
+
+
+# ============================================================================
+# Пакетное вычисление всех виджетов дашборда
+# ============================================================================
+
+def batch_dimensions(kind, config):
+    """
+    Поля группировки виджета (от outlet/ячейки куба) для пакетного запроса.
+    Периоды (день/неделя/месяц/квартал) группируются по дню и сворачиваются в Python.
+    None - неизвестная группировка, виджет возвращается пустым без запроса.
+    """
+    if kind == 'metric':
+        return ()
+    # KPI читаются из материализованных значений метрик (analytics.metrics), без запроса к кубу
+    if kind == 'kpi':
+        return None
+
+    group_by = config.get('group_by', 'date' if kind == 'chart' else 'outlet')
+    if group_by in periods.PERIOD_GROUPS:
+        return ('day',)
+    if kind == 'chart' and group_by in SEGMENT_GROUPS:
+        return (SEGMENT_GROUPS[group_by][0],)
+    if kind == 'table' and group_by == 'outlet':
+        return (TABLE_GROUPS['outlet'][0], 'outlet__code')
+    if kind == 'table' and group_by in TABLE_GROUPS:
+        return (TABLE_GROUPS[group_by][0],)
+    return None
+
+
+def plan_widgets(widget_configs):
+    """
+    Разбить виджеты на пакеты с общей группировкой.
+    Возвращает (пакеты {поля группировки: [(индекс, тип, конфиг)]}, без группировки [(индекс, тип, конфиг)]).
+    """
+    batches = {}
+    ungrouped = []
+    for index, config in enumerate(widget_configs):
+        kind = widget_kind(config)
+        if kind is None:
+            continue
+        dimensions = batch_dimensions(kind, config)
+        if dimensions is None:
+            ungrouped.append((index, kind, config))
+        else:
+            batches.setdefault(dimensions, []).append((index, kind, config))
+    return batches, ungrouped
+
+
+def evaluate_widgets(widget_configs, filters, dashboard=None, concurrent=False):
+    """
+    Вычислить все виджеты дашборда.
+    Количество запросов - по одному на группировку, а не на виджет.
+    Если передан dashboard, результаты берутся из кэша (см. analytics.widget_cache).
+    concurrent=True - пакеты считаются параллельно, не успевшие за таймаут виджеты
+    возвращаются заглушками type='pending' и попадают в кэш, когда досчитаются.
+    Виджеты с ошибками возвращаются как type='error', неизвестные типы пропускаются.
+    """
+    results = [None] * len(widget_configs)
+
+    lookup = None
+    if dashboard is not None:
+        lookup = widget_cache.WidgetCacheLookup(dashboard, widget_configs, filters)
+        for index, result in lookup.hits.items():
+            results[index] = result
+
+    pending = [index for index, result in enumerate(results) if result is None]
+    pending_configs = [widget_configs[index] for index in pending]
+    if concurrent:
+        def store_late(late_results):
+            lookup.store({pending[index]: result for index, result in late_results.items()})
+
+        computed = compute_widgets_concurrently(
+            pending_configs, filters, on_late=store_late if lookup is not None else None
+        )
+    else:
+        computed = compute_widgets(pending_configs, filters)
+    computed = dict(zip(pending, computed))
+    for index, result in computed.items():
+        results[index] = result
+
+    if lookup is not None:
+        lookup.store(computed)
+
+    return [result for result in results if result is not None]
+
+
+def compute_widgets(widget_configs, filters):
+    """Вычислить виджеты пакетными запросами; результат выровнен по входному списку (None - неизвестный тип)"""
+    results = [None] * len(widget_configs)
+    batches, ungrouped = plan_widgets(widget_configs)
+
+    for dimensions, members in batches.items():
+        for index, result in compute_batch(dimensions, members, filters).items():
+            results[index] = result
+
+    for index, kind, config in ungrouped:
+        results[index] = compute_ungrouped(kind, config, filters)
+
+    return results
+
+
+def compute_batch(dimensions, members, filters):
+    """Вычислить пакет виджетов с общей группировкой: {индекс: результат}"""
+    results = {}
+    coefficient_ids = {config.get('coefficient_id') for _, _, config in members}
+    try:
+        partials = fetch_partials(filters, dimensions, coefficient_ids)
+    except Exception as e:
+        return {index: error_widget(config, e) for index, _, config in members}
+
+    for index, kind, config in members:
+        try:
+            results[index] = fan_out(kind, config, partials, filters)
+        except Exception as e:
+            results[index] = error_widget(config, e)
+    return results
+
+
+def compute_ungrouped(kind, config, filters):
+    """Виджет вне пакетов: KPI из значений метрик или пустой результат неизвестной группировки"""
+    try:
+        if kind == 'kpi':
+            return metrics.kpi_widget(config, filters)
+        return fan_out(kind, config, {}, filters)
+    except Exception as e:
+        return error_widget(config, e)
+
+
+# ============================================================================
+# Параллельное вычисление
+# ============================================================================
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Общий пул потоков для виджетов: ограничивает число параллельных запросов к БД на процесс"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ANALYTICS_WIDGET_WORKERS', 4),
+                thread_name_prefix='analytics-widgets'
+            )
+    return _executor
+
+
+def _compute_batch_in_thread(dimensions, members, filters):
+    try:
+        return compute_batch(dimensions, members, filters)
+    finally:
+        # У каждого потока свое соединение с БД - не оставлять его открытым в пуле
+        connections.close_all()
+
+
+def pending_widget(config):
+    return {
+        'type': 'pending',
+        'title': config.get('title', 'Виджет'),
+    }
+
+
+def compute_widgets_concurrently(widget_configs, filters, timeout=None, on_late=None):
+    """
+    Как compute_widgets(), но пакеты считаются параллельно в общем пуле потоков.
+    Время ответа - как у самого медленного пакета, но не больше timeout секунд
+    (по умолчанию ANALYTICS_WIDGET_TIMEOUT). Виджеты пакетов, не успевших
+    за таймаут, возвращаются заглушками pending_widget(); когда такой пакет
+    досчитается, его результаты {индекс: результат} передаются в on_late.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'ANALYTICS_WIDGET_TIMEOUT', 10)
+
+    results = [None] * len(widget_configs)
+    batches, ungrouped = plan_widgets(widget_configs)
+
+    for index, kind, config in ungrouped:
+        results[index] = compute_ungrouped(kind, config, filters)
+
+    executor = get_executor()
+    futures = {
+        executor.submit(_compute_batch_in_thread, dimensions, members, filters): members
+        for dimensions, members in batches.items()
+    }
+    done, not_done = wait(futures, timeout=timeout)
+
+    for future in done:
+        for index, result in future.result().items():
+            results[index] = result
+
+    def deliver_late(future):
+        if not future.cancelled() and future.exception() is None:
+            on_late(future.result())
+
+    for future in not_done:
+        for index, _, config in futures[future]:
+            results[index] = pending_widget(config)
+        # Еще не начатые пакеты отменяются, начатые досчитываются для кэша
+        if not future.cancel() and on_late is not None:
+            future.add_done_callback(deliver_late)
+
+    return results
+
+
+def fetch_partials(filters, dimensions, coefficient_ids):
+    """
+    Один сгруппированный запрос по (coefficient_id, *dimensions).
+    Возвращает {coefficient_id: {ключ группировки: частичные агрегаты}}.
+    """
+    # Виджет без коэффициента агрегирует по всем коэффициентам
+    coefficient_filter = None if not all(coefficient_ids) else coefficient_ids
+
+    rollups = filter_rollups(filters)
+    if rollups is not None:
+        queryset = rollups
+        fields = list(dimensions)
+        aggregates = {
+            'row_count': Sum('row_count'),
+            'value_count': Sum('value_count'),
+            'value_sum': Sum('value_sum'),
+            'value_min': Min('value_min'),
+            'value_max': Max('value_max'),
+        }
+    else:
+        queryset = filter_observations(filters)
+        fields = [observation_field(name) for name in dimensions]
+        aggregates = {
+            'row_count': Count('id'),
+            'value_count': Count('value_numeric'),
+            'value_sum': Sum('value_numeric'),
+            'value_min': Min('value_numeric'),
+            'value_max': Max('value_numeric'),
+        }
+
+    if coefficient_filter is not None:
+        queryset = queryset.filter(coefficient_id__in=coefficient_filter)
+
+    partials = {}
+    for item in queryset.values('coefficient_id', *fields).annotate(**aggregates).order_by():
+        key = tuple(item[field] for field in fields)
+        partials.setdefault(item['coefficient_id'], {})[key] = {name: item[name] for name in aggregates}
+    return partials
+
+
+def _combine(left, right):
+    def pick(a, b, func):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return func(a, b)
+
+    return {
+        'row_count': (left['row_count'] or 0) + (right['row_count'] or 0),
+        'value_count': (left['value_count'] or 0) + (right['value_count'] or 0),
+        'value_sum': pick(left['value_sum'], right['value_sum'], lambda a, b: a + b),
+        'value_min': pick(left['value_min'], right['value_min'], min),
+        'value_max': pick(left['value_max'], right['value_max'], max),
+    }
+
+
+def _groups_for(partials, coefficient_id):
+    """Частичные агрегаты виджета по ключам группировки"""
+    if coefficient_id:
+        return partials.get(coefficient_id, {})
+    groups = {}
+    for coefficient_groups in partials.values():
+        for key, partial in coefficient_groups.items():
+            groups[key] = _combine(groups[key], partial) if key in groups else partial
+    return groups
+
+
+def _avg(partial):
+    if not partial['value_count'] or partial['value_sum'] is None:
+        return None
+    return float(partial['value_sum']) / partial['value_count']
+
+
+def _sorted_by_avg(groups, descending):
+    # NULL-значения идут последними при сортировке по убыванию и первыми по возрастанию
+    return sorted(
+        groups.items(),
+        key=lambda item: (_avg(item[1]) is not None, _avg(item[1]) or 0),
+        reverse=descending
+    )
+
+
+def _period_series(groups, period, filters):
+    """Значения по периодам без пропусков [(начало периода, частичные агрегаты или None)]"""
+    days = {key[0]: partial for key, partial in groups.items() if key[0] is not None}
+    grouped = periods.group_days(days, period, _combine)
+    day_from = to_local_date(filters['date_from'])
+    day_to = max(to_local_date(filters['date_to']), day_from)
+    return periods.fill_gaps(grouped, day_from, day_to, period)
+
+
+def fan_out(kind, config, partials, filters):
+    """Собрать результат виджета из частичных агрегатов пакетного запроса"""
+    groups = _groups_for(partials, config.get('coefficient_id'))
+
+    if kind == 'metric':
+        aggregation = config.get('aggregation', 'avg')
+        partial = groups.get(())
+        value = 0
+        if partial:
+            if aggregation == 'avg':
+                value = _avg(partial) or 0
+            elif aggregation == 'sum':
+                value = partial['value_sum'] or 0
+            elif aggregation == 'count':
+                value = partial['row_count'] or 0
+            elif aggregation == 'min':
+                value = partial['value_min'] or 0
+            elif aggregation == 'max':
+                value = partial['value_max'] or 0
+        return {
+            'type': 'metric',
+            'title': config.get('title', 'Метрика'),
+            'value': round(float(value), 2) if value else 0,
+            'unit': config.get('unit', ''),
+            'color': config.get('color', 'primary'),
+        }
+
+    if kind == 'chart':
+        group_by = config.get('group_by', 'date')
+        labels = []
+        values = []
+        if group_by in periods.PERIOD_GROUPS:
+            period = periods.PERIOD_GROUPS[group_by]
+            # Последние N периодов, пустые периоды - нули
+            series = _period_series(groups, period, filters)[-periods.PERIOD_LIMITS[period]:]
+            labels = [periods.period_label(start, period) for start, _ in series]
+            values = [(_avg(partial) or 0) if partial else 0 for _, partial in series]
+        elif group_by in SEGMENT_GROUPS:
+            empty_label = SEGMENT_GROUPS[group_by][1]
+            items = _sorted_by_avg(groups, descending=True)[:config.get('max_segments', 10)]
+            labels = [key[0] or empty_label for key, _ in items]
+            values = [_avg(partial) or 0 for _, partial in items]
+
+        return {
+            'type': 'chart',
+            'title': config.get('title', 'График'),
+            'chart_type': config.get('chart_type', config.get('type') or 'line'),
+            'labels': json.dumps(labels),
+            'values': json.dumps(values),
+            'color': config.get('color', 'rgba(75, 192, 192, 0.8)'),
+        }
+
+    group_by = config.get('group_by', 'outlet')
+    descending = config.get('sort', 'desc') == 'desc'
+    row_limit = config.get('row_limit', 10)
+    rows = []
+    if group_by in periods.PERIOD_GROUPS:
+        period = periods.PERIOD_GROUPS[group_by]
+        days = {key[0]: partial for key, partial in groups.items() if key[0] is not None}
+        grouped = periods.group_days(days, period, _combine)
+        for start, partial in _sorted_by_avg(grouped, descending)[:row_limit]:
+            avg_value = _avg(partial)
+            rows.append({
+                'name': periods.period_label(start, period, long=True),
+                'value': round(avg_value, 2) if avg_value else 0,
+                'count': partial['row_count'],
+            })
+    elif group_by in TABLE_GROUPS:
+        for key, partial in _sorted_by_avg(groups, descending)[:row_limit]:
+            avg_value = _avg(partial)
+            row = {'name': key[0] or TABLE_GROUPS[group_by][1]}
+            if group_by == 'outlet':
+                row['code'] = key[1] or '-'
+            row['value'] = round(avg_value, 2) if avg_value else 0
+            row['count'] = partial['row_count']
+            rows.append(row)
+
+    return {
+        'type': 'table',
+        'title': config.get('title', 'Таблица'),
+        'rows': rows,
+        'group_by': group_by,
+    }
@@ -5,6 +5,9 @@ Compatible with Select2 library format
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.db.models import Q, Count
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import etag
+from geo import closure, selectors
 from geo.models import GlobalMarket, Country, Region, City, District, Channel, Outlet
 from catalog.models import Brand, Category, Product, AttributeDefinition, AttributeGroup
 from coefficients.models import Coefficient
@@ -276,17 +279,13 @@ def ajax_outlets_by_channel(request):
     if channel_id:
         outlets = outlets.filter(channel_id=channel_id)
 
-    # Alternative filter by district (shows all outlets in district)
+    # Alternative filter by district / city / region (shows all outlets in the subtree, via geo closure)
     elif district_id:
-        outlets = outlets.filter(channel__district_id=district_id)
-
-    # Alternative filter by city (shows all outlets in city)
+        outlets = closure.filter_under(outlets, 'district', district_id, field='pk')
     elif city_id:
-        outlets = outlets.filter(channel__district__city_id=city_id)
-
-    # Alternative filter by region (shows all outlets in region)
+        outlets = closure.filter_under(outlets, 'city', city_id, field='pk')
     elif region_id:
-        outlets = outlets.filter(channel__district__city__region_id=region_id)
+        outlets = closure.filter_under(outlets, 'region', region_id, field='pk')
 
     # Search filter
     if search_term:
@@ -324,6 +323,34 @@ def ajax_outlets_by_channel(request):
     })
 
 
+def geo_selector_etag(request):
+    """ETag списка узлов: версия снимка иерархии + параметры запроса"""
+    return f"{selectors.version()}:{request.GET.urlencode()}"
+
+
+@login_required
+@etag(geo_selector_etag)
+def ajax_geo_selector(request):
+    """
+    Узлы уровня гео-иерархии для селекторов дашбордов (кэшированный снимок)
+    GET params: level, scope_level + scope (id выбранного предка), q (search term), page
+    """
+    level = request.GET.get('level', '').strip()
+    scope_level = request.GET.get('scope_level', '').strip() or None
+    search_term = request.GET.get('q', '').strip()
+    try:
+        scope_id = int(request.GET.get('scope') or 0) or None
+        page = max(int(request.GET.get('page', 1)), 1)
+        data = selectors.children(level, scope_level, scope_id, search_term, page)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    response = JsonResponse(data)
+    # Снимок меняется только с версией иерархии - браузер перепроверяет его по ETag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 # ============================================================================
 # CATALOG CASCADE: Brand → Category → Product
 # ============================================================================
@@ -499,15 +526,13 @@ def ajax_region_summary(request):
     try:
         region = Region.objects.get(pk=region_id)
 
-        # Count channels (through district -> city -> region)
-        channels_count = Channel.objects.filter(district__city__region_id=region_id).count()
-
-        # Count outlets (through channel -> district -> city -> region)
-        outlets_count = Outlet.objects.filter(channel__district__city__region_id=region_id).count()
+        # Count channels and outlets in the region subtree (geo closure, no join chain)
+        channels_count = closure.descendant_ids('region', region_id, 'channel').count()
+        outlets_count = closure.descendant_ids('region', region_id, 'outlet').count()
 
-        # Count visits
+        # Count visits (region denormalized on Visit - no join chain)
         from visits.models import Visit
-        visits_count = Visit.objects.filter(outlet__channel__district__city__region_id=region_id).count()
+        visits_count = Visit.objects.filter(region_id=region_id).count()
 
         return JsonResponse({
             'region': {
@@ -16,6 +16,7 @@ urlpatterns = [
     path('ajax/districts/', ajax_views.ajax_districts_by_city, name='ajax_districts_by_city'),
     path('ajax/channels/', ajax_views.ajax_channels_by_district, name='ajax_channels_by_district'),
     path('ajax/outlets/', ajax_views.ajax_outlets_by_channel, name='ajax_outlets_by_channel'),
+    path('ajax/geo-selector/', ajax_views.ajax_geo_selector, name='ajax_geo_selector'),
 
     # ============================================================================
     # CATALOG CASCADE: Brand → Category → Product
@@ -0,0 +1,312 @@
+"""
+Инвертированный индекс значений атрибутов товаров (ProductAttributeIndex)
+
+Для каждого атрибута и нормализованного значения хранится множество id
+товаров в виде битовой карты со смещением (бит N - товар с id base_id + N,
+base_id - наименьший id множества): размер карты зависит от разброса id
+товаров значения, а не от их абсолютной величины. Фильтр по нескольким
+атрибутам разрешается одним запросом к индексу и пересечением битовых карт,
+без JOIN на значения атрибутов для каждого параметра; дашборды и список
+товаров получают готовое множество id товаров и фильтруют по нему через
+id_condition (большое множество передается одним параметром-подзапросом).
+
+Индекс поддерживается сигналами (catalog.signals) при записи и удалении
+значений. После загрузок в обход сигналов (bulk_create, QuerySet.update) -
+python manage.py rebuild_attribute_index.
+"""
+import json
+import time
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import AttributeDefinition, ProductAttributeValue, ProductAttributeIndex
+
+# Версия индекса: меняется при любом изменении, по ней сбрасываются зависящие кэши
+VERSION_KEY = 'catalog:attribute_index:version'
+
+MAX_VALUE_LENGTH = 255
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on', 'да'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', 'нет'}
+
+# Множество id больше этого размера передается в запрос одним параметром (JSON массив),
+# а не списком параметров IN (лимит переменных SQLite, размер запроса)
+IN_LIST_LIMIT = 500
+
+# Подзапрос, разворачивающий JSON массив id в строки
+ID_SUBQUERIES = {
+    'sqlite': 'SELECT value FROM json_each(%s)',
+    'postgresql': 'SELECT jsonb_array_elements_text(%s::jsonb)::bigint',
+    'mysql': "SELECT id FROM JSON_TABLE(%s, '$[*]' COLUMNS (id BIGINT PATH '$')) AS ids",
+}
+
+
+# ============================================================================
+# Битовые карты
+# ============================================================================
+
+def to_bitmap(value):
+    """Битовая карта из значения BinaryField"""
+    return int.from_bytes(bytes(value or b''), 'little')
+
+
+def to_bytes(bitmap):
+    return bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+
+def ids_to_bitmap(ids, base=0):
+    """Битовая карта из множества id товаров (бит N - товар с id base + N)"""
+    ids = [product_id - base for product_id in ids]
+    if not ids:
+        return 0
+    buffer = bytearray(max(ids) // 8 + 1)
+    for offset in ids:
+        buffer[offset >> 3] |= 1 << (offset & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def bitmap_ids(bitmap, base=0):
+    """Множество id товаров битовой карты со смещением base"""
+    bits = bin(bitmap)[:1:-1]
+    ids = set()
+    position = bits.find('1')
+    while position != -1:
+        ids.add(base + position)
+        position = bits.find('1', position + 1)
+    return ids
+
+
+def normalize(bitmap, base):
+    """Сдвинуть карту так, чтобы бит 0 был наименьшим id. Возвращает (карта, смещение)."""
+    if not bitmap:
+        return 0, 0
+    shift = (bitmap & -bitmap).bit_length() - 1
+    return bitmap >> shift, base + shift
+
+
+def rebase(bitmap, base, new_base):
+    """Та же карта относительно меньшего смещения new_base"""
+    return bitmap << (base - new_base)
+
+
+# ============================================================================
+# Нормализация значений
+# ============================================================================
+
+def _text_key(value):
+    return ' '.join(str(value).split()).casefold()[:MAX_VALUE_LENGTH]
+
+
+def _decimal_key(value):
+    return format(Decimal(str(value)).normalize(), 'f')
+
+
+def value_keys(data_type, attribute_value):
+    """Ключи индекса для сохраненного значения атрибута (пустой список - не индексируется)"""
+    if data_type == AttributeDefinition.TYPE_TEXT:
+        values = [attribute_value.value_text]
+    elif data_type == AttributeDefinition.TYPE_INTEGER:
+        values = [attribute_value.value_integer]
+    elif data_type == AttributeDefinition.TYPE_DECIMAL:
+        value = attribute_value.value_decimal
+        return [_decimal_key(value)] if value is not None else []
+    elif data_type == AttributeDefinition.TYPE_BOOLEAN:
+        value = attribute_value.value_boolean
+        return [str(value).lower()] if value is not None else []
+    elif data_type == AttributeDefinition.TYPE_DATE:
+        value = attribute_value.value_date
+        return [value.isoformat()] if value is not None else []
+    elif data_type == AttributeDefinition.TYPE_CHOICE:
+        values = [attribute_value.value_choice]
+    elif data_type == AttributeDefinition.TYPE_MULTI_CHOICE:
+        values = attribute_value.value_multi_choice or []
+        if not isinstance(values, list):
+            values = [values]
+        # Для списков словарей (например, камни) индексируется первое значимое поле
+        values = [list(item.values())[0] if isinstance(item, dict) and item else item for item in values]
+    else:
+        return []
+
+    keys = {_text_key(value) for value in values if value not in (None, '') and not isinstance(value, (dict, list))}
+    keys.discard('')
+    return sorted(keys)
+
+
+def query_key(data_type, value):
+    """Ключ индекса для значения из фильтра. ValueError - значение не подходит типу атрибута."""
+    if data_type == AttributeDefinition.TYPE_INTEGER:
+        return str(int(value))
+    if data_type == AttributeDefinition.TYPE_DECIMAL:
+        try:
+            return _decimal_key(value)
+        except InvalidOperation:
+            raise ValueError(f'Некорректное число: {value}')
+    if data_type == AttributeDefinition.TYPE_BOOLEAN:
+        value = str(value).strip().lower()
+        if value in TRUE_VALUES:
+            return 'true'
+        if value in FALSE_VALUES:
+            return 'false'
+        raise ValueError(f'Некорректное булево значение: {value}')
+    if data_type == AttributeDefinition.TYPE_DATE:
+        return date.fromisoformat(str(value).strip()).isoformat()
+    if data_type == AttributeDefinition.TYPE_FILE:
+        raise ValueError('Файловые атрибуты не индексируются')
+    key = _text_key(value)
+    if not key:
+        raise ValueError('Пустое значение')
+    return key
+
+
+# ============================================================================
+# Выборка
+# ============================================================================
+
+def resolve(filters, by='code'):
+    """
+    Товары, подходящие под все фильтры {код атрибута (или id при by='id'): значение}.
+    Возвращает множество id товаров или None, если применимых фильтров нет.
+    Неизвестные атрибуты и значения, не подходящие типу атрибута, пропускаются.
+
+    Текстовые атрибуты ищутся по вхождению подстроки, остальные - по точному значению.
+    """
+    filters = {str(key): value for key, value in (filters or {}).items() if value not in (None, '')}
+    if by == 'id':
+        filters = {key: value for key, value in filters.items() if key.isdigit()}
+    if not filters:
+        return None
+
+    attributes = AttributeDefinition.objects.filter(**{f'{by}__in': list(filters)}).values_list('id', by, 'data_type')
+
+    conditions = Q()
+    attribute_ids = []
+    for attribute_id, key, data_type in attributes:
+        try:
+            index_key = query_key(data_type, filters[str(key)])
+        except ValueError:
+            continue
+        attribute_ids.append(attribute_id)
+        if data_type == AttributeDefinition.TYPE_TEXT:
+            conditions |= Q(attribute_id=attribute_id, value__contains=index_key)
+        else:
+            conditions |= Q(attribute_id=attribute_id, value=index_key)
+
+    if not attribute_ids:
+        return None
+
+    entries = list(ProductAttributeIndex.objects.filter(conditions).values_list(
+        'attribute_id', 'base_id', 'product_bitmap'
+    ))
+    if {attribute_id for attribute_id, _, _ in entries} != set(attribute_ids):
+        # У одного из атрибутов нет подходящих значений
+        return set()
+
+    # Карты приводятся к общему смещению; объединение значений внутри атрибута, пересечение между атрибутами
+    base = min(entry_base for _, entry_base, _ in entries)
+    matched = dict.fromkeys(attribute_ids, 0)
+    for attribute_id, entry_base, product_bitmap in entries:
+        matched[attribute_id] |= rebase(to_bitmap(product_bitmap), entry_base, base)
+
+    result = None
+    for bitmap in matched.values():
+        result = bitmap if result is None else result & bitmap
+        if not result:
+            return set()
+    return bitmap_ids(result, base)
+
+
+def id_condition(field, ids):
+    """
+    Условие «field входит в множество ids» для QuerySet.filter.
+    Небольшое множество - обычный IN со списком параметров; большое - подзапрос
+    по JSON массиву в одном параметре (SQLite ограничивает число переменных запроса).
+    """
+    ids = sorted(ids)
+    subquery = ID_SUBQUERIES.get(connection.vendor)
+    if len(ids) <= IN_LIST_LIMIT or subquery is None:
+        return Q(**{f'{field}__in': ids})
+    return Q(**{f'{field}__in': RawSQL(subquery, [json.dumps(ids)])})
+
+
+# ============================================================================
+# Поддержка индекса
+# ============================================================================
+
+def version():
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+    return cache.get(VERSION_KEY)
+
+
+def invalidate():
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+@transaction.atomic
+def update(attribute_id, product_id, old_keys, new_keys):
+    """Перенести товар из множеств старых значений атрибута в множества новых"""
+    old_keys, new_keys = set(old_keys), set(new_keys)
+    changed = old_keys ^ new_keys
+    if not changed:
+        return
+
+    entries = {
+        entry.value: entry
+        for entry in ProductAttributeIndex.objects.select_for_update().filter(attribute_id=attribute_id, value__in=changed)
+    }
+    for key in changed:
+        entry = entries.get(key) or ProductAttributeIndex(attribute_id=attribute_id, value=key, base_id=product_id)
+        bitmap, base = to_bitmap(entry.product_bitmap), entry.base_id
+        if key in new_keys:
+            if not bitmap:
+                base = product_id
+            elif product_id < base:
+                # Товар с id меньше смещения карты: карта сдвигается к новому смещению
+                bitmap, base = rebase(bitmap, base, product_id), product_id
+            bitmap |= 1 << (product_id - base)
+        elif product_id >= base:
+            bitmap &= ~(1 << (product_id - base))
+        bitmap, base = normalize(bitmap, base)
+        if not bitmap:
+            if entry.pk:
+                entry.delete()
+            continue
+        entry.product_bitmap = to_bytes(bitmap)
+        entry.base_id = base
+        entry.product_count = bitmap.bit_count()
+        entry.save()
+
+    transaction.on_commit(invalidate)
+
+
+@transaction.atomic
+def rebuild():
+    """Перестроить индекс целиком. Возвращает количество записей индекса."""
+    ProductAttributeIndex.objects.all().delete()
+
+    products = {}
+    values = ProductAttributeValue.objects.select_related('attribute').only(
+        'product_id', 'attribute__data_type',
+        'value_text', 'value_integer', 'value_decimal', 'value_boolean',
+        'value_date', 'value_choice', 'value_multi_choice',
+    )
+    for attribute_value in values.iterator(chunk_size=2000):
+        for key in value_keys(attribute_value.attribute.data_type, attribute_value):
+            products.setdefault((attribute_value.attribute_id, key), set()).add(attribute_value.product_id)
+
+    ProductAttributeIndex.objects.bulk_create(
+        [
+            ProductAttributeIndex(
+                attribute_id=attribute_id, value=key, base_id=min(ids),
+                product_bitmap=to_bytes(ids_to_bitmap(ids, min(ids))), product_count=len(ids)
+            )
+            for (attribute_id, key), ids in products.items()
+        ],
+        batch_size=1000
+    )
+    transaction.on_commit(invalidate)
+    return len(products)
@@ -0,0 +1,18 @@
+"""
+Management command для перестроения инвертированного индекса значений атрибутов (ProductAttributeIndex)
+
+Нужна после загрузки значений атрибутов в обход сигналов (loaddata, bulk_create,
+QuerySet.update), после смены типа данных атрибута и для первоначального заполнения.
+"""
+from django.core.management.base import BaseCommand
+
+from catalog import attribute_index
+
+
+class Command(BaseCommand):
+    help = 'Перестроить инвертированный индекс значений атрибутов товаров'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Перестраиваем индекс значений атрибутов...')
+        count = attribute_index.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Готово: записано {count} значений'))
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_index(apps, schema_editor):
+    """Построить индекс по существующим значениям атрибутов"""
+    from catalog.attribute_index import value_keys, ids_to_bitmap, to_bytes
+
+    ProductAttributeValue = apps.get_model('catalog', 'ProductAttributeValue')
+    ProductAttributeIndex = apps.get_model('catalog', 'ProductAttributeIndex')
+
+    products = {}
+    for attribute_value in ProductAttributeValue.objects.select_related('attribute').iterator():
+        for key in value_keys(attribute_value.attribute.data_type, attribute_value):
+            products.setdefault((attribute_value.attribute_id, key), set()).add(attribute_value.product_id)
+
+    ProductAttributeIndex.objects.bulk_create(
+        [
+            ProductAttributeIndex(
+                attribute_id=attribute_id, value=key,
+                product_bitmap=to_bytes(ids_to_bitmap(ids)), product_count=len(ids)
+            )
+            for (attribute_id, key), ids in products.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_remove_attributedefinition_data_source_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAttributeIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=255, verbose_name='Нормализованное значение')),
+                ('product_bitmap', models.BinaryField(default=b'', verbose_name='Битовая карта товаров')),
+                ('product_count', models.PositiveIntegerField(default=0, verbose_name='Количество товаров')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('attribute', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_entries', to='catalog.attributedefinition', verbose_name='Атрибут')),
+            ],
+            options={
+                'verbose_name': 'Индекс значения атрибута',
+                'verbose_name_plural': 'Индекс значений атрибутов',
+                'unique_together': {('attribute', 'value')},
+            },
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
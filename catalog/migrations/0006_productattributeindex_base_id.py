@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+def rebase_bitmaps(apps, schema_editor):
+    """Карты с абсолютными id (бит N - товар N) → карты со смещением от наименьшего id"""
+    from catalog.attribute_index import normalize, to_bitmap, to_bytes
+
+    ProductAttributeIndex = apps.get_model('catalog', 'ProductAttributeIndex')
+    for entry in ProductAttributeIndex.objects.iterator():
+        bitmap, base = normalize(to_bitmap(entry.product_bitmap), 0)
+        entry.product_bitmap, entry.base_id = to_bytes(bitmap), base
+        entry.save(update_fields=['product_bitmap', 'base_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_productattributeindex'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productattributeindex',
+            name='base_id',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Наименьший id товара'),
+        ),
+        migrations.RunPython(rebase_bitmaps, migrations.RunPython.noop),
+    ]
@@ -416,3 +416,31 @@ class CategoryAttributeTemplate(models.Model):
     def __str__(self):
         required = " *" if self.is_required else ""
         return f"{self.category.name} / {self.attribute.name}{required}"
+
+
+class ProductAttributeIndex(models.Model):
+    """
+    Инвертированный индекс значений атрибутов (catalog.attribute_index):
+    атрибут + нормализованное значение → множество id товаров.
+    Множество хранится битовой картой со смещением (бит N - товар с id base_id + N).
+    """
+    attribute = models.ForeignKey(
+        AttributeDefinition,
+        on_delete=models.CASCADE,
+        related_name='index_entries',
+        verbose_name='Атрибут'
+    )
+    value = models.CharField('Нормализованное значение', max_length=255)
+    base_id = models.PositiveBigIntegerField('Наименьший id товара', default=0)
+    product_bitmap = models.BinaryField('Битовая карта товаров', default=b'')
+    product_count = models.PositiveIntegerField('Количество товаров', default=0)
+
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Индекс значения атрибута'
+        verbose_name_plural = 'Индекс значений атрибутов'
+        unique_together = ['attribute', 'value']
+
+    def __str__(self):
+        return f"{self.attribute_id} = {self.value} ({self.product_count})"
@@ -0,0 +1,48 @@
+"""
+Сигналы каталога: поддержание инвертированного индекса значений атрибутов
+(catalog.attribute_index) при записи и удалении ProductAttributeValue
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import attribute_index
+from .models import AttributeDefinition, ProductAttributeValue
+
+
+def _data_type(attribute_id):
+    return AttributeDefinition.objects.filter(pk=attribute_id).values_list('data_type', flat=True).first()
+
+
+@receiver(pre_save, sender=ProductAttributeValue)
+def attribute_value_pre_save(sender, instance, raw=False, **kwargs):
+    """Запомнить ключи индекса прежнего значения"""
+    instance._index_old = None
+    if raw or not instance.pk:
+        return
+    old = ProductAttributeValue.objects.filter(pk=instance.pk).select_related('attribute').first()
+    if old:
+        instance._index_old = (
+            old.attribute_id, old.product_id, attribute_index.value_keys(old.attribute.data_type, old)
+        )
+
+
+@receiver(post_save, sender=ProductAttributeValue)
+def attribute_value_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    new_keys = attribute_index.value_keys(_data_type(instance.attribute_id), instance)
+    old = getattr(instance, '_index_old', None)
+    if old and old[:2] != (instance.attribute_id, instance.product_id):
+        # Значение перенесено на другой товар или атрибут
+        attribute_index.update(old[0], old[1], old[2], [])
+        old = None
+    attribute_index.update(instance.attribute_id, instance.product_id, old[2] if old else [], new_keys)
+
+
+@receiver(post_delete, sender=ProductAttributeValue)
+def attribute_value_post_delete(sender, instance, **kwargs):
+    data_type = _data_type(instance.attribute_id)
+    if data_type:
+        attribute_index.update(
+            instance.attribute_id, instance.product_id, attribute_index.value_keys(data_type, instance), []
+        )
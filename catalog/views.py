@@ -4,6 +4,7 @@ from django.urls import reverse_lazy
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.db import transaction
 
+from . import attribute_index
 from .models import Brand, Category, Product
 from .forms import BrandForm, CategoryForm, ProductForm, ProductAttributeValueFormSet
 
@@ -146,41 +147,11 @@ class ProductListView(LoginRequiredMixin, ListView):
         if status:
             queryset = queryset.filter(status=status)
 
-        # Filter by attribute values
-        for key, value in self.request.GET.items():
-            if key.startswith('attr_') and value:
-                attr_id = key.replace('attr_', '')
-                try:
-                    from .models import AttributeDefinition, ProductAttributeValue
-                    attr_def = AttributeDefinition.objects.get(id=attr_id)
-
-                    # Build filter based on attribute type
-                    if attr_def.data_type == 'text':
-                        product_ids = ProductAttributeValue.objects.filter(
-                            attribute_id=attr_id,
-                            value_text__icontains=value
-                        ).values_list('product_id', flat=True)
-                    elif attr_def.data_type == 'integer':
-                        product_ids = ProductAttributeValue.objects.filter(
-                            attribute_id=attr_id,
-                            value_integer=int(value)
-                        ).values_list('product_id', flat=True)
-                    elif attr_def.data_type == 'decimal':
-                        product_ids = ProductAttributeValue.objects.filter(
-                            attribute_id=attr_id,
-                            value_decimal=float(value)
-                        ).values_list('product_id', flat=True)
-                    elif attr_def.data_type == 'choice':
-                        product_ids = ProductAttributeValue.objects.filter(
-                            attribute_id=attr_id,
-                            value_choice=value
-                        ).values_list('product_id', flat=True)
-                    else:
-                        continue
-
-                    queryset = queryset.filter(id__in=product_ids)
-                except (AttributeDefinition.DoesNotExist, ValueError):
-                    continue
+        # Filter by attribute values: product ids resolved from the attribute inverted index
+        attribute_filters = {key[5:]: value for key, value in self.request.GET.items() if key.startswith('attr_')}
+        product_ids = attribute_index.resolve(attribute_filters, by='id')
+        if product_ids is not None:
+            queryset = queryset.filter(attribute_index.id_condition('id', product_ids))
 
         # Search by name or SKU
         search = self.request.GET.get('search')
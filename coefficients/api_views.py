@@ -1,8 +1,13 @@
 """
 DRF ViewSets for COEFFICIENTS app
 """
+from datetime import datetime
+
 from rest_framework import viewsets, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 
 from .models import Coefficient, Metric, Formula, Rule
@@ -46,3 +51,29 @@ class RuleViewSet(viewsets.ModelViewSet):
     filterset_fields = ['condition_type', 'is_active']
     search_fields = ['name']
     ordering = ['name']
+
+    @action(detail=True, methods=['get'])
+    def execute(self, request, pk=None):
+        """
+        Выполнить правило агрегации за период для всех уровней иерархии.
+        Параметры: period (day/week/month/quarter, по умолчанию month), date - дата внутри периода (YYYY-MM-DD).
+        """
+        from analytics import periods, rules
+
+        period = request.query_params.get('period', 'month')
+        if period not in periods.PERIOD_LIMITS:
+            raise ValidationError({'period': f'Ожидается одно из: {", ".join(periods.PERIOD_LIMITS)}'})
+        try:
+            day = datetime.strptime(request.query_params['date'], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            raise ValidationError({'date': 'Ожидается дата в формате YYYY-MM-DD'})
+
+        try:
+            result = rules.execute(self.get_object(), period, periods.period_start(day, period))
+        except ValueError as e:
+            raise ValidationError({'rule': str(e)})
+        return Response({
+            'period': period,
+            'period_start': result.start,
+            'values': result.as_rows(),
+        })
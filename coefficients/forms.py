@@ -1,4 +1,5 @@
 from django import forms
+from . import formulas
 from .models import Coefficient, Metric, Formula, Rule
 
 
@@ -162,6 +163,14 @@ class FormulaForm(forms.ModelForm):
         self.fields['coefficients'].help_text = 'Выберите коэффициенты, используемые в этой формуле (Ctrl+Click для множественного выбора)'
         self.fields['coefficients'].required = False
 
+    def clean_expression(self):
+        expression = self.cleaned_data['expression']
+        try:
+            formulas.compile_expression(expression)
+        except formulas.FormulaError as e:
+            raise forms.ValidationError(str(e))
+        return expression
+
 
 class RuleForm(forms.ModelForm):
     """Form for Rule model"""
@@ -0,0 +1,356 @@
+"""
+Вычисление формул (Formula.expression)
+
+Выражение разбирается один раз в AST, проверяется по белому списку узлов
+и компилируется в дерево функций над массивами NumPy. Скомпилированная
+формула кэшируется по (Formula.id, Formula.updated_at) и за один вызов
+считается сразу для всех точек / периодов: входы - массивы агрегатов
+коэффициентов одинаковой длины, результат - массив той же длины.
+
+Переменные выражения - коды коэффициентов (premium_items_count) или
+обозначения из Formula.settings['coefficient_map'] ({'C1': 'код коэффициента'}).
+
+Семантика:
+- пропущенное значение - NaN; отсутствующий вход целиком - все значения пропущены;
+- арифметика и сравнения с пропущенным значением дают пропущенное значение,
+  coalesce(x, 0) подставляет значение по умолчанию;
+- деление (и остаток) на ноль дают пропущенное значение, а не бесконечность;
+- любой нечисловой результат (inf, переполнение) считается пропущенным.
+
+Поддерживаются: числа, + - * / % **, унарный минус, сравнения (1 - да, 0 - нет),
+and / or / not, "a if условие else b", функции abs, min, max, round, coalesce.
+"""
+import ast
+import math
+import threading
+
+import numpy as np
+
+MAX_EXPRESSION_LENGTH = 2000
+
+
+class FormulaError(ValueError):
+    """Некорректное выражение формулы"""
+
+
+# ============================================================================
+# Операции над массивами
+# ============================================================================
+
+def _missing(*operands):
+    """Маска пропущенных значений операндов"""
+    mask = False
+    for operand in operands:
+        mask = mask | np.isnan(operand)
+    return mask
+
+
+def _with_missing(result, *operands):
+    """Результат логической операции (1.0 / 0.0) с пропущенными значениями операндов"""
+    result = np.asarray(result, dtype=float)
+    mask = _missing(*operands)
+    if np.any(mask):
+        result = np.where(mask, np.nan, result)
+    return result
+
+
+def divide(a, b):
+    """Поэлементное деление; деление на ноль - пропущенное значение"""
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    out = np.full(a.shape, np.nan)
+    return np.divide(a, b, out=out, where=(b != 0))
+
+
+def _mod(a, b):
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=float), np.asarray(b, dtype=float))
+    out = np.full(a.shape, np.nan)
+    return np.mod(a, b, out=out, where=(b != 0))
+
+
+def _coalesce(*values):
+    result = values[0]
+    for value in values[1:]:
+        result = np.where(np.isnan(result), value, result)
+    return result
+
+
+def _min(*values):
+    result = values[0]
+    for value in values[1:]:
+        result = np.minimum(result, value)
+    return result
+
+
+def _max(*values):
+    result = values[0]
+    for value in values[1:]:
+        result = np.maximum(result, value)
+    return result
+
+
+def _round(value, digits=0):
+    return np.round(value, int(digits))
+
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: divide,
+    ast.Mod: _mod,
+    ast.Pow: np.power,
+}
+
+COMPARE_OPERATORS = {
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+}
+
+# Функция: (реализация, минимум аргументов, максимум аргументов или None)
+FUNCTIONS = {
+    'abs': (np.abs, 1, 1),
+    'min': (_min, 2, None),
+    'max': (_max, 2, None),
+    'round': (_round, 1, 2),
+    'coalesce': (_coalesce, 2, None),
+}
+
+
+# ============================================================================
+# Компиляция
+# ============================================================================
+
+class CompiledFormula:
+    """Скомпилированное выражение: function(env) над массивами, names - используемые переменные"""
+
+    def __init__(self, expression, function, names):
+        self.expression = expression
+        self.function = function
+        self.names = frozenset(names)
+
+    def __repr__(self):
+        return f'<CompiledFormula {self.expression!r}>'
+
+
+def _round_digits(node):
+    """Число знаков round - целая константа (одно значение на весь массив)"""
+    sign = 1
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        sign = -1 if isinstance(node.op, ast.USub) else 1
+        node = node.operand
+    value = node.value if isinstance(node, ast.Constant) else None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise FormulaError('Число знаков round должно быть целой константой')
+    return sign * value
+
+
+def _compile_node(node, names):
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise FormulaError(f'Недопустимая константа: {node.value!r}')
+        try:
+            value = float(node.value)
+        except OverflowError:
+            value = math.inf
+        if not math.isfinite(value):
+            raise FormulaError('Недопустимая константа: число вне допустимого диапазона')
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in FUNCTIONS:
+            raise FormulaError(f'Функция {name} используется без вызова')
+        names.add(name)
+        return lambda env: env[name]
+
+    if isinstance(node, ast.BinOp):
+        operator = BINARY_OPERATORS.get(type(node.op))
+        if operator is None:
+            raise FormulaError(f'Недопустимая операция: {type(node.op).__name__}')
+        left, right = _compile_node(node.left, names), _compile_node(node.right, names)
+        return lambda env: operator(left(env), right(env))
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, names)
+        if isinstance(node.op, ast.USub):
+            return lambda env: np.negative(operand(env))
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        if isinstance(node.op, ast.Not):
+            def logical_not(env):
+                value = operand(env)
+                return _with_missing(value == 0, value)
+            return logical_not
+        raise FormulaError(f'Недопустимая операция: {type(node.op).__name__}')
+
+    if isinstance(node, ast.Compare):
+        operands = [_compile_node(node.left, names)] + [_compile_node(item, names) for item in node.comparators]
+        operators = []
+        for op in node.ops:
+            operator = COMPARE_OPERATORS.get(type(op))
+            if operator is None:
+                raise FormulaError(f'Недопустимое сравнение: {type(op).__name__}')
+            operators.append(operator)
+
+        def compare(env):
+            values = [operand(env) for operand in operands]
+            result = True
+            for operator, left, right in zip(operators, values, values[1:]):
+                result = np.logical_and(result, operator(left, right))
+            return _with_missing(result, *values)
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile_node(value, names) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def bool_op(env):
+            values = [operand(env) for operand in operands]
+            result = values[0] != 0
+            for value in values[1:]:
+                result = combine(result, value != 0)
+            return _with_missing(result, *values)
+        return bool_op
+
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = (
+            _compile_node(node.test, names), _compile_node(node.body, names), _compile_node(node.orelse, names)
+        )
+
+        def if_exp(env):
+            condition = test(env)
+            result = np.where(condition != 0, body(env), orelse(env))
+            return np.where(np.isnan(condition), np.nan, result)
+        return if_exp
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise FormulaError(f'Недопустимый вызов: {ast.unparse(node.func)}')
+        function, min_args, max_args = FUNCTIONS[node.func.id]
+        if len(node.args) < min_args or (max_args is not None and len(node.args) > max_args):
+            raise FormulaError(f'Неверное количество аргументов {node.func.id}: {len(node.args)}')
+        if node.func.id == 'round' and len(node.args) == 2:
+            _round_digits(node.args[1])
+        arguments = [_compile_node(argument, names) for argument in node.args]
+        return lambda env: function(*(argument(env) for argument in arguments))
+
+    raise FormulaError(f'Недопустимый элемент выражения: {type(node).__name__}')
+
+
+def compile_expression(expression):
+    """Разобрать и скомпилировать выражение (FormulaError - если выражение некорректно)"""
+    expression = (expression or '').strip()
+    if not expression:
+        raise FormulaError('Пустое выражение')
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise FormulaError(f'Выражение длиннее {MAX_EXPRESSION_LENGTH} символов')
+
+    try:
+        tree = ast.parse(expression, mode='eval')
+        names = set()
+        function = _compile_node(tree.body, names)
+    except SyntaxError as e:
+        raise FormulaError(f'Синтаксическая ошибка: {e.msg}')
+    except RecursionError:
+        raise FormulaError('Слишком глубокая вложенность выражения')
+    return CompiledFormula(expression, function, names)
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled_formula(formula):
+    """Скомпилированное выражение формулы (кэш по id и дате обновления)"""
+    if formula.pk is None:
+        return compile_expression(formula.expression)
+
+    key = (formula.pk, formula.updated_at)
+    with _compiled_lock:
+        entry = _compiled.get(formula.pk)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+
+    compiled = compile_expression(formula.expression)
+    with _compiled_lock:
+        _compiled[formula.pk] = (key, compiled)
+    return compiled
+
+
+# ============================================================================
+# Вычисление
+# ============================================================================
+
+def evaluate(compiled, inputs, size=None):
+    """
+    Посчитать выражение для массивов входов {переменная: массив или число}.
+    Возвращает массив float64 длины size (по умолчанию - длина входов); NaN - значение не определено.
+    """
+    arrays = {name: np.asarray(value, dtype=float) for name, value in inputs.items()}
+    if size is None:
+        size = max((array.size for array in arrays.values() if array.ndim), default=1)
+
+    missing = np.full(size, np.nan)
+    env = {name: arrays.get(name, missing) for name in compiled.names}
+    with np.errstate(all='ignore'):
+        result = np.array(np.broadcast_to(compiled.function(env), (size,)), dtype=float)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def variable_codes(formula):
+    """Переменные выражения формулы → коды коэффициентов"""
+    mapping = (formula.settings or {}).get('coefficient_map') or {}
+    return {name: mapping.get(name, name) for name in compiled_formula(formula).names}
+
+
+def calculate(formula, inputs, size=None):
+    """
+    Посчитать формулу для массивов агрегатов {код коэффициента: массив}.
+    Обозначения из coefficient_map (C1, C2...) подставляются по кодам коэффициентов.
+    """
+    compiled = compiled_formula(formula)
+    env = {
+        name: inputs[code]
+        for name, code in variable_codes(formula).items()
+        if code in inputs
+    }
+    return evaluate(compiled, env, size=size if size is not None else _inputs_size(inputs))
+
+
+def _inputs_size(inputs):
+    sizes = [np.size(value) for value in inputs.values() if np.ndim(value)]
+    return max(sizes, default=1)
+
+
+def pivot(rows):
+    """
+    Строки (ключ, код коэффициента, значение) → (ключи, {код коэффициента: массив}).
+    Массивы выровнены по ключам; значения, которых нет в строках, - NaN.
+    """
+    key_index = {}
+    columns = {}
+    for key, code, value in rows:
+        position = key_index.setdefault(key, len(key_index))
+        column = columns.setdefault(code, ([], []))
+        column[0].append(position)
+        column[1].append(np.nan if value is None else float(value))
+
+    size = len(key_index)
+    arrays = {}
+    for code, (positions, values) in columns.items():
+        array = np.full(size, np.nan)
+        array[positions] = values
+        arrays[code] = array
+    return list(key_index), arrays
+
+
+def to_values(array, digits=None):
+    """Массив результата → список чисел, None для пропущенных значений"""
+    if digits is not None:
+        array = np.round(array, digits)
+    return [None if np.isnan(value) else value for value in array.tolist()]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coefficients', '0003_metric_source_data_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='coefficient',
+            index=models.Index(fields=['updated_at', 'id'], name='coefficient_updated_3e38b2_idx'),
+        ),
+    ]
@@ -55,6 +55,8 @@ class Coefficient(models.Model):
         indexes = [
             models.Index(fields=['code']),
             models.Index(fields=['data_type']),
+            # Лента изменений оффлайн клиента (core.changes)
+            models.Index(fields=['updated_at', 'id']),
         ]
 
     def __str__(self):
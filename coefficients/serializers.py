@@ -2,6 +2,7 @@
 DRF Serializers for COEFFICIENTS app models
 """
 from rest_framework import serializers
+from . import formulas
 from .models import Coefficient, Metric, Formula, Rule
 
 
@@ -30,6 +31,13 @@ class FormulaSerializer(serializers.ModelSerializer):
         model = Formula
         fields = '__all__'
 
+    def validate_expression(self, value):
+        try:
+            formulas.compile_expression(value)
+        except formulas.FormulaError as e:
+            raise serializers.ValidationError(str(e))
+        return value
+
 
 class RuleSerializer(serializers.ModelSerializer):
     """Serializer for Rule model"""
@@ -1,9 +1,10 @@
 from rest_framework.routers import DefaultRouter
-from .api_views import SystemSettingsViewSet, IntegrationSettingsViewSet, SystemLogViewSet, AuditLogViewSet
+from .api_views import SystemSettingsViewSet, IntegrationSettingsViewSet, SystemLogViewSet, AuditLogViewSet, ChangesViewSet
 
 router = DefaultRouter()
 router.register(r'system-settings', SystemSettingsViewSet, basename='systemsettings')
 router.register(r'integration-settings', IntegrationSettingsViewSet, basename='integrationsettings')
 router.register(r'system-logs', SystemLogViewSet, basename='systemlog')
 router.register(r'audit-logs', AuditLogViewSet, basename='auditlog')
+router.register(r'changes', ChangesViewSet, basename='changes')
 urlpatterns = router.urls
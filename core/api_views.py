@@ -1,6 +1,9 @@
 from rest_framework import viewsets, filters
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from . import changes
 from .models import SystemSettings, IntegrationSettings, SystemLog, AuditLog
 from .serializers import SystemSettingsSerializer, IntegrationSettingsSerializer, SystemLogSerializer, AuditLogSerializer
 
@@ -36,3 +39,31 @@ class AuditLogViewSet(viewsets.ModelViewSet):
     filterset_fields = ['user', 'action', 'model_name']
     search_fields = ['model_name', 'changes']
     ordering = ['-timestamp']
+
+
+class ChangesViewSet(viewsets.ViewSet):
+    """
+    Лента изменений справочников для оффлайн клиента.
+    GET ?cursor=<курсор прошлого ответа>&limit=500&models=outlets,visit_types,coefficients,form_templates
+    """
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request):
+        try:
+            limit = int(request.query_params.get('limit') or changes.DEFAULT_LIMIT)
+        except ValueError:
+            raise ValidationError({'limit': 'Должно быть целым числом'})
+        names = request.query_params.get('models')
+        names = [name.strip() for name in names.split(',') if name.strip()] if names else None
+        if names:
+            unknown = sorted(set(names) - set(changes.feeds()))
+            if unknown:
+                raise ValidationError({'models': f'Неизвестные ленты: {", ".join(unknown)}'})
+        try:
+            data = changes.changes(
+                cursor=request.query_params.get('cursor') or None, limit=limit, names=names,
+                context={'request': request},
+            )
+        except changes.CursorError as e:
+            raise ValidationError({'cursor': str(e)})
+        return Response(data)
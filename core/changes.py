@@ -0,0 +1,182 @@
+"""
+Лента изменений справочников для оффлайн клиента (PWA)
+
+Клиент хранит локальную копию точек, типов визитов, коэффициентов и шаблонов
+форм и обновляет ее одним запросом: "что изменилось после курсора".
+
+- Измененные и созданные записи - по (updated_at, id) каждой модели, в формате
+  сериализаторов соответствующих ViewSet'ов REST API (та же форма записей, что
+  при полной загрузке списков).
+- Удаленные записи - из журнала Tombstone (заполняется сигналами core.signals).
+- Курсор - непрозрачная строка с позициями по каждой ленте и ее журналу удалений.
+  Без курсора (или для ленты, которой еще нет в курсоре) отдается полная копия
+  постранично, удаления не отдаются.
+- Записи последних CHANGES_FEED_SAFETY_LAG секунд не отдаются: транзакции,
+  начатые раньше, успевают завершиться, и их записи не будут пропущены.
+- Журнал удалений хранится CHANGES_FEED_TOMBSTONE_DAYS дней: для курсора старше
+  лента попадает в reset - клиент очищает ее локальную копию и загружает заново.
+- Не больше limit записей на ответ; has_more=true - запросить следующую страницу
+  с новым курсором.
+"""
+import base64
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Tombstone
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 2000
+DELETED = 'deleted'
+
+
+class CursorError(ValueError):
+    """Курсор ленты изменений не разбирается"""
+
+
+def feeds():
+    """Ленты: имя → ViewSet REST API (queryset и сериализатор записей)"""
+    from coefficients.api_views import CoefficientViewSet
+    from forms.api_views import FormTemplateViewSet
+    from geo.api_views import OutletViewSet
+    from visits.api_views import VisitTypeViewSet
+
+    return {
+        'outlets': OutletViewSet,
+        'visit_types': VisitTypeViewSet,
+        'coefficients': CoefficientViewSet,
+        'form_templates': FormTemplateViewSet,
+    }
+
+
+def model_label(viewset):
+    return viewset.queryset.model._meta.label_lower
+
+
+def tracked_models():
+    """Модели, удаления которых записываются в журнал"""
+    return [viewset.queryset.model for viewset in feeds().values()]
+
+
+def safety_lag():
+    return timedelta(seconds=getattr(settings, 'CHANGES_FEED_SAFETY_LAG', 5))
+
+
+def tombstone_retention():
+    return timedelta(days=getattr(settings, 'CHANGES_FEED_TOMBSTONE_DAYS', 90))
+
+
+# ============================================================================
+# Курсор
+# ============================================================================
+
+def encode_cursor(positions):
+    """Позиции {лента: (время, id или None)} → строка курсора"""
+    payload = {name: [moment.isoformat(), pk] for name, (moment, pk) in positions.items()}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Строка курсора → позиции {лента: (время, id или None)}"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        positions = {}
+        for name, (moment, pk) in payload.items():
+            moment = parse_datetime(moment)
+            if moment is None or (pk is not None and not isinstance(pk, int)):
+                raise ValueError(name)
+            positions[name] = (moment, pk)
+        return positions
+    except (ValueError, TypeError, AttributeError):
+        raise CursorError('Некорректный курсор')
+
+
+def after(position, time_field):
+    """Условие "после позиции" для упорядочения (время, id)"""
+    moment, pk = position
+    if pk is None:
+        return Q(**{f'{time_field}__gt': moment})
+    return Q(**{f'{time_field}__gt': moment}) | Q(**{time_field: moment, 'pk__gt': pk})
+
+
+# ============================================================================
+# Лента
+# ============================================================================
+
+def _page(queryset, time_field, position, until, budget):
+    """Страница записей после позиции: (записи, новая позиция, есть ли еще)"""
+    if position is not None:
+        queryset = queryset.filter(after(position, time_field))
+    records = list(queryset.filter(**{f'{time_field}__lte': until}).order_by(time_field, 'pk')[:budget + 1])
+    if len(records) > budget:
+        records = records[:budget]
+        return records, (getattr(records[-1], time_field), records[-1].pk), True
+    # Лента исчерпана до until - следующий запрос начнет после until
+    return records, (until, None), False
+
+
+def changes(cursor=None, limit=DEFAULT_LIMIT, names=None, context=None):
+    """
+    Изменения после курсора.
+    Возвращает {'cursor', 'has_more', 'reset': [ленты], 'changes': {лента: {'updated': [...], 'deleted': [id...]}}}.
+    """
+    budget = max(1, min(limit, MAX_LIMIT))
+    all_feeds = feeds()
+    names = [name for name in all_feeds if names is None or name in names]
+    now = timezone.now()
+    until = now - safety_lag()
+
+    positions = decode_cursor(cursor) if cursor else {}
+    result = {}
+    reset = []
+    has_more = False
+
+    for name in names:
+        if budget <= 0:
+            # Лимит ответа исчерпан предыдущими лентами - продолжение в следующем запросе
+            has_more = True
+            break
+        viewset = all_feeds[name]
+        deleted_key = f'{name}.{DELETED}'
+        if deleted_key in positions and positions[deleted_key][0] < now - tombstone_retention():
+            # Журнал удалений за этот период уже очищен - локальную копию нужно загрузить заново
+            positions.pop(name, None)
+            positions.pop(deleted_key)
+            reset.append(name)
+        # Полная загрузка: удалять в пустой копии нечего
+        positions.setdefault(deleted_key, (until, None))
+
+        records, positions[name], has_more = _page(viewset.queryset, 'updated_at', positions.get(name), until, budget)
+        budget -= len(records)
+        tombstones = []
+        if not has_more and budget > 0:
+            tombstones, positions[deleted_key], has_more = _page(
+                Tombstone.objects.filter(model=model_label(viewset)), 'deleted_at', positions[deleted_key], until, budget
+            )
+            budget -= len(tombstones)
+        elif not has_more:
+            has_more = True
+
+        result[name] = {
+            'updated': viewset.serializer_class(records, many=True, context=context or {}).data,
+            'deleted': [tombstone.object_id for tombstone in tombstones],
+        }
+        if has_more:
+            break
+
+    return {
+        'cursor': encode_cursor(positions),
+        'has_more': has_more,
+        'reset': reset,
+        'changes': result,
+    }
+
+
+def prune_tombstones():
+    """Удалить записи журнала удалений старше срока хранения. Возвращает количество."""
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=timezone.now() - tombstone_retention()).delete()
+    return deleted
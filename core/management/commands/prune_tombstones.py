@@ -0,0 +1,18 @@
+"""
+Management command для очистки журнала удалений ленты изменений (core.Tombstone)
+
+Записи старше CHANGES_FEED_TOMBSTONE_DAYS дней удаляются; клиент с курсором
+старше этого срока получает reset и загружает справочники заново.
+Запускается по расписанию (cron).
+"""
+from django.core.management.base import BaseCommand
+
+from core import changes
+
+
+class Command(BaseCommand):
+    help = 'Удалить старые записи журнала удалений ленты изменений'
+
+    def handle(self, *args, **options):
+        deleted = changes.prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала: {deleted}'))
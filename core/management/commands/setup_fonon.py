@@ -176,6 +176,8 @@ class Command(BaseCommand):
                 defaults={
                     'name': data['name'],
                     'expression': data['expression'],
+                    # Placeholders C1, C2... -> coefficient codes for coefficients.formulas
+                    'settings': {'coefficient_map': data['coefficient_map']},
                 }
             )
 
@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class SystemSettings(models.Model):
@@ -158,3 +159,21 @@ class AuditLog(models.Model):
 
     def __str__(self):
         return f"{self.get_action_display()} {self.table_name}:{self.record_id} - {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
+
+
+class Tombstone(models.Model):
+    """Запись об удалении объекта справочника - для ленты изменений оффлайн клиента (core.changes)"""
+    model = models.CharField('Модель', max_length=100, help_text='Например: geo.outlet')
+    object_id = models.PositiveBigIntegerField('ID записи')
+    deleted_at = models.DateTimeField('Дата удаления', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Удаленная запись'
+        verbose_name_plural = 'Удаленные записи'
+        ordering = ['-deleted_at']
+        indexes = [
+            models.Index(fields=['model', 'deleted_at', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.model}:{self.object_id} ({self.deleted_at})"
@@ -0,0 +1,39 @@
+"""
+Сигналы CORE: журнал удалений и версии записей для ленты изменений (core.changes)
+"""
+from django.db.models.signals import post_delete, m2m_changed
+from django.utils import timezone
+
+from visits.models import VisitType
+from . import changes
+from .models import Tombstone
+
+
+def record_tombstone(sender, instance, **kwargs):
+    """Записать удаление справочника, чтобы оффлайн клиент удалил его из локальной копии"""
+    Tombstone.objects.create(model=sender._meta.label_lower, object_id=instance.pk)
+
+
+for model in changes.tracked_models():
+    post_delete.connect(record_tombstone, sender=model, dispatch_uid=f'core_tombstone_{model._meta.label_lower}')
+
+
+def visit_type_coefficients_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Изменение состава коэффициентов меняет запись типа визита в ленте - обновить updated_at"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        visit_type_ids = [instance.pk]
+    elif action == 'post_clear':
+        # pk_set для обратного clear не передается - типы визитов уже отвязаны
+        return
+    else:
+        visit_type_ids = pk_set or []
+    if visit_type_ids:
+        VisitType.objects.filter(pk__in=visit_type_ids).update(updated_at=timezone.now())
+
+
+m2m_changed.connect(
+    visit_type_coefficients_changed, sender=VisitType.coefficients.through,
+    dispatch_uid='core_visit_type_coefficients_changed',
+)
@@ -101,6 +101,93 @@ DATABASES = {
 }
 
 
+# Cache
+# Кэш результатов виджетов дашбордов (analytics.widget_cache) и версии для его инвалидации.
+# В продакшене с несколькими воркерами нужен общий бэкенд (Redis/Memcached),
+# иначе инвалидация из одного процесса не видна другим до истечения refresh_interval.
+# С LocMemCache не работает прогрев кэша командой warm_dashboard_cache (analytics.cache_warmer).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'datum-default',
+    }
+}
+
+
+# Analytics
+# Параллельное вычисление виджетов многоуровневого дашборда (analytics.widgets.compute_widgets_concurrently):
+# размер общего пула потоков на процесс и таймаут страницы в секундах
+
+ANALYTICS_WIDGET_WORKERS = 4
+ANALYTICS_WIDGET_TIMEOUT = 10
+
+# Периоды, за которые материализуются значения метрик (analytics.metrics, MetricValue)
+ANALYTICS_METRIC_PERIODS = ['month']
+
+# Очередь генерации отчетов (analytics.report_queue, python manage.py run_report_worker):
+# потоков на воркер, отчетов в обработке на все воркеры, попыток при временных ошибках,
+# через сколько секунд отчет в обработке считается зависшим
+ANALYTICS_REPORT_WORKERS = 2
+ANALYTICS_REPORT_CONCURRENCY = 4
+ANALYTICS_REPORT_MAX_ATTEMPTS = 3
+ANALYTICS_REPORT_TIMEOUT = 30 * 60
+
+# Отчеты с большим числом строк таблиц выгружаются в Excel готовым файлом, сформированным в фоне
+ANALYTICS_REPORT_EXCEL_INLINE_ROWS = 50000
+
+# Фоновая отрисовка выгрузок (PDF, Excel больших отчетов): потоков на процесс
+# и сколько секунд запрос скачивания PDF ждет отрисовки
+ANALYTICS_REPORT_RENDER_WORKERS = 2
+ANALYTICS_REPORT_PDF_WAIT = 10
+
+# SQL запросы шаблонов отчетов (analytics.sql_reports): алиас БД (можно указать реплику),
+# таймаут запроса в секундах, максимум строк результата, время кэширования результата
+ANALYTICS_SQL_DATABASE = 'default'
+ANALYTICS_SQL_TIMEOUT = 30
+ANALYTICS_SQL_MAX_ROWS = 10000
+ANALYTICS_SQL_CACHE_TIMEOUT = 10 * 60
+# Приложения, таблицы которых доступны SQL запросам шаблонов (остальные таблицы запрещены)
+ANALYTICS_SQL_ALLOWED_APPS = ['analytics', 'visits', 'geo', 'coefficients', 'catalog', 'forms']
+
+# Прогрев кэша виджетов популярных дашбордов (analytics.cache_warmer, python manage.py warm_dashboard_cache):
+# сколько самых популярных видов прогревать, за сколько дней учитываются просмотры,
+# бюджет цикла в секундах (общий и процессорного времени), как часто (секунд) можно
+# прогревать после массовой загрузки данных (0 - не прогревать после загрузки)
+ANALYTICS_CACHE_WARM_TARGETS = 50
+ANALYTICS_CACHE_WARM_USAGE_DAYS = 14
+ANALYTICS_CACHE_WARM_TIME_BUDGET = 120
+ANALYTICS_CACHE_WARM_CPU_BUDGET = 60
+ANALYTICS_CACHE_WARM_MIN_INTERVAL = 5 * 60
+
+# Visits
+# Максимум визитов в одном пакете оффлайн синхронизации (visits.sync, api/sync/batch/)
+VISITS_SYNC_MAX_BATCH = 100
+# Сколько дней хранятся примененные операции синхронизации для ответа на повторы
+# (python manage.py prune_sync_operations)
+VISITS_SYNC_OPERATION_DAYS = 30
+# Загрузка медиа по частям (visits.uploads, api/uploads/): рекомендуемый и максимальный
+# размер части, максимальный размер файла (байт)
+VISITS_UPLOAD_CHUNK_SIZE = 1024 * 1024
+VISITS_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+VISITS_UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+# Незавершенные загрузки без активности дольше N часов удаляются (python manage.py prune_media_uploads)
+VISITS_UPLOAD_EXPIRE_HOURS = 48
+# Обработка медиа (visits.media_processing): размеры миниатюр (максимальная сторона, px),
+# размер для VisitMedia.thumbnail, качество JPEG, число процессов обработки изображений
+VISITS_THUMBNAIL_SIZES = {'small': 160, 'medium': 480, 'large': 1280}
+VISITS_THUMBNAIL_DEFAULT = 'medium'
+VISITS_THUMBNAIL_QUALITY = 80
+VISITS_MEDIA_WORKERS = 2
+
+# Лента изменений справочников для оффлайн клиента (core.changes, api/v1/core/changes/)
+# Записи последних N секунд не отдаются - незавершенные транзакции не будут пропущены
+CHANGES_FEED_SAFETY_LAG = 5
+# Сколько дней хранится журнал удалений (python manage.py prune_tombstones);
+# клиент с курсором старше загружает справочники заново
+CHANGES_FEED_TOMBSTONE_DAYS = 90
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
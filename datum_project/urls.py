@@ -37,7 +37,7 @@ urlpatterns = [
     path('api/v1/coefficients/', include('coefficients.api_urls')),
     path('api/v1/forms/', include('forms.api_urls')),
     path('api/v1/integrations/', include('integrations.api_urls')),
-    path('api/v1/core/', include('core.api_urls'))
+    path('api/v1/core/', include('core.api_urls')),
 
     # AJAX API (legacy - will be replaced by REST API)
     path('api/', include('api.urls')),
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('forms', '0002_initial'),
+        ('geo', '0007_outlet_geo_outlet_updated_937319_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='formtemplate',
+            index=models.Index(fields=['updated_at', 'id'], name='forms_formt_updated_6e6286_idx'),
+        ),
+    ]
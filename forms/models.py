@@ -104,6 +104,8 @@ class FormTemplate(models.Model):
         indexes = [
             models.Index(fields=['code']),
             models.Index(fields=['form_type', 'status']),
+            # Лента изменений оффлайн клиента (core.changes)
+            models.Index(fields=['updated_at', 'id']),
         ]
 
     def __str__(self):
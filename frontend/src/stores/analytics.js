@@ -10,6 +10,12 @@ export const useAnalyticsStore = defineStore('analytics', {
     dashboards: [],
     currentDashboard: null,
 
+    // Dashboard widgets (progressive loading)
+    dashboardLayout: null,
+    widgetData: {},
+    widgetLoading: {},
+    widgetErrors: {},
+
     // Reports
     reports: [],
     currentReport: null,
@@ -48,6 +54,8 @@ export const useAnalyticsStore = defineStore('analytics', {
     dashboardById: (state) => (id) => state.dashboards.find(d => d.id === id),
     dashboardsByType: (state) => (type) => state.dashboards.filter(d => d.dashboard_type === type),
     dashboardsByLevel: (state) => (level) => state.dashboards.filter(d => d.level === level),
+    widgetByIndex: (state) => (index) => state.widgetData[index] || null,
+    widgetsLoading: (state) => Object.values(state.widgetLoading).some(Boolean),
 
     // Report getters
     reportById: (state) => (id) => state.reports.find(r => r.id === id),
@@ -149,6 +157,50 @@ export const useAnalyticsStore = defineStore('analytics', {
       }
     },
 
+    // ==================== DASHBOARD WIDGETS ====================
+    async fetchDashboardLayout(id) {
+      this.dashboardsError = null
+      try {
+        const response = await axios.get(`${API_BASE}/api/${API_VERSION}/analytics/dashboards/${id}/layout/`)
+        this.dashboardLayout = response.data
+        return this.dashboardLayout
+      } catch (error) {
+        this.dashboardsError = error.response?.data?.detail || error.message
+        throw error
+      }
+    },
+
+    async fetchWidgetData(id, index, filters = {}) {
+      this.widgetLoading[index] = true
+      this.widgetErrors[index] = null
+      try {
+        const response = await axios.get(
+          `${API_BASE}/api/${API_VERSION}/analytics/dashboards/${id}/widgets/${index}/`,
+          { params: filters }
+        )
+        this.widgetData[index] = response.data
+        return response.data
+      } catch (error) {
+        this.widgetErrors[index] = error.response?.data?.detail || error.message
+        throw error
+      } finally {
+        this.widgetLoading[index] = false
+      }
+    },
+
+    // Load the layout, then fetch every widget in parallel:
+    // each widget renders as soon as its own data arrives
+    async loadDashboardWidgets(id, filters = {}) {
+      this.widgetData = {}
+      this.widgetLoading = {}
+      this.widgetErrors = {}
+      const layout = await this.fetchDashboardLayout(id)
+      await Promise.allSettled(
+        layout.widgets.map(widget => this.fetchWidgetData(id, widget.index, filters))
+      )
+      return layout
+    },
+
     // ==================== REPORTS ====================
     async fetchReports(params = {}) {
       this.reportsLoading = true
@@ -0,0 +1,200 @@
+"""
+Замыкание гео-иерархии (GeoClosure)
+
+GlobalMarket → Country → Region → City → District → Channel → Outlet хранятся
+внешними ключами на родителя; таблица замыкания дополнительно хранит все пары
+предок - потомок, поэтому выборка поддерева любого узла - один подзапрос
+по индексу (ancestor_level, ancestor_id, descendant_level) вместо цепочки JOIN,
+своей для каждого уровня.
+
+Таблица поддерживается сигналами (geo.signals) при создании, переносе
+и удалении узлов. После массовых загрузок в обход сигналов -
+python manage.py rebuild_geo_closure.
+"""
+from django.db import transaction
+
+from .models import GlobalMarket, Country, Region, City, District, Channel, Outlet, GeoClosure
+
+# Уровни от корня к листьям: (уровень, модель, поле родителя)
+LEVELS = [
+    ('global_market', GlobalMarket, None),
+    ('country', Country, 'global_market'),
+    ('region', Region, 'country'),
+    ('city', City, 'region'),
+    ('district', District, 'city'),
+    ('channel', Channel, 'district'),
+    ('outlet', Outlet, 'channel'),
+]
+LEVEL_NAMES = [level for level, _, _ in LEVELS]
+MODEL_LEVELS = {model: level for level, model, _ in LEVELS}
+PARENT_FIELDS = {level: parent for level, _, parent in LEVELS}
+
+
+def parent_of(instance):
+    """(уровень, id) родителя узла или None для корня"""
+    parent_level = PARENT_FIELDS[MODEL_LEVELS[type(instance)]]
+    if parent_level is None:
+        return None
+    parent_id = getattr(instance, f'{parent_level}_id')
+    return (parent_level, parent_id) if parent_id else None
+
+
+# ============================================================================
+# Выборки
+# ============================================================================
+
+def descendant_ids(level, node_id, descendant_level='outlet'):
+    """Подзапрос id потомков уровня descendant_level узла (level, node_id), включая сам узел"""
+    return GeoClosure.objects.filter(
+        ancestor_level=level,
+        ancestor_id=node_id,
+        descendant_level=descendant_level,
+    ).values('descendant_id')
+
+
+def filter_under(queryset, level, node_id, field='outlet', descendant_level='outlet'):
+    """
+    Ограничить queryset поддеревом узла любого уровня одним подзапросом.
+    field - путь от модели queryset к узлу уровня descendant_level
+    (например, 'pk' для Outlet, 'outlet' для Visit, 'visit__outlet' для Observation).
+    """
+    return queryset.filter(**{f'{field}__in': descendant_ids(level, node_id, descendant_level)})
+
+
+def outlets_under(level, node_id):
+    """Точки сбыта под узлом"""
+    return filter_under(Outlet.objects.all(), level, node_id, field='pk')
+
+
+def visits_under(level, node_id):
+    """Визиты в точки под узлом"""
+    from visits.models import Visit
+    return filter_under(Visit.objects.all(), level, node_id)
+
+
+def observations_under(level, node_id):
+    """Наблюдения визитов в точки под узлом"""
+    from visits.models import Observation
+    return filter_under(Observation.objects.all(), level, node_id, field='visit__outlet')
+
+
+def ancestors_of(level, node_ids):
+    """Предки узлов одного уровня: {id узла: {уровень предка: id предка}} (включая сам узел)"""
+    result = {}
+    rows = GeoClosure.objects.filter(
+        descendant_level=level, descendant_id__in=list(node_ids)
+    ).values_list('descendant_id', 'ancestor_level', 'ancestor_id')
+    for descendant_id, ancestor_level, ancestor_id in rows:
+        result.setdefault(descendant_id, {})[ancestor_level] = ancestor_id
+    return result
+
+
+# ============================================================================
+# Поддержка таблицы
+# ============================================================================
+
+def _ancestor_rows(level, node_id):
+    """Предки узла с глубиной (включая сам узел): [(уровень, id, глубина)]"""
+    return list(GeoClosure.objects.filter(
+        descendant_level=level, descendant_id=node_id
+    ).values_list('ancestor_level', 'ancestor_id', 'depth'))
+
+
+def node_created(level, node_id, parent):
+    """Добавить новый узел: связь с самим собой и со всеми предками родителя"""
+    rows = [GeoClosure(
+        ancestor_level=level, ancestor_id=node_id,
+        descendant_level=level, descendant_id=node_id, depth=0
+    )]
+    if parent:
+        rows += [
+            GeoClosure(
+                ancestor_level=ancestor_level, ancestor_id=ancestor_id,
+                descendant_level=level, descendant_id=node_id, depth=depth + 1
+            )
+            for ancestor_level, ancestor_id, depth in _ancestor_rows(*parent)
+        ]
+    GeoClosure.objects.bulk_create(rows, ignore_conflicts=True)
+
+
+@transaction.atomic
+def node_moved(level, node_id, parent):
+    """Перенести поддерево узла к новому родителю"""
+    subtree = list(GeoClosure.objects.filter(
+        ancestor_level=level, ancestor_id=node_id
+    ).values_list('descendant_level', 'descendant_id', 'depth'))
+    subtree_ids = {}
+    for descendant_level, descendant_id, _ in subtree:
+        subtree_ids.setdefault(descendant_level, []).append(descendant_id)
+
+    # Отвязать поддерево от прежних предков узла
+    old_ancestors = [(a_level, a_id) for a_level, a_id, depth in _ancestor_rows(level, node_id) if depth > 0]
+    for ancestor_level, ancestor_id in old_ancestors:
+        for descendant_level, ids in subtree_ids.items():
+            for offset in range(0, len(ids), 1000):
+                GeoClosure.objects.filter(
+                    ancestor_level=ancestor_level,
+                    ancestor_id=ancestor_id,
+                    descendant_level=descendant_level,
+                    descendant_id__in=ids[offset:offset + 1000],
+                ).delete()
+
+    if not parent:
+        return
+    GeoClosure.objects.bulk_create(
+        [
+            GeoClosure(
+                ancestor_level=ancestor_level, ancestor_id=ancestor_id,
+                descendant_level=descendant_level, descendant_id=descendant_id,
+                depth=ancestor_depth + descendant_depth + 1
+            )
+            for ancestor_level, ancestor_id, ancestor_depth in _ancestor_rows(*parent)
+            for descendant_level, descendant_id, descendant_depth in subtree
+        ],
+        batch_size=1000,
+        ignore_conflicts=True
+    )
+
+
+def node_deleted(level, node_id):
+    """Удалить связи узла (потомки удаляются каскадом и обрабатываются своими сигналами)"""
+    GeoClosure.objects.filter(descendant_level=level, descendant_id=node_id).delete()
+    GeoClosure.objects.filter(ancestor_level=level, ancestor_id=node_id).delete()
+
+
+@transaction.atomic
+def rebuild():
+    """Перестроить таблицу замыкания целиком. Возвращает количество связей."""
+    GeoClosure.objects.all().delete()
+
+    ancestors = {}
+    count = 0
+    batch = []
+    for level, model, parent_level in LEVELS:
+        fields = ['id', f'{parent_level}_id'] if parent_level else ['id']
+        for row in model.objects.values_list(*fields).iterator(chunk_size=5000):
+            node_id = row[0]
+            chain = [(level, node_id, 0)]
+            if parent_level and row[1]:
+                chain += [
+                    (ancestor_level, ancestor_id, depth + 1)
+                    for ancestor_level, ancestor_id, depth in ancestors.get((parent_level, row[1]), [])
+                ]
+            # Цепочки точек не нужны для следующих уровней
+            if level != 'outlet':
+                ancestors[(level, node_id)] = chain
+
+            batch += [
+                GeoClosure(
+                    ancestor_level=ancestor_level, ancestor_id=ancestor_id,
+                    descendant_level=level, descendant_id=node_id, depth=depth
+                )
+                for ancestor_level, ancestor_id, depth in chain
+            ]
+            if len(batch) >= 5000:
+                GeoClosure.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+
+    GeoClosure.objects.bulk_create(batch)
+    return count + len(batch)
@@ -0,0 +1,18 @@
+"""
+Management command для перестроения таблицы замыкания гео-иерархии (GeoClosure)
+
+Нужна после загрузки узлов в обход сигналов (loaddata, bulk_create, QuerySet.update)
+и для первоначального заполнения таблицы.
+"""
+from django.core.management.base import BaseCommand
+
+from geo import closure
+
+
+class Command(BaseCommand):
+    help = 'Перестроить таблицу замыкания гео-иерархии'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Перестраиваем замыкание гео-иерархии...')
+        count = closure.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Готово: записано {count} связей'))
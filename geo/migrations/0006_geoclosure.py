@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+# Уровни иерархии: (уровень, модель, поле родителя)
+LEVELS = [
+    ('global_market', 'GlobalMarket', None),
+    ('country', 'Country', 'global_market'),
+    ('region', 'Region', 'country'),
+    ('city', 'City', 'region'),
+    ('district', 'District', 'city'),
+    ('channel', 'Channel', 'district'),
+    ('outlet', 'Outlet', 'channel'),
+]
+
+
+def fill_closure(apps, schema_editor):
+    """Заполнить замыкание для существующих узлов"""
+    GeoClosure = apps.get_model('geo', 'GeoClosure')
+    ancestors = {}
+    batch = []
+    for level, model_name, parent_level in LEVELS:
+        model = apps.get_model('geo', model_name)
+        fields = ['id', f'{parent_level}_id'] if parent_level else ['id']
+        for row in model.objects.values_list(*fields).iterator():
+            chain = [(level, row[0], 0)]
+            if parent_level and row[1]:
+                chain += [(a_level, a_id, depth + 1) for a_level, a_id, depth in ancestors.get((parent_level, row[1]), [])]
+            if level != 'outlet':
+                ancestors[(level, row[0])] = chain
+            batch += [
+                GeoClosure(ancestor_level=a_level, ancestor_id=a_id, descendant_level=level, descendant_id=row[0], depth=depth)
+                for a_level, a_id, depth in chain
+            ]
+            if len(batch) >= 5000:
+                GeoClosure.objects.bulk_create(batch)
+                batch = []
+    GeoClosure.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geo', '0005_alter_channel_district'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeoClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_level', models.CharField(choices=[('global_market', 'Глобальный рынок'), ('country', 'Страна'), ('region', 'Регион'), ('city', 'Город'), ('district', 'Район'), ('channel', 'Канал сбыта'), ('outlet', 'Точка сбыта')], max_length=20, verbose_name='Уровень предка')),
+                ('ancestor_id', models.PositiveBigIntegerField(verbose_name='ID предка')),
+                ('descendant_level', models.CharField(choices=[('global_market', 'Глобальный рынок'), ('country', 'Страна'), ('region', 'Регион'), ('city', 'Город'), ('district', 'Район'), ('channel', 'Канал сбыта'), ('outlet', 'Точка сбыта')], max_length=20, verbose_name='Уровень потомка')),
+                ('descendant_id', models.PositiveBigIntegerField(verbose_name='ID потомка')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='Глубина')),
+            ],
+            options={
+                'verbose_name': 'Связь гео-иерархии',
+                'verbose_name_plural': 'Замыкание гео-иерархии',
+                'indexes': [models.Index(fields=['descendant_level', 'descendant_id'], name='geo_geoclos_descend_697e5f_idx')],
+                'unique_together': {('ancestor_level', 'ancestor_id', 'descendant_level', 'descendant_id')},
+            },
+        ),
+        migrations.RunPython(fill_closure, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geo', '0006_geoclosure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='outlet',
+            index=models.Index(fields=['updated_at', 'id'], name='geo_outlet_updated_937319_idx'),
+        ),
+    ]
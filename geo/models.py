@@ -288,6 +288,10 @@ class Outlet(models.Model):
         verbose_name = 'Точка сбыта'
         verbose_name_plural = 'Точки сбыта'
         ordering = ['channel', 'name']
+        indexes = [
+            # Лента изменений оффлайн клиента (core.changes)
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.channel.name} - {self.name}"
@@ -412,3 +416,37 @@ class DisplayInventory(models.Model):
 
     def __str__(self):
         return f"{self.product.name} на {self.display.name}: {self.quantity} шт"
+
+
+class GeoClosure(models.Model):
+    """
+    Замыкание гео-иерархии: все пары предок - потомок (включая узел с самим собой, depth=0).
+    Поддерживается geo.closure при создании, переносе и удалении узлов;
+    "все точки/визиты/наблюдения под узлом X" - один индексированный подзапрос.
+    """
+    LEVEL_CHOICES = [
+        ('global_market', 'Глобальный рынок'),
+        ('country', 'Страна'),
+        ('region', 'Регион'),
+        ('city', 'Город'),
+        ('district', 'Район'),
+        ('channel', 'Канал сбыта'),
+        ('outlet', 'Точка сбыта'),
+    ]
+
+    ancestor_level = models.CharField('Уровень предка', max_length=20, choices=LEVEL_CHOICES)
+    ancestor_id = models.PositiveBigIntegerField('ID предка')
+    descendant_level = models.CharField('Уровень потомка', max_length=20, choices=LEVEL_CHOICES)
+    descendant_id = models.PositiveBigIntegerField('ID потомка')
+    depth = models.PositiveSmallIntegerField('Глубина')
+
+    class Meta:
+        verbose_name = 'Связь гео-иерархии'
+        verbose_name_plural = 'Замыкание гео-иерархии'
+        unique_together = ['ancestor_level', 'ancestor_id', 'descendant_level', 'descendant_id']
+        indexes = [
+            models.Index(fields=['descendant_level', 'descendant_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_level}:{self.ancestor_id} → {self.descendant_level}:{self.descendant_id} ({self.depth})"
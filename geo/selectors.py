@@ -0,0 +1,144 @@
+"""
+Данные для селекторов гео-иерархии (страна → регион → город → район → канал → точка)
+
+Списки узлов загружаются по требованию (AJAX) и только в пределах выбранного
+родителя. Списки в пределах родителя и путь выбранного узла кэшируются
+под общей версией иерархии; любое изменение узла (geo.signals) меняет
+версию, и все снимки перестают использоваться.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from . import closure
+from .models import Country, Region, City, District, Channel, Outlet
+
+KEY_PREFIX = 'geo:selectors'
+VERSION_KEY = f'{KEY_PREFIX}:version'
+CACHE_TIMEOUT = 60 * 60 * 24
+PAGE_SIZE = 20
+
+# Уровни от корня к листьям: (уровень, модель, поле родителя)
+LEVELS = [
+    ('country', Country, None),
+    ('region', Region, 'country'),
+    ('city', City, 'region'),
+    ('district', District, 'city'),
+    ('channel', Channel, 'district'),
+    ('outlet', Outlet, 'channel'),
+]
+LEVEL_NAMES = [level for level, _, _ in LEVELS]
+LEVEL_MODELS = {level: model for level, model, _ in LEVELS}
+PARENT_FIELDS = {level: parent for level, _, parent in LEVELS}
+
+# Без родителя из кэша отдаются только короткие верхние уровни, остальные - постранично из БД
+UNSCOPED_CACHED_LEVELS = ['country', 'region', 'city']
+
+
+def ancestor_lookup(level, ancestor_level):
+    """Путь от узла уровня level до id предка уровня ancestor_level (например, channel__district__city_id)"""
+    path = []
+    current = level
+    while current != ancestor_level:
+        current = PARENT_FIELDS[current]
+        if current is None:
+            raise ValueError(f'{ancestor_level} не является предком {level}')
+        path.append(current)
+    return '__'.join(path) + '_id'
+
+
+def version():
+    """Текущая версия снимков иерархии"""
+    cache.add(VERSION_KEY, time.time_ns(), timeout=None)
+    return cache.get(VERSION_KEY)
+
+
+def invalidate():
+    """Сбросить все снимки иерархии"""
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _nodes(level, scope_level=None, scope_id=None):
+    """Узлы уровня в пределах предка: [(id, название)] по алфавиту"""
+    queryset = LEVEL_MODELS[level].objects.all()
+    if scope_level:
+        queryset = closure.filter_under(queryset, scope_level, scope_id, field='pk', descendant_level=level)
+    return list(queryset.order_by('name', 'id').values_list('id', 'name'))
+
+
+def children(level, scope_level=None, scope_id=None, search='', page=1):
+    """
+    Страница узлов уровня для селектора в формате Select2.
+    scope_level/scope_id - выбранный предок (любого уровня выше), чьим поддеревом ограничен список.
+    """
+    if level not in LEVEL_MODELS:
+        raise ValueError(f'Неизвестный уровень: {level}')
+    if scope_level and scope_level not in LEVEL_MODELS:
+        raise ValueError(f'Неизвестный уровень: {scope_level}')
+    if not scope_id:
+        scope_level = None
+
+    start = (page - 1) * PAGE_SIZE
+    end = start + PAGE_SIZE
+
+    if scope_level or level in UNSCOPED_CACHED_LEVELS:
+        key = f'{KEY_PREFIX}:{version()}:nodes:{level}:{scope_level}:{scope_id}'
+        nodes = cache.get(key)
+        if nodes is None:
+            nodes = _nodes(level, scope_level, scope_id)
+            cache.set(key, nodes, CACHE_TIMEOUT)
+        if search:
+            search = search.lower()
+            nodes = [node for node in nodes if search in node[1].lower()]
+        total_count = len(nodes)
+        nodes = nodes[start:end]
+    else:
+        queryset = LEVEL_MODELS[level].objects.all()
+        if search:
+            queryset = queryset.filter(Q(name__icontains=search) | Q(code__icontains=search))
+        queryset = queryset.order_by('name', 'id').values_list('id', 'name')
+        total_count = queryset.count()
+        nodes = list(queryset[start:end])
+
+    return {
+        'results': [{'id': node_id, 'text': name} for node_id, name in nodes],
+        'pagination': {'more': end < total_count},
+    }
+
+
+def selection_path(level, node_id):
+    """
+    Путь от страны до выбранного узла: [{'level', 'id', 'name'}].
+    Пустой список, если узел не выбран или не найден.
+    """
+    if level not in LEVEL_MODELS or not node_id:
+        return []
+    try:
+        node_id = int(node_id)
+    except (TypeError, ValueError):
+        return []
+
+    key = f'{KEY_PREFIX}:{version()}:path:{level}:{node_id}'
+    path = cache.get(key)
+    if path is not None:
+        return path
+
+    ancestors = LEVEL_NAMES[:LEVEL_NAMES.index(level)]
+    fields = {'name': 'name'}
+    for ancestor in ancestors:
+        lookup = ancestor_lookup(level, ancestor)
+        fields[f'{ancestor}_id'] = lookup
+        fields[f'{ancestor}_name'] = lookup[:-len('_id')] + '__name'
+
+    row = LEVEL_MODELS[level].objects.filter(pk=node_id).values(*fields.values()).first()
+    path = []
+    if row:
+        for ancestor in ancestors:
+            ancestor_id = row[fields[f'{ancestor}_id']]
+            if ancestor_id is not None:
+                path.append({'level': ancestor, 'id': ancestor_id, 'name': row[fields[f'{ancestor}_name']]})
+        path.append({'level': level, 'id': node_id, 'name': row['name']})
+
+    cache.set(key, path, CACHE_TIMEOUT)
+    return path
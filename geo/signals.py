@@ -0,0 +1,49 @@
+"""
+Сигналы GEO:
+- поддержание таблицы замыкания иерархии (geo.closure) при создании, переносе и удалении узлов
+- сброс кэшированных снимков иерархии для селекторов при изменении узлов
+"""
+from django.db.models.signals import pre_save, post_save, post_delete
+
+from . import closure, selectors
+
+
+def closure_pre_save(sender, instance, raw=False, **kwargs):
+    """Запомнить прежнего родителя узла"""
+    instance._closure_old_parent = None
+    if raw or not instance.pk:
+        return
+    parent_level = closure.PARENT_FIELDS[closure.MODEL_LEVELS[sender]]
+    if parent_level:
+        old_parent_id = sender.objects.filter(pk=instance.pk).values_list(f'{parent_level}_id', flat=True).first()
+        instance._closure_old_parent = (parent_level, old_parent_id) if old_parent_id else None
+
+
+def closure_post_save(sender, instance, created=False, raw=False, **kwargs):
+    if raw:
+        return
+    level = closure.MODEL_LEVELS[sender]
+    parent = closure.parent_of(instance)
+    if created:
+        closure.node_created(level, instance.pk, parent)
+    elif parent != getattr(instance, '_closure_old_parent', parent):
+        closure.node_moved(level, instance.pk, parent)
+
+
+def closure_post_delete(sender, instance, **kwargs):
+    closure.node_deleted(closure.MODEL_LEVELS[sender], instance.pk)
+
+
+def geo_node_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        selectors.invalidate()
+
+
+for _, model, _ in closure.LEVELS:
+    pre_save.connect(closure_pre_save, sender=model, dispatch_uid=f'geo_closure_pre_save_{model.__name__}')
+    post_save.connect(closure_post_save, sender=model, dispatch_uid=f'geo_closure_post_save_{model.__name__}')
+    post_delete.connect(closure_post_delete, sender=model, dispatch_uid=f'geo_closure_post_delete_{model.__name__}')
+
+for _, model, _ in selectors.LEVELS:
+    post_save.connect(geo_node_changed, sender=model, dispatch_uid=f'geo_selectors_post_save_{model.__name__}')
+    post_delete.connect(geo_node_changed, sender=model, dispatch_uid=f'geo_selectors_post_delete_{model.__name__}')
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import VisitType, Visit, Observation, VisitMedia, Sale
+from .models import VisitType, Visit, Observation, VisitMedia, Sale, SyncOperation, MediaUpload
 
 
 @admin.register(VisitType)
@@ -110,10 +110,10 @@ class ObservationAdmin(admin.ModelAdmin):
 
 @admin.register(VisitMedia)
 class VisitMediaAdmin(admin.ModelAdmin):
-    list_display = ['visit', 'media_type', 'title', 'observation', 'created_at']
+    list_display = ['visit', 'media_type', 'title', 'observation', 'processed_at', 'created_at']
     list_filter = ['media_type', 'created_at']
     search_fields = ['visit__outlet__name', 'title', 'description']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['thumbnails', 'processed_at', 'created_at', 'updated_at']
     ordering = ['visit', 'created_at']
     list_per_page = 25
     date_hierarchy = 'created_at'
@@ -123,7 +123,7 @@ class VisitMediaAdmin(admin.ModelAdmin):
             'fields': ('visit', 'observation', 'media_type')
         }),
         ('File', {
-            'fields': ('file', 'thumbnail')
+            'fields': ('file', 'thumbnail', 'thumbnails', 'processed_at')
         }),
         ('Details', {
             'fields': ('title', 'description')
@@ -161,3 +161,24 @@ class SaleAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+
+
+@admin.register(SyncOperation)
+class SyncOperationAdmin(admin.ModelAdmin):
+    list_display = ['op_id', 'user', 'visit', 'created_at']
+    search_fields = ['op_id', 'user__username']
+    readonly_fields = ['user', 'op_id', 'visit', 'result', 'created_at']
+    ordering = ['-created_at']
+    list_per_page = 50
+    date_hierarchy = 'created_at'
+
+
+@admin.register(MediaUpload)
+class MediaUploadAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'user', 'visit', 'media_type', 'status', 'received', 'size', 'updated_at']
+    list_filter = ['status', 'media_type', 'created_at']
+    search_fields = ['filename', 'checksum', 'user__username']
+    readonly_fields = ['id', 'received', 'parts', 'file', 'media', 'created_at', 'updated_at']
+    ordering = ['-created_at']
+    list_per_page = 50
+    date_hierarchy = 'created_at'
@@ -30,7 +30,7 @@ class VisitViewSet(viewsets.ModelViewSet):
     serializer_class = VisitSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['visit_type', 'outlet', 'user', 'status', 'data_source_type']
+    filterset_fields = ['visit_type', 'outlet', 'user', 'status', 'data_source_type', 'country', 'region', 'city', 'district', 'channel']
     search_fields = ['outlet__name', 'user__username', 'notes']
     ordering_fields = ['planned_date', 'start_date', 'end_date', 'created_at']
     ordering = ['-created_at']
@@ -50,7 +50,9 @@ class ObservationViewSet(viewsets.ModelViewSet):
 
 class VisitMediaViewSet(viewsets.ModelViewSet):
     """ViewSet for VisitMedia model"""
-    queryset = VisitMedia.objects.select_related('visit', 'observation').all()
+    queryset = VisitMedia.objects.select_related(
+        'visit__visit_type', 'visit__outlet', 'observation__coefficient'
+    ).all()
     serializer_class = VisitMediaSerializer
     permission_classes = [IsAuthenticated]
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -1,5 +1,6 @@
 from django import forms
 from .models import VisitType, Visit, Observation, VisitMedia
+from . import uploads
 
 
 class VisitTypeForm(forms.ModelForm):
@@ -160,6 +161,12 @@ class ObservationForm(forms.ModelForm):
 
 class VisitMediaForm(forms.ModelForm):
     """Form for VisitMedia model"""
+    upload = forms.UUIDField(
+        label='Загрузка по частям',
+        required=False,
+        widget=forms.HiddenInput(),
+        help_text='ID собранной загрузки (api/uploads/) вместо файла'
+    )
 
     class Meta:
         model = VisitMedia
@@ -205,3 +212,22 @@ class VisitMediaForm(forms.ModelForm):
                 'step': '0.000001'
             }),
         }
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user = user
+        # Файл можно не выбирать, если он уже загружен по частям
+        self.fields['file'].required = False
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload_id = cleaned_data.get('upload')
+        visit = cleaned_data.get('visit')
+        if upload_id:
+            upload = uploads.completed_upload(self.user, visit, upload_id) if self.user and visit else None
+            if upload is None:
+                raise forms.ValidationError('Загрузка не найдена, не завершена или относится к другому визиту')
+            cleaned_data['upload'] = upload
+        elif not cleaned_data.get('file') and not self.instance.file:
+            self.add_error('file', 'Выберите файл')
+        return cleaned_data
@@ -0,0 +1,125 @@
+"""
+Обработка изображений медиа визитов: миниатюры и EXIF
+
+Функции выполняются в процессах пула (visits.media_processing), поэтому модуль
+не импортирует Django: на входе путь к файлу или байты, на выходе - байты
+миниатюр и словарь с данными EXIF.
+"""
+import io
+from datetime import datetime
+
+from PIL import ExifTags, Image, ImageOps
+
+# Теги EXIF, которые сохраняются в VisitMedia.exif_data
+EXIF_TAGS = [
+    'Make', 'Model', 'Software', 'DateTime', 'DateTimeOriginal', 'OffsetTimeOriginal',
+    'Orientation', 'ExposureTime', 'FNumber', 'ISOSpeedRatings', 'FocalLength', 'LensModel',
+]
+# Все ключи exif_data, которые формирует обработка
+RESULT_KEYS = set(EXIF_TAGS) | {'GPS', 'taken_at', 'width', 'height', 'processing_error'}
+
+
+def _json_value(value):
+    """Значение тега EXIF в виде, пригодном для JSON (None - не сохраняется)"""
+    if isinstance(value, bytes):
+        return None
+    if isinstance(value, str):
+        return value.strip('\x00 ').strip() or None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        # IFDRational и подобные
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _degrees(value, ref):
+    """GPS координата EXIF (градусы, минуты, секунды) → десятичные градусы"""
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    result = degrees + minutes / 60 + seconds / 3600
+    if ref in ('S', 'W'):
+        result = -result
+    return round(result, 6)
+
+
+def _taken_at(values):
+    """Время съемки в ISO формате (со смещением часового пояса, если камера его записала)"""
+    raw = values.get('DateTimeOriginal') or values.get('DateTime')
+    if not isinstance(raw, str):
+        return None
+    try:
+        moment = datetime.strptime(raw[:19], '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    offset = values.get('OffsetTimeOriginal')
+    return moment.isoformat() + (offset if isinstance(offset, str) and len(offset) == 6 else '')
+
+
+def read_exif(image):
+    """EXIF изображения: (теги для exif_data, широта, долгота)"""
+    exif = image.getexif()
+    tags = dict(exif)
+    tags.update(exif.get_ifd(ExifTags.IFD.Exif))
+
+    values = {}
+    for tag_id, value in tags.items():
+        name = ExifTags.TAGS.get(tag_id)
+        if name in EXIF_TAGS:
+            value = _json_value(value)
+            if value is not None:
+                values[name] = value
+
+    latitude = longitude = None
+    gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+    if gps:
+        latitude = _degrees(gps.get(ExifTags.GPS.GPSLatitude), gps.get(ExifTags.GPS.GPSLatitudeRef))
+        longitude = _degrees(gps.get(ExifTags.GPS.GPSLongitude), gps.get(ExifTags.GPS.GPSLongitudeRef))
+        if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            latitude = longitude = None
+        else:
+            values['GPS'] = {'latitude': latitude, 'longitude': longitude}
+            altitude = _json_value(gps.get(ExifTags.GPS.GPSAltitude))
+            if altitude is not None:
+                values['GPS']['altitude'] = altitude
+
+    taken_at = _taken_at(values)
+    if taken_at:
+        values['taken_at'] = taken_at
+    return values, latitude, longitude
+
+
+def process(source, sizes, quality=80):
+    """
+    Миниатюры и EXIF изображения.
+    source - путь к файлу или байты; sizes - {размер: максимальная сторона в пикселях}.
+    Возвращает {'thumbnails': {размер: JPEG}, 'exif', 'latitude', 'longitude'}.
+    """
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+        exif, latitude, longitude = read_exif(image)
+        width, height = image.size
+        # JPEG декодируется сразу в уменьшенном масштабе - не распаковывать полный кадр камеры
+        largest = max(sizes.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+
+        thumbnails = {}
+        # От большего размера к меньшему: каждая следующая миниатюра уменьшается из предыдущей
+        for label, side in sorted(sizes.items(), key=lambda item: -item[1]):
+            image.thumbnail((side, side), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+            thumbnails[label] = buffer.getvalue()
+
+    exif.update({'width': width, 'height': height})
+    return {
+        'thumbnails': thumbnails,
+        'exif': exif,
+        'latitude': latitude,
+        'longitude': longitude,
+    }
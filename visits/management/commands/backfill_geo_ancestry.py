@@ -0,0 +1,36 @@
+"""
+Management command для заполнения денормализованных предков точки на визитах
+(country, region, city, district, channel) по текущей гео-иерархии.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from visits.models import Visit
+
+
+class Command(BaseCommand):
+    help = 'Заполнить страну/регион/город/район/канал на визитах по их точкам сбыта'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Количество визитов (по диапазону id) в одном UPDATE'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        bounds = Visit.objects.aggregate(first=Min('id'), last=Max('id'))
+        if bounds['first'] is None:
+            self.stdout.write(self.style.WARNING('Визитов нет'))
+            return
+
+        updated = 0
+        for start in range(bounds['first'], bounds['last'] + 1, batch_size):
+            updated += Visit.sync_geo_ancestry(
+                Visit.objects.filter(id__gte=start, id__lt=start + batch_size)
+            )
+            self.stdout.write(f'  обработано визитов: {updated}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: обновлено {updated} визитов'))
@@ -12,6 +12,7 @@ from geo.models import GlobalMarket, Country, Region, Channel, Outlet
 from catalog.models import Brand, Category, Product
 from coefficients.models import Coefficient
 from visits.models import VisitType, Visit, Observation
+from analytics import rollup
 
 
 User = get_user_model()
@@ -62,16 +63,17 @@ class Command(BaseCommand):
             # Получаем или создаем точки сбыта для канала
             outlets = self.get_or_create_outlets(channel, count=5)
 
-            # Генерируем визиты
-            visits_created = self.generate_visits(
-                channel=channel,
-                outlets=outlets,
-                visit_types=visit_types,
-                coefficients=coefficients,
-                user=user,
-                count=visits_per_channel,
-                months=months
-            )
+            # Генерируем визиты (дневной куб пересчитывается один раз на канал)
+            with rollup.deferred_refresh():
+                visits_created = self.generate_visits(
+                    channel=channel,
+                    outlets=outlets,
+                    visit_types=visit_types,
+                    coefficients=coefficients,
+                    user=user,
+                    count=visits_per_channel,
+                    months=months
+                )
             total_visits += visits_created
 
         self.stdout.write(self.style.SUCCESS(
@@ -0,0 +1,55 @@
+"""
+Management command для обработки уже загруженных медиа визитов
+
+Формирует миниатюры и извлекает EXIF (время съемки, GPS) для файлов,
+которые еще не обработаны (загружены до появления фоновой обработки
+или пропущены при перезапуске сервера). --all - обработать заново все файлы
+(например, после изменения VISITS_THUMBNAIL_SIZES).
+"""
+from django.core.management.base import BaseCommand
+
+from visits import media_processing
+
+
+class Command(BaseCommand):
+    help = 'Сформировать миниатюры и извлечь EXIF для загруженных медиа визитов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Обработать заново все файлы, а не только необработанные'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=None,
+            help='Обработать не больше N файлов'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Файлов в пачке (по умолчанию 100)'
+        )
+
+    def handle(self, *args, **options):
+        media_ids = list(
+            media_processing.pending_media(reprocess=options['all']).values_list('pk', flat=True)[:options['limit']]
+        )
+        self.stdout.write(f'Файлов к обработке: {len(media_ids)}')
+
+        totals = {}
+        batch_size = max(options['batch_size'], 1)
+        for start in range(0, len(media_ids), batch_size):
+            report = media_processing.process_many(media_ids[start:start + batch_size])
+            for result, count in report.items():
+                totals[result] = totals.get(result, 0) + count
+            self.stdout.write(f'  обработано {min(start + batch_size, len(media_ids))} из {len(media_ids)}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: миниатюры - {totals.get(media_processing.RESULT_PROCESSED, 0)}, "
+            f"без миниатюр - {totals.get(media_processing.RESULT_SKIPPED, 0)}, "
+            f"ошибок - {totals.get(media_processing.RESULT_FAILED, 0)}, "
+            f"файл заменен - {totals.get(media_processing.RESULT_STALE, 0)}"
+        ))
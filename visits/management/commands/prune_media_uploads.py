@@ -0,0 +1,17 @@
+"""
+Management command для удаления брошенных загрузок медиа по частям (MediaUpload)
+
+Сессии без активности дольше VISITS_UPLOAD_EXPIRE_HOURS часов удаляются вместе
+с принятыми частями и непривязанным к медиа файлом. Запускается по расписанию (cron).
+"""
+from django.core.management.base import BaseCommand
+
+from visits import uploads
+
+
+class Command(BaseCommand):
+    help = 'Удалить брошенные загрузки медиа по частям'
+
+    def handle(self, *args, **options):
+        deleted = uploads.prune()
+        self.stdout.write(self.style.SUCCESS(f'Удалено загрузок: {deleted}'))
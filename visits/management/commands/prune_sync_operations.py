@@ -0,0 +1,30 @@
+"""
+Management command для удаления старых операций оффлайн синхронизации (SyncOperation)
+
+Операции хранятся, пока клиент может повторить запрос (Background Sync);
+старше VISITS_SYNC_OPERATION_DAYS дней удаляются. Запускается по расписанию (cron).
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from visits.models import SyncOperation
+
+
+class Command(BaseCommand):
+    help = 'Удалить старые операции оффлайн синхронизации'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'VISITS_SYNC_OPERATION_DAYS', 30),
+            help='Хранить операции за последние N дней (по умолчанию VISITS_SYNC_OPERATION_DAYS)'
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = SyncOperation.objects.filter(created_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено операций: {deleted}'))
@@ -0,0 +1,226 @@
+"""
+Фоновая обработка медиа визитов: миниатюры и EXIF
+
+После загрузки фото (сигнал post_save VisitMedia) файл обрабатывается в фоне:
+- миниатюры размеров VISITS_THUMBNAIL_SIZES сохраняются в хранилище медиа,
+  размер VISITS_THUMBNAIL_DEFAULT - в VisitMedia.thumbnail (галереи, списки),
+  все размеры - в VisitMedia.thumbnails;
+- EXIF (время съемки, камера, GPS) - в exif_data, координаты - в latitude / longitude.
+
+Декодирование и масштабирование изображений выполняются в пуле процессов
+(VISITS_MEDIA_WORKERS, visits.imaging) - обработка не занимает GIL потоков,
+обслуживающих запросы; чтение файла и запись результата - в потоках.
+Результат записывается условным UPDATE по имени файла: если файл заменили
+во время обработки, устаревшие миниатюры не записываются.
+
+Для уже загруженных файлов - python manage.py process_visit_media.
+"""
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image
+
+from . import imaging
+from .models import VisitMedia
+
+THUMBNAILS_DIR = 'visit_media/thumbnails'
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff', '.heic', '.heif'}
+
+# Итог обработки одного файла
+RESULT_PROCESSED = 'processed'
+RESULT_SKIPPED = 'skipped'
+RESULT_FAILED = 'failed'
+RESULT_STALE = 'stale'
+
+
+def thumbnail_sizes():
+    """Размеры миниатюр: {размер: максимальная сторона в пикселях}"""
+    return getattr(settings, 'VISITS_THUMBNAIL_SIZES', {'small': 160, 'medium': 480, 'large': 1280})
+
+
+def default_size():
+    return getattr(settings, 'VISITS_THUMBNAIL_DEFAULT', 'medium')
+
+
+def thumbnail_quality():
+    return getattr(settings, 'VISITS_THUMBNAIL_QUALITY', 80)
+
+
+def workers():
+    return getattr(settings, 'VISITS_MEDIA_WORKERS', 2)
+
+
+def is_image(media):
+    """Файл - изображение (фото визита или файл с расширением изображения)"""
+    if not media.file:
+        return False
+    extension = os.path.splitext(media.file.name)[1].lower()
+    return media.media_type == VisitMedia.TYPE_PHOTO or extension in IMAGE_EXTENSIONS
+
+
+# ============================================================================
+# Пулы
+# ============================================================================
+
+_pool = None
+_executor = None
+_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул процессов для работы с изображениями (spawn - без копии состояния веб-процесса)"""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers(), mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def reset_pool():
+    """Пересоздать пул после падения процесса (BrokenProcessPool)"""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def get_executor():
+    """Потоки, которые читают файлы, ждут пул процессов и записывают результат"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers(), thread_name_prefix='visits-media')
+    return _executor
+
+
+# ============================================================================
+# Обработка
+# ============================================================================
+
+def _source(media):
+    """Путь к файлу (локальное хранилище) или содержимое файла"""
+    try:
+        return media.file.path
+    except NotImplementedError:
+        with media.file.open('rb') as file:
+            return file.read()
+
+
+def _coordinate(value):
+    return Decimal(str(value)) if value is not None else None
+
+
+def _thumbnail_name(media, label):
+    """Имя миниатюры зависит от файла: миниатюры замененного файла не пересекаются с новыми"""
+    digest = hashlib.sha1(media.file.name.encode('utf-8')).hexdigest()[:8]
+    return f'{THUMBNAILS_DIR}/{media.pk}_{digest}_{label}.jpg'
+
+
+def _delete_thumbnails(storage, names):
+    for name in names:
+        if name:
+            storage.delete(name)
+
+
+def _render(source):
+    """Миниатюры и EXIF в пуле процессов (повтор на новом пуле, если процесс пула упал)"""
+    try:
+        return get_pool().submit(imaging.process, source, thumbnail_sizes(), thumbnail_quality()).result()
+    except BrokenProcessPool:
+        reset_pool()
+        return get_pool().submit(imaging.process, source, thumbnail_sizes(), thumbnail_quality()).result()
+
+
+def process_media(media_id):
+    """Сформировать миниатюры и прочитать EXIF файла. Возвращает итог (RESULT_*)."""
+    media = VisitMedia.objects.filter(pk=media_id).first()
+    if media is None or not media.file:
+        return RESULT_SKIPPED
+    file_name = media.file.name
+    pending = VisitMedia.objects.filter(pk=media.pk, file=file_name)
+
+    if not is_image(media):
+        # Видео, аудио, документы: миниатюр нет, отметить как обработанные
+        pending.update(processed_at=timezone.now())
+        return RESULT_SKIPPED
+
+    try:
+        result = _render(_source(media))
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        # Файл не читается как изображение (поврежден, неподдерживаемый формат)
+        pending.update(
+            exif_data=dict(media.exif_data or {}, processing_error=str(e) or e.__class__.__name__),
+            processed_at=timezone.now(),
+        )
+        return RESULT_FAILED
+
+    storage = VisitMedia._meta.get_field('thumbnail').storage
+    previous = set(media.thumbnails.values()) | {media.thumbnail.name}
+    thumbnails = {}
+    for label, content in result['thumbnails'].items():
+        name = _thumbnail_name(media, label)
+        # Повторная обработка того же файла заменяет миниатюру, а не копит рядом
+        storage.delete(name)
+        thumbnails[label] = storage.save(name, ContentFile(content))
+
+    # Данные EXIF прежнего файла заменяются целиком, остальные ключи exif_data сохраняются
+    previous_exif = media.exif_data or {}
+    exif_data = {key: value for key, value in previous_exif.items() if key not in imaging.RESULT_KEYS}
+    exif_data.update(result['exif'])
+    fields = {
+        'thumbnail': thumbnails.get(default_size()) or next(iter(thumbnails.values()), None),
+        'thumbnails': thumbnails,
+        'exif_data': exif_data,
+        'processed_at': timezone.now(),
+    }
+    if result['latitude'] is not None:
+        fields.update(latitude=_coordinate(result['latitude']), longitude=_coordinate(result['longitude']))
+    elif 'GPS' in previous_exif:
+        # Координаты были взяты из EXIF прежнего файла
+        fields.update(latitude=None, longitude=None)
+
+    if not pending.update(**fields):
+        # Файл заменили или удалили во время обработки - миниатюры относятся к прежнему файлу
+        _delete_thumbnails(storage, thumbnails.values())
+        return RESULT_STALE
+    _delete_thumbnails(storage, previous - set(thumbnails.values()))
+    return RESULT_PROCESSED
+
+
+def _process_in_thread(media_id):
+    try:
+        return process_media(media_id)
+    finally:
+        # У каждого потока свое соединение с БД - не оставлять его открытым в пуле
+        connections.close_all()
+
+
+def process_in_background(media_id):
+    """Обработать файл в фоне после коммита транзакции, в которой он сохранен"""
+    transaction.on_commit(lambda: get_executor().submit(_process_in_thread, media_id))
+
+
+def pending_media(reprocess=False):
+    """Медиа с файлами, ожидающие обработки (reprocess - все медиа с файлами)"""
+    queryset = VisitMedia.objects.exclude(file='')
+    if not reprocess:
+        queryset = queryset.filter(processed_at__isnull=True)
+    return queryset.order_by('pk')
+
+
+def process_many(media_ids):
+    """Обработать файлы параллельно (по потоку на процесс пула). Возвращает {итог: количество}."""
+    report = {}
+    for result in get_executor().map(_process_in_thread, media_ids):
+        report[result] = report.get(result, 0) + 1
+    return report
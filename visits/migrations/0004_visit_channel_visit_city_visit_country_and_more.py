@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geo', '0005_alter_channel_district'),
+        ('visits', '0003_observation_data_source_type_visit_data_source_type'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visit',
+            name='channel',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geo.channel', verbose_name='Канал'),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='city',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geo.city', verbose_name='Город'),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='country',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geo.country', verbose_name='Страна'),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='district',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geo.district', verbose_name='Район'),
+        ),
+        migrations.AddField(
+            model_name='visit',
+            name='region',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='geo.region', verbose_name='Регион'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['country', 'start_date'], name='visits_visi_country_ad2293_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['region', 'start_date'], name='visits_visi_region__42b58e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['city', 'start_date'], name='visits_visi_city_id_0587ce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['district', 'start_date'], name='visits_visi_distric_0cb2b2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visit',
+            index=models.Index(fields=['channel', 'start_date'], name='visits_visi_channel_e3db9b_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:57
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_local_date(apps, schema_editor):
+    """Заполнить локальную дату наблюдений по дате начала визита"""
+    Visit = apps.get_model('visits', 'Visit')
+    Observation = apps.get_model('visits', 'Observation')
+
+    visits_by_day = {}
+    for visit_id, start_date in Visit.objects.filter(start_date__isnull=False).values_list('id', 'start_date').iterator():
+        day = timezone.localtime(start_date).date() if timezone.is_aware(start_date) else start_date.date()
+        visits_by_day.setdefault(day, []).append(visit_id)
+
+    for day, visit_ids in visits_by_day.items():
+        for offset in range(0, len(visit_ids), 500):
+            Observation.objects.filter(visit_id__in=visit_ids[offset:offset + 500]).update(local_date=day)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0004_remove_attributedefinition_data_source_type_and_more'),
+        ('coefficients', '0003_metric_source_data_type'),
+        ('visits', '0004_visit_channel_visit_city_visit_country_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='observation',
+            name='local_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='Дата визита'),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['coefficient', 'local_date'], name='visits_obse_coeffic_c2807c_idx'),
+        ),
+        migrations.RunPython(fill_local_date, migrations.RunPython.noop),
+    ]
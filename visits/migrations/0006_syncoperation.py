@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0005_observation_local_date'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncOperation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('op_id', models.CharField(help_text='Генерируется клиентом', max_length=64, verbose_name='ID операции')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата применения')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_operations', to=settings.AUTH_USER_MODEL, verbose_name='Исполнитель')),
+                ('visit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_operations', to='visits.visit', verbose_name='Визит')),
+            ],
+            options={
+                'verbose_name': 'Операция синхронизации',
+                'verbose_name_plural': 'Операции синхронизации',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at'], name='visits_sync_created_ffebf1_idx')],
+                'unique_together': {('user', 'op_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('coefficients', '0004_coefficient_coefficient_updated_3e38b2_idx'),
+        ('forms', '0003_formtemplate_forms_formt_updated_6e6286_idx'),
+        ('visits', '0006_syncoperation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='visittype',
+            index=models.Index(fields=['updated_at', 'id'], name='visits_visi_updated_f16d9c_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:40
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0007_visittype_visits_visi_updated_f16d9c_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='ID загрузки')),
+                ('media_type', models.CharField(choices=[('photo', 'Фото'), ('video', 'Видео'), ('audio', 'Аудио'), ('document', 'Документ')], default='photo', max_length=20, verbose_name='Тип медиа')),
+                ('filename', models.CharField(max_length=255, verbose_name='Имя файла')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер (байт)')),
+                ('checksum', models.CharField(help_text='Контрольная сумма всего файла (hex)', max_length=64, verbose_name='SHA-256')),
+                ('received', models.PositiveBigIntegerField(default=0, verbose_name='Принято байт')),
+                ('parts', models.JSONField(blank=True, default=list, help_text='[[смещение, имя в хранилище, размер], ...]', verbose_name='Части')),
+                ('status', models.CharField(choices=[('uploading', 'Загружается'), ('assembling', 'Сборка'), ('completed', 'Загружен'), ('failed', 'Ошибка')], default='uploading', max_length=20, verbose_name='Статус')),
+                ('error_message', models.CharField(blank=True, max_length=255, verbose_name='Ошибка')),
+                ('file', models.FileField(blank=True, upload_to='visit_media/%Y/%m/%d/', verbose_name='Файл')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('media', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to='visits.visitmedia', verbose_name='Медиа файл')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_uploads', to=settings.AUTH_USER_MODEL, verbose_name='Исполнитель')),
+                ('visit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='media_uploads', to='visits.visit', verbose_name='Визит')),
+            ],
+            options={
+                'verbose_name': 'Загрузка медиа',
+                'verbose_name_plural': 'Загрузки медиа',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'visit', 'checksum'], name='visits_medi_user_id_69c13b_idx'), models.Index(fields=['updated_at'], name='visits_medi_updated_1d82cb_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('visits', '0008_mediaupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='visitmedia',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата обработки'),
+        ),
+        migrations.AddField(
+            model_name='visitmedia',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Миниатюры по размерам'),
+        ),
+        migrations.AddIndex(
+            model_name='visitmedia',
+            index=models.Index(fields=['processed_at'], name='visits_visi_process_1ce8f4_idx'),
+        ),
+    ]
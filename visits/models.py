@@ -1,8 +1,31 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from core.constants import DATA_SOURCE_CHOICES
 
 
+# Поля предков точки на визите и пути к ним от Outlet
+GEO_ANCESTRY_LOOKUPS = {
+    'channel': 'channel_id',
+    'district': 'channel__district_id',
+    'city': 'channel__district__city_id',
+    'region': 'channel__district__city__region_id',
+    'country': 'channel__district__city__region__country_id',
+}
+GEO_ANCESTRY_FIELDS = list(GEO_ANCESTRY_LOOKUPS)
+
+
+def to_local_date(value):
+    """Локальная дата (TIME_ZONE) для datetime визита"""
+    if value is None:
+        return None
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
 class VisitType(models.Model):
     """Тип визита - шаблон для проведения визитов"""
     name = models.CharField('Название', max_length=255)
@@ -61,6 +84,10 @@ class VisitType(models.Model):
         verbose_name = 'Тип визита'
         verbose_name_plural = 'Типы визитов'
         ordering = ['name']
+        indexes = [
+            # Лента изменений оффлайн клиента (core.changes)
+            models.Index(fields=['updated_at', 'id']),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.get_type_display()})"
@@ -87,6 +114,29 @@ class Visit(models.Model):
         related_name='visits'
     )
 
+    # Денормализованные предки точки в гео-иерархии (заполняются автоматически).
+    # Фильтр по любому уровню - одно индексированное равенство вместо цепочки из пяти JOIN.
+    country = models.ForeignKey(
+        'geo.Country', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        db_index=False, verbose_name='Страна', related_name='+'
+    )
+    region = models.ForeignKey(
+        'geo.Region', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        db_index=False, verbose_name='Регион', related_name='+'
+    )
+    city = models.ForeignKey(
+        'geo.City', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        db_index=False, verbose_name='Город', related_name='+'
+    )
+    district = models.ForeignKey(
+        'geo.District', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        db_index=False, verbose_name='Район', related_name='+'
+    )
+    channel = models.ForeignKey(
+        'geo.Channel', on_delete=models.SET_NULL, null=True, blank=True, editable=False,
+        db_index=False, verbose_name='Канал', related_name='+'
+    )
+
     # Даты и время
     planned_date = models.DateTimeField('Плановая дата', null=True, blank=True)
     start_date = models.DateTimeField('Дата начала', null=True, blank=True)
@@ -139,11 +189,60 @@ class Visit(models.Model):
             models.Index(fields=['outlet', '-created_at']),
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['status']),
+            models.Index(fields=['country', 'start_date']),
+            models.Index(fields=['region', 'start_date']),
+            models.Index(fields=['city', 'start_date']),
+            models.Index(fields=['district', 'start_date']),
+            models.Index(fields=['channel', 'start_date']),
         ]
 
     def __str__(self):
         return f"{self.visit_type.name} - {self.outlet.name} ({self.created_at.strftime('%Y-%m-%d')})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Дата начала при загрузке - чтобы при сохранении понять, сдвинулась ли локальная дата наблюдений
+        instance._loaded_start_date = instance.__dict__.get('start_date')
+        return instance
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self.outlet_id and (update_fields is None or 'outlet' in update_fields):
+            self.fill_geo_ancestry()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(GEO_ANCESTRY_FIELDS)
+
+        # Локальная дата наблюдений обновляется до сохранения визита:
+        # обработчики post_save (куб аналитики) уже читают новые даты
+        if not self._state.adding and (update_fields is None or 'start_date' in update_fields):
+            if self.start_date != getattr(self, '_loaded_start_date', None):
+                self.observations.update(local_date=to_local_date(self.start_date))
+        super().save(*args, **kwargs)
+        self._loaded_start_date = self.start_date
+
+    @classmethod
+    def sync_geo_ancestry(cls, queryset=None):
+        """
+        Пересчитать предков точки одним UPDATE для набора визитов (по умолчанию - для всех).
+        Возвращает количество обновленных визитов.
+        """
+        from geo.models import Outlet
+
+        queryset = cls.objects.all() if queryset is None else queryset
+        return queryset.update(**{
+            field: models.Subquery(Outlet.objects.filter(pk=models.OuterRef('outlet_id')).values(lookup)[:1])
+            for field, lookup in GEO_ANCESTRY_LOOKUPS.items()
+        })
+
+    def fill_geo_ancestry(self):
+        """Заполнить предков точки (канал, район, город, регион, страна)"""
+        from geo.models import Outlet
+
+        ancestry = Outlet.objects.filter(pk=self.outlet_id).values(*GEO_ANCESTRY_LOOKUPS.values()).first() or {}
+        for field, lookup in GEO_ANCESTRY_LOOKUPS.items():
+            setattr(self, f'{field}_id', ancestry.get(lookup))
+
 
 class Observation(models.Model):
     """Наблюдение - единичный замер коэффициента во время визита"""
@@ -186,6 +285,9 @@ class Observation(models.Model):
     notes = models.TextField('Комментарии', blank=True)
     metadata = models.JSONField('Метаданные', default=dict, blank=True)
 
+    # Локальная дата начала визита (TIME_ZONE) для группировки по периодам без функций дат БД
+    local_date = models.DateField('Дата визита', null=True, blank=True, editable=False)
+
     # Метаданные
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
@@ -197,12 +299,21 @@ class Observation(models.Model):
         indexes = [
             models.Index(fields=['visit', 'coefficient']),
             models.Index(fields=['coefficient', 'product']),
+            models.Index(fields=['coefficient', 'local_date']),
         ]
 
     def __str__(self):
         product_str = f" ({self.product.name})" if self.product else ""
         return f"{self.coefficient.name}{product_str} - {self.visit.outlet.name}"
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'visit' in update_fields:
+            self.local_date = to_local_date(self.visit.start_date)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'local_date'}
+        super().save(*args, **kwargs)
+
     def get_value(self):
         """Получить значение в зависимости от типа коэффициента"""
         if self.coefficient.value_type == 'numeric':
@@ -245,19 +356,25 @@ class VisitMedia(models.Model):
 
     # Файл
     file = models.FileField('Файл', upload_to='visit_media/%Y/%m/%d/')
+    # Миниатюры формирует фоновая обработка (visits.media_processing):
+    # thumbnail - размер для галерей, thumbnails - все размеры {размер: имя файла}
     thumbnail = models.ImageField('Миниатюра', upload_to='visit_media/thumbnails/', blank=True, null=True)
+    thumbnails = models.JSONField('Миниатюры по размерам', default=dict, blank=True)
 
     # Описание
     title = models.CharField('Название', max_length=255, blank=True)
     description = models.TextField('Описание', blank=True)
 
-    # EXIF данные (заглушка на потом)
+    # EXIF данные (время съемки - taken_at, камера, GPS)
     exif_data = models.JSONField('EXIF данные', default=dict, blank=True)
 
-    # GPS из EXIF (заглушка)
+    # GPS из EXIF
     latitude = models.DecimalField('Широта', max_digits=9, decimal_places=6, null=True, blank=True)
     longitude = models.DecimalField('Долгота', max_digits=9, decimal_places=6, null=True, blank=True)
 
+    # Когда файл обработан (миниатюры, EXIF); пусто - ожидает обработки
+    processed_at = models.DateTimeField('Дата обработки', null=True, blank=True)
+
     # Метаданные
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
@@ -266,6 +383,9 @@ class VisitMedia(models.Model):
         verbose_name = 'Медиа файл визита'
         verbose_name_plural = 'Медиа файлы визитов'
         ordering = ['visit', 'created_at']
+        indexes = [
+            models.Index(fields=['processed_at']),
+        ]
 
     def __str__(self):
         return f"{self.get_media_type_display()} - {self.visit.outlet.name}"
@@ -319,3 +439,107 @@ class Sale(models.Model):
 
     def __str__(self):
         return f"{self.product.name} - {self.quantity} шт x {self.price}₽ = {self.total_amount}₽"
+
+
+class SyncOperation(models.Model):
+    """
+    Примененная операция оффлайн синхронизации (visits.sync).
+    Повтор операции с тем же id (Background Sync повторяет запросы) возвращает сохраненный результат без записи.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Исполнитель',
+        related_name='sync_operations'
+    )
+    op_id = models.CharField('ID операции', max_length=64, help_text='Генерируется клиентом')
+    visit = models.ForeignKey(
+        Visit,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name='Визит',
+        related_name='sync_operations'
+    )
+    result = models.JSONField('Результат', default=dict, blank=True)
+    created_at = models.DateTimeField('Дата применения', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Операция синхронизации'
+        verbose_name_plural = 'Операции синхронизации'
+        ordering = ['-created_at']
+        unique_together = ['user', 'op_id']
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.op_id} ({self.user_id})"
+
+
+class MediaUpload(models.Model):
+    """
+    Сессия загрузки медиа файла по частям (visits.uploads).
+    Части пишутся в хранилище по мере получения; прерванная загрузка продолжается
+    с последнего принятого байта, после последней части файл собирается
+    и проверяется по контрольной сумме.
+    """
+    STATUS_UPLOADING = 'uploading'
+    STATUS_ASSEMBLING = 'assembling'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, 'Загружается'),
+        (STATUS_ASSEMBLING, 'Сборка'),
+        (STATUS_COMPLETED, 'Загружен'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    id = models.UUIDField('ID загрузки', primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Исполнитель',
+        related_name='media_uploads'
+    )
+    visit = models.ForeignKey(
+        Visit,
+        on_delete=models.CASCADE,
+        verbose_name='Визит',
+        related_name='media_uploads'
+    )
+    media_type = models.CharField('Тип медиа', max_length=20, choices=VisitMedia.TYPE_CHOICES, default=VisitMedia.TYPE_PHOTO)
+    filename = models.CharField('Имя файла', max_length=255)
+    size = models.PositiveBigIntegerField('Размер (байт)')
+    checksum = models.CharField('SHA-256', max_length=64, help_text='Контрольная сумма всего файла (hex)')
+
+    received = models.PositiveBigIntegerField('Принято байт', default=0)
+    parts = models.JSONField('Части', default=list, blank=True, help_text='[[смещение, имя в хранилище, размер], ...]')
+    status = models.CharField('Статус', max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    error_message = models.CharField('Ошибка', max_length=255, blank=True)
+
+    # Собранный файл и медиа визита, к которому он привязан
+    file = models.FileField('Файл', upload_to='visit_media/%Y/%m/%d/', blank=True)
+    media = models.ForeignKey(
+        VisitMedia,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name='Медиа файл',
+        related_name='uploads'
+    )
+
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Загрузка медиа'
+        verbose_name_plural = 'Загрузки медиа'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'visit', 'checksum']),
+            models.Index(fields=['updated_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size})"
@@ -66,10 +66,12 @@ class VisitMediaSerializer(serializers.ModelSerializer):
     media_type_display = serializers.CharField(source='get_media_type_display', read_only=True)
     file_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    thumbnail_urls = serializers.SerializerMethodField()
 
     class Meta:
         model = VisitMedia
         fields = '__all__'
+        read_only_fields = ['thumbnail', 'thumbnails', 'processed_at']
 
     def get_visit_info(self, obj):
         return f"{obj.visit.visit_type.name} - {obj.visit.outlet.name}"
@@ -93,6 +95,14 @@ class VisitMediaSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.thumbnail.url)
         return None
 
+    def get_thumbnail_urls(self, obj):
+        """Миниатюры всех размеров {размер: URL} - для галерей и srcset вместо полного файла"""
+        request = self.context.get('request')
+        if not request or not obj.thumbnails:
+            return {}
+        storage = obj.thumbnail.storage
+        return {size: request.build_absolute_uri(storage.url(name)) for size, name in obj.thumbnails.items()}
+
 
 class SaleSerializer(serializers.ModelSerializer):
     """Serializer for Sale model"""
@@ -0,0 +1,62 @@
+"""
+Сигналы VISITS: согласованность денормализованных предков точки на визитах
+при переносе точек и узлов гео-иерархии к другому родителю; фоновая обработка
+загруженных медиа файлов (миниатюры, EXIF)
+"""
+from django.db.models.signals import pre_save, post_save
+from django.dispatch import receiver
+
+from geo.models import Region, City, District, Channel, Outlet
+from . import media_processing
+from .models import Visit, VisitMedia
+
+# Гео-модель -> (поле родителя, поле визита для выборки визитов поддерева)
+REPARENT_SCOPES = {
+    Outlet: ('channel_id', 'outlet_id'),
+    Channel: ('district_id', 'channel_id'),
+    District: ('city_id', 'district_id'),
+    City: ('region_id', 'city_id'),
+    Region: ('country_id', 'region_id'),
+}
+
+
+def geo_node_pre_save(sender, instance, raw=False, **kwargs):
+    """Отметить узел, у которого меняется родитель"""
+    instance._geo_parent_changed = False
+    if raw or not instance.pk:
+        return
+    parent_field, _ = REPARENT_SCOPES[sender]
+    old_parent = sender.objects.filter(pk=instance.pk).values_list(parent_field, flat=True).first()
+    instance._geo_parent_changed = old_parent != getattr(instance, parent_field)
+
+
+def geo_node_post_save(sender, instance, raw=False, **kwargs):
+    """Пересчитать предков на визитах поддерева перенесенного узла"""
+    if raw or not getattr(instance, '_geo_parent_changed', False):
+        return
+    _, visit_field = REPARENT_SCOPES[sender]
+    Visit.sync_geo_ancestry(Visit.objects.filter(**{visit_field: instance.pk}))
+
+
+for model in REPARENT_SCOPES:
+    pre_save.connect(geo_node_pre_save, sender=model, dispatch_uid=f'visits_geo_pre_save_{model.__name__}')
+    post_save.connect(geo_node_post_save, sender=model, dispatch_uid=f'visits_geo_post_save_{model.__name__}')
+
+
+@receiver(pre_save, sender=VisitMedia)
+def visit_media_pre_save(sender, instance, raw=False, **kwargs):
+    """Новый или замененный файл ожидает обработки"""
+    instance._file_changed = False
+    if raw or not instance.file:
+        return
+    old_file = VisitMedia.objects.filter(pk=instance.pk).values_list('file', flat=True).first() if instance.pk else None
+    if old_file != instance.file.name:
+        instance._file_changed = True
+        instance.processed_at = None
+
+
+@receiver(post_save, sender=VisitMedia)
+def visit_media_post_save(sender, instance, raw=False, **kwargs):
+    if raw or not getattr(instance, '_file_changed', False):
+        return
+    media_processing.process_in_background(instance.pk)
@@ -0,0 +1,275 @@
+"""
+Синхронизация визитов из оффлайн режима (Service Worker Background Sync)
+
+Пакет - список визитов исполнителя с данными формы, комментариями и значениями
+коэффициентов ({id коэффициента: значение}). На весь пакет:
+- визиты и коэффициенты читаются одним запросом каждый;
+- существующие наблюдения всех визитов пакета - одним запросом;
+- каждый визит записывается в своей транзакции: новые наблюдения - bulk_create,
+  измененные - bulk_update, неизменившиеся не записываются;
+- куб аналитики пересчитывается один раз на пакет (analytics.rollup.deferred_refresh).
+
+Результат - по элементу на визит пакета: ошибка одного визита (нет доступа,
+некорректное значение) не откатывает остальные.
+
+Повторы и конфликты:
+- op_id - id операции, сгенерированный клиентом. Примененная операция сохраняется
+  (SyncOperation) в одной транзакции с данными визита, повтор возвращает
+  сохраненный результат (replayed=True) без записи - весь повторенный пакет
+  стоит одного запроса;
+- base_updated_at - Visit.updated_at, с которым работал клиент (ISO 8601
+  со смещением, как его отдает сервер). Если визит изменен на сервере позже,
+  элемент возвращает конфликт (status=409, server_updated_at) вместо перезаписи.
+  Новая версия - updated_at в результате.
+"""
+import math
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from analytics import rollup
+from coefficients.models import Coefficient
+from .models import Visit, Observation, SyncOperation, to_local_date
+
+VALUE_FIELDS = ['value_numeric', 'value_boolean', 'value_text']
+
+
+class SyncError(ValueError):
+    """Пакет синхронизации нельзя принять целиком (неверный формат, слишком большой)"""
+
+
+def max_batch_size():
+    return getattr(settings, 'VISITS_SYNC_MAX_BATCH', 100)
+
+
+def observation_values(coefficient, value):
+    """Значение из оффлайн формы → поля наблюдения (None - тип коэффициента не поддерживается)"""
+    if coefficient.value_type == Coefficient.VALUE_TYPE_NUMERIC:
+        if not value:
+            return {'value_numeric': None}
+        number = float(value)
+        if not math.isfinite(number):
+            raise ValueError(value)
+        # Decimal из строки - чтобы сравнение с сохраненным значением не давало ложных изменений
+        return {'value_numeric': Decimal(str(number))}
+    if coefficient.value_type == Coefficient.VALUE_TYPE_BOOLEAN:
+        return {'value_boolean': bool(value)}
+    if coefficient.value_type == Coefficient.VALUE_TYPE_TEXT:
+        return {'value_text': str(value)}
+    return None
+
+
+def parse_items(data):
+    """Элементы пакета {"visits": [{"visit_id", "op_id", "base_updated_at", "form_data", "notes", "observations"}, ...]}"""
+    items = data.get('visits') if isinstance(data, dict) and 'visits' in data else None
+    if items is None:
+        raise SyncError('visits is required')
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise SyncError('visits must be a list of objects')
+    if len(items) > max_batch_size():
+        raise SyncError(f'Too many visits in one batch (max {max_batch_size()})')
+    return items
+
+
+def _coefficient_ids(items):
+    ids = set()
+    for item in items:
+        observations = item.get('observations') or {}
+        if isinstance(observations, dict):
+            ids.update(int(coef_id) for coef_id in observations if str(coef_id).isdigit())
+    return ids
+
+
+def _item_visit_id(item):
+    try:
+        return int(item.get('visit_id'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _item_op_id(item):
+    op_id = item.get('op_id')
+    return str(op_id) if op_id not in (None, '') else None
+
+
+class _Conflict(Exception):
+    """Визит изменен на сервере после версии, от которой шел клиент"""
+
+
+def sync_visits(user, items):
+    """Записать пакет визитов исполнителя. Возвращает результаты в порядке элементов пакета."""
+    # Уже примененные операции (повтор Background Sync) - одним запросом, без записи
+    op_ids = {op_id for op_id in map(_item_op_id, items) if op_id}
+    applied = dict(
+        SyncOperation.objects.filter(user=user, op_id__in=op_ids).values_list('op_id', 'result')
+    ) if op_ids else {}
+    pending = [item for item in items if _item_op_id(item) not in applied]
+
+    visits = Visit.objects.filter(user=user).in_bulk(
+        {visit_id for visit_id in map(_item_visit_id, pending) if visit_id is not None}
+    )
+    coefficients = Coefficient.objects.only('id', 'value_type').in_bulk(_coefficient_ids(pending))
+
+    existing = {}
+    observations = Observation.objects.filter(
+        visit_id__in=visits, coefficient_id__in=coefficients
+    ).only('id', 'visit_id', 'coefficient_id', 'data_source_type', *VALUE_FIELDS) if visits and coefficients else []
+    for observation in observations:
+        existing.setdefault((observation.visit_id, observation.coefficient_id), []).append(observation)
+
+    results = []
+    with rollup.deferred_refresh():
+        for item in items:
+            op_id = _item_op_id(item)
+            if op_id in applied:
+                results.append(dict(applied[op_id], replayed=True))
+                continue
+            visit = visits.get(_item_visit_id(item))
+            if visit is None:
+                results.append({
+                    'visit_id': item.get('visit_id'),
+                    'success': False,
+                    'status': 404,
+                    'error': 'Visit not found or access denied',
+                })
+                continue
+            result = sync_visit(visit, item, coefficients, existing)
+            if op_id and result['success']:
+                applied[op_id] = result
+            results.append(result)
+    return results
+
+
+def _conflict(visit):
+    server_updated_at = Visit.objects.filter(pk=visit.pk).values_list('updated_at', flat=True).first()
+    return {
+        'visit_id': visit.pk,
+        'success': False,
+        'status': 409,
+        'error': 'Visit was changed on the server',
+        'server_updated_at': server_updated_at.isoformat() if server_updated_at else None,
+    }
+
+
+def sync_visit(visit, item, coefficients, existing):
+    """
+    Записать один визит пакета в отдельной транзакции.
+    base_updated_at - Visit.updated_at, от которого шел клиент: если визит с тех пор
+    изменен, возвращается конфликт (409) без записи.
+    op_id - id операции клиента: записывается вместе с данными в той же транзакции.
+    """
+    op_id = _item_op_id(item)
+    if op_id and len(op_id) > SyncOperation._meta.get_field('op_id').max_length:
+        return {'visit_id': visit.pk, 'success': False, 'status': 400, 'error': 'op_id is too long'}
+
+    base_updated_at = item.get('base_updated_at')
+    if base_updated_at:
+        try:
+            base_updated_at = parse_datetime(str(base_updated_at))
+        except ValueError:
+            base_updated_at = None
+        if base_updated_at is None:
+            return {'visit_id': visit.pk, 'success': False, 'status': 400, 'error': 'Invalid base_updated_at'}
+        if timezone.is_naive(base_updated_at):
+            # Без смещения момент неоднозначен и никогда не совпадет с updated_at визита
+            return {
+                'visit_id': visit.pk, 'success': False, 'status': 400,
+                'error': 'base_updated_at must include a UTC offset',
+            }
+        if visit.updated_at != base_updated_at:
+            return _conflict(visit)
+
+    form_data = item.get('form_data') or {}
+    notes = item.get('notes') or ''
+    values = item.get('observations') or {}
+    if not isinstance(values, dict):
+        return {'visit_id': visit.pk, 'success': False, 'status': 400, 'error': 'observations must be an object'}
+
+    now = timezone.now()
+    to_create, to_update, saved, errors = [], [], [], []
+    for coef_id, value in values.items():
+        coefficient = coefficients.get(int(coef_id)) if str(coef_id).isdigit() else None
+        if coefficient is None:
+            errors.append({'coefficient_id': coef_id, 'error': 'Coefficient not found'})
+            continue
+        try:
+            obs_data = observation_values(coefficient, value)
+        except (TypeError, ValueError):
+            errors.append({'coefficient_id': coefficient.pk, 'error': f'Invalid value: {value}'})
+            continue
+        if obs_data is None:
+            continue
+
+        matches = existing.get((visit.pk, coefficient.pk), [])
+        if len(matches) > 1:
+            errors.append({'coefficient_id': coefficient.pk, 'error': 'Several observations for coefficient'})
+            continue
+        if matches:
+            observation = matches[0]
+            changed = [field for field, field_value in obs_data.items() if getattr(observation, field) != field_value]
+            for field in changed:
+                setattr(observation, field, obs_data[field])
+            if changed:
+                observation.updated_at = now
+                to_update.append(observation)
+            saved.append({'coefficient_id': coefficient.pk, 'created': False})
+        else:
+            to_create.append(Observation(
+                visit=visit, coefficient=coefficient, local_date=to_local_date(visit.start_date), **obs_data
+            ))
+            saved.append({'coefficient_id': coefficient.pk, 'created': True})
+
+    visit_fields = {'updated_at': now}
+    if form_data:
+        visit_fields['form_data'] = form_data
+    if notes:
+        visit_fields['notes'] = notes
+
+    result = {
+        'visit_id': visit.pk,
+        'success': True,
+        'op_id': op_id,
+        'updated_at': now.isoformat(),
+        'observations_saved': len(saved),
+        'created': sum(1 for entry in saved if entry['created']),
+        'updated': len(to_update),
+        'errors': errors,
+    }
+
+    try:
+        with transaction.atomic():
+            # Условный UPDATE: визит, измененный параллельно после проверки версии, не перезаписывается
+            target = Visit.objects.filter(pk=visit.pk)
+            if base_updated_at:
+                target = target.filter(updated_at=base_updated_at)
+            if not target.update(**visit_fields):
+                raise _Conflict()
+            Observation.objects.bulk_create(to_create)
+            Observation.objects.bulk_update(to_update, VALUE_FIELDS + ['updated_at'])
+            if op_id:
+                SyncOperation.objects.create(user_id=visit.user_id, op_id=op_id, visit=visit, result=result)
+    except _Conflict:
+        return _conflict(visit)
+    except IntegrityError:
+        # Та же операция параллельно применена другим запросом
+        stored = SyncOperation.objects.filter(user_id=visit.user_id, op_id=op_id).values_list('result', flat=True).first()
+        if stored is not None:
+            return dict(stored, replayed=True)
+        return {'visit_id': visit.pk, 'success': False, 'status': 500, 'error': 'Integrity error'}
+    except DatabaseError as e:
+        return {'visit_id': visit.pk, 'success': False, 'status': 500, 'error': str(e)}
+
+    for field, value in visit_fields.items():
+        setattr(visit, field, value)
+    for observation in to_create:
+        existing.setdefault((visit.pk, observation.coefficient_id), []).append(observation)
+
+    # bulk_create / bulk_update не отправляют сигналы - ячейки куба помечаются явно
+    rollup.mark_dirty({
+        rollup.cell_key(visit, observation.coefficient_id, observation.data_source_type)
+        for observation in to_create + to_update
+    })
+    return result
@@ -0,0 +1,346 @@
+"""
+Загрузка медиа файлов визитов по частям (фото / видео с мобильной сети)
+
+Протокол (api/uploads/):
+- POST - открыть сессию: визит, имя файла, размер, SHA-256 всего файла.
+  Повторное открытие того же файла (визит, размер, SHA-256) возвращает
+  незавершенную сессию - клиент, потерявший id загрузки, продолжит ее.
+- GET - состояние сессии: offset - сколько байт уже принято.
+- PUT - часть файла в теле запроса с заголовком Upload-Offset (должен быть
+  равен offset сессии, иначе 409 с текущим offset). Необязательный заголовок
+  Upload-Checksum - SHA-256 части.
+- После последней части файл собирается в хранилище медиа и проверяется
+  по SHA-256; собранный файл привязывается к VisitMedia (attach) формой
+  заполнения визита или формой загрузки медиа. Если сборка прервалась сбоем
+  хранилища, сессия снова принимает части: пустой PUT с Upload-Offset = size
+  повторяет сборку; если пропала часть - сессия failed, файл загружается заново.
+
+Части пишутся в хранилище по мере чтения тела запроса (без буферизации файла
+в памяти) и удаляются после сборки. Принятие части - условный UPDATE по offset,
+поэтому повтор той же части параллельным запросом не записывается дважды.
+"""
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import MediaUpload, Visit, VisitMedia
+
+PARTS_DIR = 'visit_media/uploads'
+CHECKSUM_RE = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadError(ValueError):
+    """Запрос загрузки отклонен (status - HTTP статус ответа)"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def chunk_size():
+    """Рекомендуемый размер части для клиента"""
+    return getattr(settings, 'VISITS_UPLOAD_CHUNK_SIZE', 1024 * 1024)
+
+
+def max_chunk_size():
+    return getattr(settings, 'VISITS_UPLOAD_MAX_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def max_file_size():
+    return getattr(settings, 'VISITS_UPLOAD_MAX_SIZE', 1024 * 1024 * 1024)
+
+
+def expire_after():
+    return timedelta(hours=getattr(settings, 'VISITS_UPLOAD_EXPIRE_HOURS', 48))
+
+
+def storage():
+    """Хранилище медиа визитов (части пишутся туда же, куда ляжет файл)"""
+    return VisitMedia._meta.get_field('file').storage
+
+
+def state(upload):
+    """Состояние сессии для клиента"""
+    return {
+        'upload_id': str(upload.pk),
+        'status': upload.status,
+        'offset': upload.received,
+        'size': upload.size,
+        'chunk_size': chunk_size(),
+        'media_id': upload.media_id,
+        'error': upload.error_message or None,
+    }
+
+
+# ============================================================================
+# Сессия
+# ============================================================================
+
+def start(user, data):
+    """Открыть сессию загрузки (или вернуть незавершенную для того же файла). Возвращает (сессия, создана)."""
+    try:
+        visit_id = int(data.get('visit_id'))
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise UploadError('visit_id and size are required')
+    checksum = str(data.get('checksum') or '').lower()
+    if not CHECKSUM_RE.match(checksum):
+        raise UploadError('checksum must be a SHA-256 hex digest')
+    if not 0 < size <= max_file_size():
+        raise UploadError(f'size must be between 1 and {max_file_size()} bytes')
+    media_type = data.get('media_type') or VisitMedia.TYPE_PHOTO
+    if media_type not in dict(VisitMedia.TYPE_CHOICES):
+        raise UploadError(f'Unknown media_type: {media_type}')
+    filename = os.path.basename(str(data.get('filename') or ''))[:255] or 'upload'
+
+    visit = Visit.objects.filter(pk=visit_id, user=user).first()
+    if visit is None:
+        raise UploadError('Visit not found or access denied', status=404)
+
+    upload = MediaUpload.objects.filter(
+        user=user, visit=visit, checksum=checksum, size=size, status=MediaUpload.STATUS_UPLOADING
+    ).order_by('-created_at').first()
+    if upload is not None:
+        return upload, False
+    upload = MediaUpload.objects.create(
+        user=user, visit=visit, media_type=media_type, filename=filename, size=size, checksum=checksum
+    )
+    return upload, True
+
+
+def get_upload(user, upload_id):
+    """Сессия загрузки исполнителя (None - нет или чужая)"""
+    try:
+        return MediaUpload.objects.filter(pk=upload_id, user=user).first()
+    except ValidationError:
+        # Некорректный UUID
+        return None
+
+
+def cancel(upload):
+    """Отменить загрузку: удалить принятые части (и недописанные оборванными запросами) и сессию"""
+    _delete_parts(upload.parts)
+    directory = f'{PARTS_DIR}/{upload.pk}'
+    try:
+        _, names = storage().listdir(directory)
+    except (OSError, NotImplementedError):
+        names = []
+    for name in names:
+        storage().delete(f'{directory}/{name}')
+    if upload.file and upload.media_id is None:
+        upload.file.delete(save=False)
+    upload.delete()
+
+
+def _delete_parts(parts):
+    for _, name, _ in parts:
+        storage().delete(name)
+
+
+# ============================================================================
+# Части
+# ============================================================================
+
+class _ChunkReader:
+    """Чтение тела запроса не больше length байт с подсчетом SHA-256"""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+        self.received = 0
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        self.received += len(data)
+        self.sha256.update(data)
+        return data
+
+
+def write_chunk(upload, stream, offset, length, checksum=None):
+    """
+    Принять часть файла из потока (тело запроса). Возвращает обновленную сессию;
+    после последней части файл собирается (assemble).
+    """
+    if upload.status != MediaUpload.STATUS_UPLOADING:
+        raise UploadError(f'Upload is {upload.status}', status=409)
+    if offset != upload.received:
+        raise UploadError(f'Expected offset {upload.received}', status=409)
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+    if length <= 0 and upload.received < upload.size:
+        raise UploadError('Empty chunk')
+    if length > max_chunk_size():
+        raise UploadError(f'Chunk is too large (max {max_chunk_size()} bytes)', status=413)
+    if offset + length > upload.size:
+        raise UploadError('Chunk exceeds file size')
+
+    if length:
+        reader = _ChunkReader(stream, length)
+        content = File(reader, name=f'{offset:012d}.part')
+        content.size = length
+        try:
+            name = storage().save(f'{PARTS_DIR}/{upload.pk}/{offset:012d}.part', content)
+        except OSError:
+            # Соединение оборвалось посреди части - клиент повторит ее с того же offset
+            raise UploadError('Incomplete chunk')
+
+        if reader.received != length:
+            storage().delete(name)
+            raise UploadError('Incomplete chunk')
+        if checksum and reader.sha256.hexdigest() != checksum.lower():
+            storage().delete(name)
+            raise UploadError('Chunk checksum mismatch')
+
+        now = timezone.now()
+        parts = upload.parts + [[offset, name, length]]
+        accepted = MediaUpload.objects.filter(
+            pk=upload.pk, status=MediaUpload.STATUS_UPLOADING, received=offset
+        ).update(received=offset + length, parts=parts, updated_at=now)
+        if not accepted:
+            # Эту часть уже принял параллельный запрос
+            storage().delete(name)
+            upload.refresh_from_db()
+            raise UploadError(f'Expected offset {upload.received}', status=409)
+        upload.received, upload.parts, upload.updated_at = offset + length, parts, now
+
+    if upload.received == upload.size:
+        assemble(upload)
+    return upload
+
+
+# ============================================================================
+# Сборка
+# ============================================================================
+
+class _AssembledFile(File):
+    """Файл из частей в хранилище: читается последовательно, с подсчетом SHA-256"""
+
+    def __init__(self, parts, name, size):
+        super().__init__(None, name=name)
+        self.parts = parts
+        self.size = size
+        self.sha256 = hashlib.sha256()
+
+    def chunks(self, chunk_size=None):
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        for _, part_name, _ in sorted(self.parts):
+            with storage().open(part_name, 'rb') as part:
+                while True:
+                    data = part.read(chunk_size)
+                    if not data:
+                        break
+                    self.sha256.update(data)
+                    yield data
+
+    def multiple_chunks(self, chunk_size=None):
+        return True
+
+    def __bool__(self):
+        return True
+
+
+def assemble(upload):
+    """Собрать файл из частей и проверить SHA-256 (сборку выполняет один запрос)"""
+    claimed = MediaUpload.objects.filter(
+        pk=upload.pk, status=MediaUpload.STATUS_UPLOADING, received=upload.size
+    ).update(status=MediaUpload.STATUS_ASSEMBLING, updated_at=timezone.now())
+    if not claimed:
+        upload.refresh_from_db()
+        return upload
+
+    file_field = MediaUpload._meta.get_field('file')
+    content = _AssembledFile(upload.parts, upload.filename, upload.size)
+    name = storage().get_available_name(file_field.generate_filename(upload, upload.filename))
+    try:
+        name = storage().save(name, content)
+    except Exception as e:
+        # Недописанный файл не нужен: сборка начнется заново
+        if storage().exists(name):
+            storage().delete(name)
+        if isinstance(e, FileNotFoundError):
+            # Часть пропала из хранилища - файл не собрать, загрузку нужно начать заново
+            _delete_parts(upload.parts)
+            fields = {'status': MediaUpload.STATUS_FAILED, 'parts': [], 'error_message': 'Upload part is missing'}
+            message, status = 'Upload part is missing, upload the file again', 422
+        else:
+            # Сбой хранилища: части на месте, сессия снова принимает запросы -
+            # пустая часть с offset = size повторит сборку
+            fields = {'status': MediaUpload.STATUS_UPLOADING, 'error_message': f'Assembly failed: {e}'}
+            message, status = 'Assembly failed, retry the last chunk', 503
+        MediaUpload.objects.filter(pk=upload.pk).update(updated_at=timezone.now(), **fields)
+        upload.refresh_from_db()
+        raise UploadError(message, status=status) from e
+
+    if content.sha256.hexdigest() != upload.checksum:
+        storage().delete(name)
+        fields = {'status': MediaUpload.STATUS_FAILED, 'error_message': 'Checksum mismatch'}
+    else:
+        fields = {'status': MediaUpload.STATUS_COMPLETED, 'file': name, 'error_message': ''}
+    # Части больше не нужны: файл собран, либо загрузку нужно начать заново
+    _delete_parts(upload.parts)
+    fields.update(parts=[], updated_at=timezone.now())
+    MediaUpload.objects.filter(pk=upload.pk).update(**fields)
+    upload.refresh_from_db()
+    if upload.status == MediaUpload.STATUS_FAILED:
+        raise UploadError('Checksum mismatch, upload the file again', status=422)
+    return upload
+
+
+# ============================================================================
+# Привязка к медиа визита
+# ============================================================================
+
+def completed_upload(user, visit, upload_id):
+    """Собранная загрузка исполнителя для визита (None - нет, не собрана или другой визит)"""
+    upload = get_upload(user, upload_id)
+    if upload is None or upload.visit_id != visit.pk or upload.status != MediaUpload.STATUS_COMPLETED:
+        return None
+    return upload
+
+
+def attach(upload, media=None, **fields):
+    """
+    Привязать собранный файл к медиа визита (без копирования файла).
+    media - несохраненный VisitMedia (форма загрузки) или None - создать по полям сессии.
+    Повторная привязка возвращает уже созданное медиа.
+    """
+    if upload.media_id:
+        return upload.media
+    if media is None:
+        media = VisitMedia(visit=upload.visit, media_type=upload.media_type, **fields)
+    media.file.name = upload.file.name
+    with transaction.atomic():
+        media.save()
+        if not MediaUpload.objects.filter(pk=upload.pk, media__isnull=True).update(media=media):
+            # Параллельный запрос уже привязал файл
+            transaction.set_rollback(True)
+            upload.refresh_from_db()
+            return upload.media
+    upload.media = media
+    return media
+
+
+def prune(now=None):
+    """
+    Удалить сессии без активности дольше VISITS_UPLOAD_EXPIRE_HOURS: брошенные -
+    вместе с частями и непривязанным файлом, привязанные к медиа - только запись сессии.
+    """
+    cutoff = (now or timezone.now()) - expire_after()
+    stale = MediaUpload.objects.filter(updated_at__lt=cutoff)
+    count, _ = stale.filter(media__isnull=False).delete()
+    for upload in stale.filter(media__isnull=True).iterator():
+        cancel(upload)
+        count += 1
+    return count
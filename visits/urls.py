@@ -40,4 +40,9 @@ urlpatterns = [
 
     # API для Background Sync
     path('api/sync/', views.sync_visit_api, name='sync_visit_api'),
+    path('api/sync/batch/', views.sync_visits_batch_api, name='sync_visits_batch_api'),
+
+    # API загрузки медиа по частям
+    path('api/uploads/', views.media_upload_api, name='media_upload_api'),
+    path('api/uploads/<uuid:upload_id>/', views.media_upload_detail_api, name='media_upload_detail_api'),
 ]
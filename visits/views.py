@@ -8,6 +8,7 @@ from django.utils import timezone
 import json
 
 from .models import VisitType, Visit, Observation, VisitMedia
+from . import sync, uploads
 from .forms import VisitTypeForm, VisitForm, ObservationForm, VisitMediaForm
 from core.validation import VisitValidator, ObservationValidator
 
@@ -288,7 +289,18 @@ class VisitMediaCreateView(LoginRequiredMixin, CreateView):
     form_class = VisitMediaForm
     success_url = reverse_lazy('visits:visitmedia_list')
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = self.request.user
+        return kwargs
+
     def form_valid(self, form):
+        upload = form.cleaned_data.get('upload')
+        if upload:
+            # Файл уже собран в хранилище (загрузка по частям) - привязать без копирования
+            self.object = uploads.attach(upload, media=form.instance)
+            messages.success(self.request, f'Media file uploaded successfully.')
+            return redirect(self.get_success_url())
         messages.success(self.request, f'Media file uploaded successfully.')
         return super().form_valid(form)
 
@@ -358,6 +370,10 @@ def fill_visit(request, pk):
                 if field_type == 'image':
                     # Обработать загрузку файла
                     file = request.FILES.get(field_name)
+                    # Файл, загруженный по частям (api/uploads/): id загрузки в поле <имя>_upload
+                    upload = uploads.completed_upload(
+                        request.user, visit, request.POST.get(f'{field_name}_upload')
+                    ) if not file and request.POST.get(f'{field_name}_upload') else None
                     if file:
                         # Создать VisitMedia
                         media = VisitMedia.objects.create(
@@ -367,6 +383,9 @@ def fill_visit(request, pk):
                             title=field.get('label', field_name)
                         )
                         form_data[field_name] = f"media_{media.id}"
+                    elif upload:
+                        media = uploads.attach(upload, title=field.get('label', field_name))
+                        form_data[field_name] = f"media_{media.id}"
                 elif field_type == 'boolean':
                     form_data[field_name] = request.POST.get(field_name) == 'on'
                 else:
@@ -477,9 +496,6 @@ def sync_visit_api(request):
         data = json.loads(request.body.decode('utf-8'))
 
         visit_id = data.get('visit_id')
-        form_data = data.get('form_data', {})
-        observations = data.get('observations', {})
-        notes = data.get('notes', '')
 
         if not visit_id:
             return JsonResponse({
@@ -487,61 +503,24 @@ def sync_visit_api(request):
                 'error': 'visit_id is required'
             }, status=400)
 
-        # Получить визит
-        try:
-            visit = Visit.objects.get(pk=visit_id, user=request.user)
-        except Visit.DoesNotExist:
-            return JsonResponse({
+        # Визит, наблюдения (одним запросом коэффициентов) - в одной транзакции;
+        # op_id и base_updated_at - защита от повторов и конфликтов (см. visits.sync)
+        result = sync.sync_visits(request.user, [data])[0]
+        if not result['success']:
+            response = {
                 'success': False,
-                'error': 'Visit not found or access denied'
-            }, status=404)
-
-        # Обновить данные визита
-        if form_data:
-            visit.form_data = form_data
-
-        if notes:
-            visit.notes = notes
-
-        visit.save()
-
-        # Сохранить наблюдения
-        saved_observations = []
-        for coef_id, value in observations.items():
-            try:
-                from coefficients.models import Coefficient
-                coefficient = Coefficient.objects.get(pk=int(coef_id))
-
-                # Определить тип значения
-                if coefficient.value_type == 'numeric':
-                    obs_data = {'value_numeric': float(value) if value else None}
-                elif coefficient.value_type == 'boolean':
-                    obs_data = {'value_boolean': bool(value)}
-                elif coefficient.value_type == 'text':
-                    obs_data = {'value_text': str(value)}
-                else:
-                    continue
-
-                # Создать или обновить наблюдение
-                observation, created = Observation.objects.update_or_create(
-                    visit=visit,
-                    coefficient=coefficient,
-                    defaults=obs_data
-                )
-
-                saved_observations.append({
-                    'coefficient_id': int(coef_id),
-                    'created': created
-                })
-            except Exception as e:
-                # Логировать ошибку, но продолжить
-                print(f"Error saving observation for coefficient {coef_id}: {e}")
-                continue
+                'error': result['error']
+            }
+            if 'server_updated_at' in result:
+                response['server_updated_at'] = result['server_updated_at']
+            return JsonResponse(response, status=result['status'])
 
         return JsonResponse({
             'success': True,
-            'visit_id': visit.id,
-            'observations_saved': len(saved_observations),
+            'visit_id': result['visit_id'],
+            'observations_saved': result['observations_saved'],
+            'updated_at': result['updated_at'],
+            'replayed': result.get('replayed', False),
             'synced_at': timezone.now().isoformat()
         })
 
@@ -558,6 +537,122 @@ def sync_visit_api(request):
         }, status=500)
 
 
+@csrf_exempt
+@require_http_methods(["POST"])
+def sync_visits_batch_api(request):
+    """
+    API endpoint для пакетной синхронизации визитов из оффлайн режима.
+    Принимает {"visits": [{"visit_id", "op_id", "base_updated_at", "form_data", "notes", "observations"}, ...]},
+    каждый визит записывается в своей транзакции; ответ - результат по каждому визиту.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Authentication required'
+        }, status=401)
+
+    try:
+        items = sync.parse_items(json.loads(request.body.decode('utf-8')))
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON'
+        }, status=400)
+    except sync.SyncError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=400)
+
+    results = sync.sync_visits(request.user, items)
+    return JsonResponse({
+        'success': all(result['success'] for result in results),
+        'results': results,
+        'synced_at': timezone.now().isoformat()
+    })
+
+
+def _upload_response(upload, status=200):
+    return JsonResponse(dict(uploads.state(upload), success=True), status=status)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def media_upload_api(request):
+    """
+    API endpoint для открытия загрузки медиа по частям.
+    Принимает {"visit_id", "filename", "size", "checksum" (SHA-256), "media_type"};
+    для уже начатой загрузки того же файла возвращает ее состояние (offset).
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Authentication required'
+        }, status=401)
+
+    try:
+        upload, created = uploads.start(request.user, json.loads(request.body.decode('utf-8')))
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON'
+        }, status=400)
+    except uploads.UploadError as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=e.status)
+    return _upload_response(upload, status=201 if created else 200)
+
+
+@csrf_exempt
+@require_http_methods(["GET", "PUT", "DELETE"])
+def media_upload_detail_api(request, upload_id):
+    """
+    API endpoint загрузки медиа по частям:
+    GET - состояние (offset), PUT - часть файла в теле запроса (заголовки Upload-Offset,
+    Upload-Checksum), DELETE - отменить загрузку.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'success': False,
+            'error': 'Authentication required'
+        }, status=401)
+
+    upload = uploads.get_upload(request.user, upload_id)
+    if upload is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'Upload not found'
+        }, status=404)
+
+    if request.method == 'GET':
+        return _upload_response(upload)
+    if request.method == 'DELETE':
+        uploads.cancel(upload)
+        return JsonResponse({'success': True})
+
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+        length = int(request.META['CONTENT_LENGTH']) if request.META.get('CONTENT_LENGTH') else None
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'Upload-Offset and Content-Length must be integers'
+        }, status=400)
+    try:
+        # Тело запроса читается потоком прямо в хранилище (request.body не используется)
+        upload = uploads.write_chunk(
+            upload, request, offset, length, checksum=request.headers.get('Upload-Checksum')
+        )
+    except uploads.UploadError as e:
+        upload.refresh_from_db()
+        return JsonResponse(dict(
+            uploads.state(upload), success=False, error=str(e)
+        ), status=e.status)
+    return _upload_response(upload)
+
+
 # ============================================================================
 # Начать визит сейчас (Start Visit Now)
 # ============================================================================